@@ -4,14 +4,26 @@
 
 __all__ = [
     'admin',
+    'analytics',
+    'apps',
+    'bulk',
+    'caching',
     'constants',
     'forms',
+    'indexes',
     'managers',
+    'matching',
     'mixins',
     'models',
     'serializers',
+    'signals',
+    'snapshot',
+    'stats',
+    'streaming',
     'views',
     'urls',
 ]
 
+default_app_config = 'questions.apps.QuestionsConfig'
+
 __version__ = '0.5'
@@ -80,9 +80,16 @@ class QuestionAdmin(admin.ModelAdmin):
         'possible_answer_count',
         'all_answer_count',
     )
+    list_select_related = ('category', 'submitted_by__user')
 
     inlines = [PossibleAnswerInline, AnswerInline]
 
+    def get_queryset(self, request):
+        """
+        Count answers for the whole changelist at once.
+        """
+        return Question.objects.with_stats()
+
     def change_view(self, request, object_id, form_url='', extra_context=None):
         extra_context = extra_context or {}
         return super(QuestionAdmin, self).change_view(
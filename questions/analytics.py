@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.analytics` -- anonymized answer datasets for offline use.
+
+A dataset is a single compressed `.npz` file that holds nothing but numpy
+arrays, so it loads with `numpy.load` without Django, the database or
+pickle.
+
+Profiles are anonymous. They appear as rows in random order, with only
+their gender, the gender they look for and an age bucket, all integer
+coded. Neither ids, usernames nor dates of birth are written.
+
+Answers form a sparse matrix of profiles by questions in coordinate
+format, one entry per public answer. Answers their users chose to keep
+private are left out, as are answers of profiles and questions created
+while the dataset is collected:
+
+`answer_row`, `answer_column`
+    Row (profile) and column (question) of the answer.
+`answer`
+    Position of the users answer within the question, or `UNANSWERED`.
+`importance`
+    Importance code, see :data:`question.matching.IMPORTANCE_CODES`.
+`acceptable`
+    Bitmask of acceptable positions, 0 if any answer is acceptable.
+
+For example `scipy.sparse.coo_matrix((answer + 1, (answer_row,
+answer_column)))` rebuilds the answers as a sparse matrix.
+
+Questions are described by `question_ids` and `question_text` for every
+column, and their possible answers by `possible_answer_column`,
+`possible_answer_position`, `possible_answer_text` and
+`possible_answer_value`. Codes are explained by the `*_labels` arrays.
+"""
+
+import logging
+from datetime import date
+
+import numpy as np
+
+from .constants import GENDER_CHOICES
+from .constants import IMPORTANCE_CHOICES
+from .constants import LOOKFOR_CHOICES
+from .constants import MAX_POSSIBLE_ANSWERS
+from .matching import IMPORTANCE_CODES
+from .matching import UNANSWERED
+from .matching import _lookup
+from .models import Answer
+from .models import PossibleAnswer
+from .models import Profile
+from .models import Question
+from .stats import chunks
+
+logger = logging.getLogger(__name__)
+
+AGE_BUCKETS = (18, 25, 35, 45, 55, 65)
+"""
+Lower bounds of the age buckets. Bucket 0 is younger than the first bound,
+profiles without a date of birth are in bucket -1.
+"""
+
+GENDER_CODES = dict((key, code) for code, (key, label) in enumerate(
+    GENDER_CHOICES
+))
+"""Map `Profile.gender` to its code."""
+
+LOOKFOR_CODES = dict((key, code) for code, (key, label) in enumerate(
+    LOOKFOR_CHOICES
+))
+"""Map `Profile.lookfor` to its code."""
+
+
+def age_bucket(dob, today):
+    """
+    :rtype: the age bucket of somebody born on `dob`, see `AGE_BUCKETS`.
+    """
+    if dob is None:
+        return -1
+    age = today.year - dob.year - (
+        (today.month, today.day) < (dob.month, dob.day)
+    )
+    return int(np.searchsorted(AGE_BUCKETS, age, side='right'))
+
+
+def _labels(choices):
+    return np.array([u'%s' % label for key, label in choices])
+
+
+def dataset(chunk_size=10000, seed=None):
+    """
+    .. function:: dataset(chunk_size=10000, seed=None)
+
+    Collect the arrays of a dataset, see :mod:`question.analytics`.
+
+    Answers are streamed from the database in chunks of `chunk_size` rows
+    and stored in compact arrays right away, so memory use stays at a few
+    bytes per answer.
+
+    :param seed: seed of the random order of profiles.
+    :rtype: dict `name -> numpy array`.
+    """
+    today = date.today()
+    profiles = list(Profile.objects.values_list(
+        'pk', 'gender', 'lookfor', 'dob'
+    ).order_by('pk'))
+    profile_ids = np.array([row[0] for row in profiles], dtype=np.int64)
+    order = np.random.RandomState(seed).permutation(len(profiles))
+    """Profile `profile_ids[i]` is anonymous row `order[i]`."""
+    gender = np.zeros(len(profiles), dtype=np.int8)
+    lookfor = np.zeros(len(profiles), dtype=np.int8)
+    age = np.zeros(len(profiles), dtype=np.int8)
+    gender[order] = [GENDER_CODES.get(row[1], 0) for row in profiles]
+    lookfor[order] = [LOOKFOR_CODES.get(row[2], 0) for row in profiles]
+    age[order] = [age_bucket(row[3], today) for row in profiles]
+    del profiles
+
+    questions = list(
+        Question.objects.values_list('pk', 'question').order_by('pk')
+    )
+    question_ids = np.array([row[0] for row in questions], dtype=np.int64)
+    question_text = np.array([row[1] for row in questions], dtype=np.str_)
+    del questions
+
+    positions = {}
+    counts = {}
+    possible_answers = []
+    for pk, question_id, text, value in PossibleAnswer.objects.values_list(
+            'pk', 'question_id', 'answer', 'value').order_by('pk'):
+        position = counts.get(question_id, 0)
+        counts[question_id] = position + 1
+        positions[pk] = position
+        possible_answers.append((question_id, position, text, int(value)))
+
+    parts = []
+    rows = Answer.objects.filter(is_public=True).values_list(
+        'profile_id', 'question_id', 'user_answer_id', 'importance',
+        'acceptable_mask'
+    ).order_by().iterator()
+    for chunk in chunks(rows, chunk_size):
+        row, found = _lookup(profile_ids, [r[0] for r in chunk])
+        column, found_column = _lookup(question_ids, [r[1] for r in chunk])
+        found &= found_column
+        position = np.array([
+            positions.get(r[2], UNANSWERED) for r in chunk
+        ], dtype=np.int64)
+        position[position >= MAX_POSSIBLE_ANSWERS] = UNANSWERED
+        parts.append((
+            order[row[found]].astype(np.int32),
+            column[found].astype(np.int32),
+            position[found].astype(np.int8),
+            np.array([
+                IMPORTANCE_CODES.get(r[3], 0) for r in chunk
+            ], dtype=np.int8)[found],
+            np.array(
+                [r[4] for r in chunk], dtype=np.int64
+            ).astype(np.uint32)[found],
+        ))
+    names = (
+        'answer_row', 'answer_column', 'answer', 'importance', 'acceptable'
+    )
+    dtypes = (np.int32, np.int32, np.int8, np.int8, np.uint32)
+    answers = dict(
+        (name, np.concatenate([part[i] for part in parts])
+         if parts else np.zeros(0, dtype=dtype))
+        for i, (name, dtype) in enumerate(zip(names, dtypes))
+    )
+    del parts
+    """Sort by row and column, so the rows of a profile are adjacent."""
+    sort = np.lexsort((answers['answer_column'], answers['answer_row']))
+    for name in names:
+        answers[name] = answers[name][sort]
+
+    column, found = _lookup(
+        question_ids, [row[0] for row in possible_answers]
+    )
+    possible_answers = [
+        row for row, exists in zip(possible_answers, found.tolist())
+        if exists
+    ]
+    result = dict(
+        gender=gender,
+        lookfor=lookfor,
+        age_bucket=age,
+        question_ids=question_ids,
+        question_text=question_text,
+        possible_answer_column=column[found].astype(np.int32),
+        possible_answer_position=np.array(
+            [row[1] for row in possible_answers], dtype=np.int16
+        ),
+        possible_answer_text=np.array(
+            [row[2] for row in possible_answers], dtype=np.str_
+        ),
+        possible_answer_value=np.array(
+            [row[3] for row in possible_answers], dtype=np.int8
+        ),
+        gender_labels=_labels(GENDER_CHOICES),
+        lookfor_labels=_labels(LOOKFOR_CHOICES),
+        importance_labels=_labels(IMPORTANCE_CHOICES),
+        age_buckets=np.array(AGE_BUCKETS, dtype=np.int16),
+    )
+    result.update(answers)
+    return result
+
+
+def write_dataset(path, chunk_size=10000, seed=None):
+    """
+    .. function:: write_dataset(path, chunk_size=10000, seed=None)
+
+    Write a compressed dataset to `path`.
+
+    .. seealso:: :mod:`question.analytics.dataset`
+
+    :rtype: dict `name -> numpy array`, as written.
+    """
+    arrays = dataset(chunk_size, seed)
+    np.savez_compressed(path, **arrays)
+    return arrays
+
+# vim: ts=4 et sw=4 sts=4
@@ -6,10 +6,23 @@
 
 """
 
-from rest_framework import viewsets
+from django.http import Http404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.utils.translation import gettext_lazy as _
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from questions.serializers import AnswerRecordSerializer
 from questions.serializers import QuestionSerializer
 from questions.serializers import CategorySerializer
+from questions.serializers import MatchSerializer
 from category.models import Category
+from .bulk import bulk_answer
+from .caching import category_api_etag, question_api_etag
+from .caching import possible_answer_ids
+from .matching import best_matches
+from .mixins import MatchQueryMixin, get_match_profile
 from .models import Question
 
 
@@ -17,9 +30,19 @@ class QuestionViewSet(viewsets.ModelViewSet):
     """
     API View for Questions
     """
-    queryset = Question.objects.all()
+    queryset = Question.objects.with_stats()
     serializer_class = QuestionSerializer
 
+    @method_decorator(condition(etag_func=question_api_etag))
+    def list(self, request, *args, **kwargs):
+        return super(QuestionViewSet, self).list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=question_api_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super(QuestionViewSet, self).retrieve(
+            request, *args, **kwargs
+        )
+
 
 class CategoryViewSet(viewsets.ModelViewSet):
     """
@@ -27,4 +50,93 @@ class CategoryViewSet(viewsets.ModelViewSet):
     """
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+
+    @method_decorator(condition(etag_func=category_api_etag))
+    def list(self, request, *args, **kwargs):
+        return super(CategoryViewSet, self).list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=category_api_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super(CategoryViewSet, self).retrieve(
+            request, *args, **kwargs
+        )
+
+
+class MatchViewSet(MatchQueryMixin, mixins.ListModelMixin,
+                   viewsets.GenericViewSet):
+    """
+    API View for the best matches of the current user.
+
+    Accepts `k`, `min_age` and `max_age` in the query string.
+    """
+    serializer_class = MatchSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = None
+
+    def get_queryset(self):
+        profile = get_match_profile(self.request)
+        if profile is None:
+            raise Http404
+        return best_matches(profile, **self.get_match_kwargs())
+
+
+class AnswerBatchViewSet(viewsets.GenericViewSet):
+    """
+    API View to answer many questions at once for the current user.
+
+    Accepts a list of up to `max_answers` answers, see
+    :mod:`question.serializers.AnswerRecordSerializer`.
+    """
+    serializer_class = AnswerRecordSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    max_answers = 100
+    """Upper limit for answers in one request."""
+
+    def get_possible_answers(self):
+        """
+        Load the possible answers of all questions in the request at once,
+        and only once per request.
+        """
+        if not hasattr(self, '_possible_answers'):
+            question_ids = []
+            if isinstance(self.request.data, list):
+                for record in self.request.data[:self.max_answers]:
+                    try:
+                        question_ids.append(int(record['question']))
+                    except (KeyError, TypeError, ValueError):
+                        pass
+            self._possible_answers = possible_answer_ids(question_ids)
+        return self._possible_answers
+
+    def get_serializer_context(self):
+        context = super(AnswerBatchViewSet, self).get_serializer_context()
+        context['possible_answers'] = self.get_possible_answers()
+        return context
+
+    def create(self, request, *args, **kwargs):
+        profile = get_match_profile(request)
+        if profile is None:
+            raise Http404
+        if not isinstance(request.data, list):
+            raise ValidationError(_('Expected a list of answers.'))
+        if len(request.data) > self.max_answers:
+            raise ValidationError(
+                _('At most %d answers at once.') % self.max_answers
+            )
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        question_ids = [
+            record['question'] for record in serializer.validated_data
+        ]
+        if len(set(question_ids)) != len(question_ids):
+            raise ValidationError(_('Every question may be answered once.'))
+        created, updated = bulk_answer(
+            profile, serializer.validated_data, self.get_possible_answers()
+        )
+        return Response(
+            {'created': created, 'updated': updated},
+            status=status.HTTP_201_CREATED
+        )
+
 # vim: ts=4 et sw=4 sts=4
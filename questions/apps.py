@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.apps` -- application configuration
+"""
+
+from django.apps import AppConfig
+
+
+class QuestionsConfig(AppConfig):
+    """
+    .. class:: QuestionsConfig
+
+    Connects the signal handlers in :mod:`question.signals` once the
+    application is ready.
+    """
+    name = 'questions'
+
+    def ready(self):
+        from . import signals  # noqa
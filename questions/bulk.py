@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.bulk` -- answer many questions at once.
+
+New answers are written with `bulk_create`, changed answers with one
+`UPDATE` per chunk of answers, and their acceptable answers with one
+`DELETE` and one `bulk_create` on the many to many table. As no signals
+are sent for any of those, everything :mod:`question.signals` keeps in
+sync is updated here, once for all answers.
+"""
+
+import logging
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from . import stats
+from .caching import bump_profile_version
+from .caching import bump_question_version
+from .caching import possible_answer_ids
+from .constants import MAX_POSSIBLE_ANSWERS
+from .matching import rescore_later
+from .models import Answer
+from .models import Question
+from .snapshot import log_answer
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('importance', 'is_public', 'description')
+"""Fields of an answer that may be given for every record."""
+
+UPDATE_CHUNK_SIZE = 50
+"""Answers changed per `UPDATE`, within the 999 parameters of SQLite."""
+
+
+def _mask(positions, ids):
+    """
+    :rtype: the acceptable answer mask of the possible answers `ids`, at
+            their `positions`.
+    """
+    mask = 0
+    for pk in ids:
+        position = positions.index(pk)
+        if position < MAX_POSSIBLE_ANSWERS:
+            mask |= 1 << position
+    return mask
+
+
+def _case(answers, name, output_field):
+    """
+    :rtype: expression giving every answer in `answers` its value of `name`,
+            and leaving every other answer unchanged.
+    """
+    return Case(*[
+        When(pk=answer.pk, then=Value(getattr(answer, name)))
+        for answer in answers
+    ], default=F(name), output_field=output_field)
+
+
+def _update(answers, fields):
+    """
+    Write `fields` of `answers` with one `UPDATE` per chunk.
+    """
+    output_fields = dict(
+        (name, Answer._meta.get_field(name).clone())
+        for name in fields if name != 'user_answer_id'
+    )
+    output_fields['user_answer_id'] = models.IntegerField()
+    now = timezone.now()
+    for start in range(0, len(answers), UPDATE_CHUNK_SIZE):
+        chunk = answers[start:start + UPDATE_CHUNK_SIZE]
+        Answer.objects.filter(pk__in=[answer.pk for answer in chunk]).update(
+            when=now,
+            **dict(
+                (name, _case(chunk, name, output_fields[name]))
+                for name in fields
+            )
+        )
+
+
+def _upsert(profile, new):
+    """
+    Write the `(answer, record)` pairs of `new` one by one.
+
+    :rtype: list of the answers created.
+    """
+    questions = Question.objects.in_bulk([
+        answer.question_id for answer, record in new
+    ])
+    created = []
+    for answer, record in new:
+        answer, was_created = Answer.objects.upsert(
+            profile,
+            questions[answer.question_id],
+            user_answer=record.get('user_answer'),
+            acceptable_answer=record.get('acceptable_answer', ()),
+            **dict(
+                (name, record[name]) for name in FIELDS if name in record
+            )
+        )
+        if was_created:
+            created.append(answer)
+    return created
+
+
+def bulk_answer(profile, records, possible_answers=None):
+    """
+    .. function:: bulk_answer(profile, records, possible_answers=None)
+
+    Answer many questions for `profile` in one transaction.
+
+    :param records: list of dicts with `question`, `user_answer` and
+                    `acceptable_answer` as ids, and optionally the `FIELDS`.
+                    Every question may be answered only once, and the
+                    answers must have been validated against
+                    `possible_answers`.
+    :param possible_answers: the possible answers of the questions, as
+                             returned by
+                             :mod:`question.caching.possible_answer_ids`,
+                             loaded if not given.
+
+    Questions answered by a concurrent request in the meantime are updated
+    with :mod:`question.managers.AnswerManager.upsert` instead. Matches are
+    rescored once for all questions, after the transaction committed.
+
+    :rtype: `(created, updated)`, the number of answers created and updated.
+    """
+    question_ids = [record['question'] for record in records]
+    if possible_answers is None:
+        possible_answers = possible_answer_ids(question_ids)
+    Through = Answer.acceptable_answer.through
+    with transaction.atomic():
+        existing = dict(
+            (answer.question_id, answer)
+            for answer in Answer.objects.select_for_update().filter(
+                profile=profile, question__in=question_ids
+            )
+        )
+        accepted = {}
+        for answer_id, pk in Through.objects.filter(
+                answer__in=[answer.pk for answer in existing.values()]
+        ).values_list('answer_id', 'possibleanswer_id'):
+            accepted.setdefault(answer_id, set()).add(pk)
+
+        new = []
+        changed = []
+        fields = set(['user_answer_id', 'acceptable_mask'])
+        user_answers = ([], [])
+        acceptable = ([], [])
+        accept_all = ([], [])
+        through = []
+        for record in records:
+            question_id = record['question']
+            ids = record.get('acceptable_answer', ())
+            answer = existing.get(question_id)
+            if answer is None:
+                answer = Answer(profile=profile, question_id=question_id)
+                new.append((answer, record))
+            else:
+                changed.append(answer)
+                old = answer.user_answer_id
+                if old != record.get('user_answer'):
+                    if old is not None:
+                        user_answers[0].append(old)
+                    if record.get('user_answer') is not None:
+                        user_answers[1].append(record['user_answer'])
+                old = accepted.get(answer.pk, set())
+                acceptable[0].extend(old - set(ids))
+                acceptable[1].extend(set(ids) - old)
+                through.extend(
+                    Through(answer_id=answer.pk, possibleanswer_id=pk)
+                    for pk in set(ids) - old
+                )
+            answer.user_answer_id = record.get('user_answer')
+            mask = _mask(possible_answers[question_id], ids)
+            if answer.pk is not None and \
+                    bool(answer.acceptable_mask) != bool(mask):
+                accept_all[0 if mask else 1].append(question_id)
+            answer.acceptable_mask = mask
+            for name in FIELDS:
+                if name in record:
+                    setattr(answer, name, record[name])
+                    fields.add(name)
+
+        if changed:
+            _update(changed, sorted(fields))
+            if acceptable[0]:
+                Through.objects.filter(
+                    answer__in=[answer.pk for answer in changed],
+                    possibleanswer__in=acceptable[0]
+                ).delete()
+            Through.objects.bulk_create(through)
+            stats.answers_updated(
+                profile, user_answers, acceptable, accept_all
+            )
+
+        created = [answer for answer, record in new]
+        if created:
+            try:
+                with transaction.atomic():
+                    Answer.objects.bulk_create(created)
+            except IntegrityError:
+                """
+                Answered by a concurrent request in the meantime. The
+                signals of `upsert` take care of everything else.
+                """
+                created = _upsert(profile, new)
+            else:
+                """Primary keys are not set by `bulk_create` everywhere."""
+                pks = dict(Answer.objects.filter(
+                    profile=profile,
+                    question__in=[answer.question_id for answer in created]
+                ).values_list('question_id', 'pk'))
+                for answer in created:
+                    answer.pk = pks[answer.question_id]
+                Through.objects.bulk_create([
+                    Through(answer_id=answer.pk, possibleanswer_id=pk)
+                    for answer, record in new
+                    for pk in record.get('acceptable_answer', ())
+                ])
+                stats.answers_created(profile, created, [
+                    pk for answer, record in new
+                    for pk in record.get('acceptable_answer', ())
+                ])
+                changed.extend(created)
+
+        bump_profile_version(profile.pk)
+        for question_id in question_ids:
+            bump_question_version(question_id)
+        for answer in changed:
+            log_answer(answer)
+        rescore_later(profile.pk, question_ids)
+    return len(created), len(records) - len(created)
+
+# vim: ts=4 et sw=4 sts=4
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.caching` -- version stamped caching.
+
+Instead of deleting cached values when the data they were computed from
+changes, every cached value is keyed with the current version of its data.
+Changing the data bumps the version, after which the old values are never
+looked up again and simply expire from the cache.
+
+Versions start at the current time in milliseconds rather than at 1, so a
+version that was evicted from the cache does not start over at a value
+that old entries are still keyed with.
+
+Versions are bumped once the transaction changing the data commits, see
+:func:`bump_version_later`. Bumped any earlier, a concurrent request could
+still read the old data and cache it with the new version.
+
+The same versions make up the ETags of question pages and API endpoints,
+for use with :func:`django.views.decorators.http.condition`.
+
+Uses the `default` cache of Django's cache framework.
+"""
+
+import copy
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import PossibleAnswer
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 'questions:profile-version:%s'
+QUESTION_VERSION = 'questions:question-version:%s'
+QUESTIONS_VERSION = 'questions:questions-version'
+CATEGORIES_VERSION = 'questions:categories-version'
+POSSIBLE_ANSWERS_VERSION = 'questions:possible-answers-version:%s'
+POSSIBLE_ANSWERS = 'questions:possible-answers:%s:%s'
+MATCH = 'questions:match:%s:%s:%s:%s'
+
+
+def _initial_version():
+    return int(time.time() * 1000)
+
+
+def get_versions(keys):
+    """
+    :rtype: dict `key -> version` for all version `keys`, in one round trip.
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def bump_version(key):
+    """
+    Increment the version `key`, making everything cached with it stale.
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        """Not cached (anymore)."""
+        cache.set(key, _initial_version(), None)
+
+
+class _Bump(object):
+    """
+    Callback of `bump_version_later`, collecting the versions bumped within
+    one transaction.
+    """
+
+    def __init__(self):
+        self.keys = set()
+
+    def __call__(self):
+        for key in sorted(self.keys):
+            bump_version(key)
+
+
+def bump_version_later(key):
+    """
+    .. function:: bump_version_later(key)
+
+    Increment the version `key` once the current transaction commits, or
+    right away outside of transactions.
+
+    Every version is bumped once, however often it is bumped within a
+    transaction. Like with :mod:`question.matching.rescore_later`,
+    callbacks dropped by the rollback of a savepoint take the versions
+    added to them along.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for sids, callback in connection.run_on_commit:
+            if isinstance(callback, _Bump):
+                callback.keys.add(key)
+                return
+    callback = _Bump()
+    callback.keys.add(key)
+    transaction.on_commit(callback)
+
+
+def bump_profile_version(profile_id):
+    """
+    The answers of profile `profile_id` changed.
+    """
+    bump_version_later(PROFILE_VERSION % profile_id)
+
+
+def question_version(question_id):
+    """
+    :rtype: the current version of the answers to question `question_id`.
+    """
+    key = QUESTION_VERSION % question_id
+    return get_versions([key])[key]
+
+
+def bump_question_version(question_id):
+    """
+    The question `question_id` or its answers changed.
+    """
+    bump_version_later(QUESTION_VERSION % question_id)
+    bump_version_later(QUESTIONS_VERSION)
+
+
+def bump_possible_answers_version(question_id):
+    """
+    The possible answers of question `question_id` changed.
+    """
+    bump_version_later(POSSIBLE_ANSWERS_VERSION % question_id)
+
+
+def bump_categories_version():
+    """
+    Any category changed.
+    """
+    bump_version_later(CATEGORIES_VERSION)
+
+
+def possible_answer_ids(question_ids):
+    """
+    .. function:: possible_answer_ids(question_ids)
+
+    The possible answers of many questions, cached until the possible
+    answers of a question change. Answering a question does not.
+
+    :rtype: dict `question id -> list of possible answer ids`, in the order
+            of their positions. Unknown questions have no possible answers.
+    """
+    question_ids = list(set(question_ids))
+    versions = get_versions([
+        POSSIBLE_ANSWERS_VERSION % pk for pk in question_ids
+    ])
+    keys = dict(
+        (pk, POSSIBLE_ANSWERS % (pk, versions[POSSIBLE_ANSWERS_VERSION % pk]))
+        for pk in question_ids
+    )
+    cached = cache.get_many(list(keys.values()))
+    result = {}
+    missing = []
+    for pk, key in keys.items():
+        if key in cached:
+            result[pk] = cached[key]
+        else:
+            missing.append(pk)
+            result[pk] = []
+    if missing:
+        for pk, question_id in PossibleAnswer.objects.filter(
+                question__in=missing).order_by('pk').values_list(
+                'pk', 'question_id'):
+            result[question_id].append(pk)
+        cache.set_many(
+            dict((keys[pk], result[pk]) for pk in missing),
+            fragment_timeout()
+        )
+    return result
+
+
+def fragment_timeout():
+    """
+    :rtype: how long template fragments keyed with a version are cached,
+            the `QUESTIONS_FRAGMENT_CACHE_TIMEOUT` setting (default: one
+            day).
+    """
+    return getattr(settings, 'QUESTIONS_FRAGMENT_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def etag(*parts):
+    """
+    :rtype: a strong ETag for a response built from `parts`.
+    """
+    return hashlib.md5(
+        u':'.join(u'%s' % part for part in parts).encode('utf-8')
+    ).hexdigest()
+
+
+def question_etag(request, pk, *args, **kwargs):
+    """
+    ETag of the page of question `pk` for the current user.
+    """
+    return etag(
+        'question', pk, question_version(pk), request.user.pk,
+        request.get_full_path()
+    )
+
+
+def question_api_etag(request, *args, **kwargs):
+    """
+    ETag of the question API, for a single question if `pk` is given.
+
+    Questions are serialized with the title of their category, so the
+    version of the categories is part of it as well.
+    """
+    pk = kwargs.get('pk')
+    if pk is None:
+        key = QUESTIONS_VERSION
+    else:
+        key = QUESTION_VERSION % pk
+    versions = get_versions([key, CATEGORIES_VERSION])
+    return etag(
+        'question-api', pk, versions[key], versions[CATEGORIES_VERSION],
+        request.user.pk, request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', '')
+    )
+
+
+def category_api_etag(request, *args, **kwargs):
+    """
+    ETag of the category API.
+    """
+    version = get_versions([CATEGORIES_VERSION])[CATEGORIES_VERSION]
+    return etag(
+        'category-api', version, request.user.pk,
+        request.get_full_path(), request.META.get('HTTP_ACCEPT', '')
+    )
+
+
+class ProfileCache(object):
+    """
+    .. class:: ProfileCache
+
+    Least recently used profiles of this process, by user id.
+
+    Entries are dropped when the profile is saved or deleted in this
+    process, and expire after `timeout` seconds to pick up changes made by
+    other processes. Every lookup returns a copy, so changes to a profile
+    never leak into other requests.
+    """
+
+    def __init__(self, size=1000, timeout=60):
+        self.size = size
+        self.timeout = timeout
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        :rtype: copy of the cached profile of user `user_id`, or None.
+        """
+        with self._lock:
+            entry = self._profiles.pop(user_id, None)
+            if entry is None or entry[0] < time.time():
+                return None
+            self._profiles[user_id] = entry
+        return copy.deepcopy(entry[1])
+
+    def set(self, user_id, profile):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+            self._profiles[user_id] = (
+                time.time() + self.timeout, copy.deepcopy(profile)
+            )
+            while len(self._profiles) > self.size:
+                self._profiles.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+profile_cache = ProfileCache(
+    getattr(settings, 'QUESTIONS_PROFILE_CACHE_SIZE', 1000),
+    getattr(settings, 'QUESTIONS_PROFILE_CACHE_TIMEOUT', 60)
+)
+"""Profiles of this process, see :mod:`question.mixins.get_match_profile`."""
+
+
+def match_percent(profile, other):
+    """
+    .. function:: match_percent(profile, other)
+
+    :mod:`question.models.Profile.match_percent`, cached for the current
+    versions of both profiles for `QUESTIONS_MATCH_CACHE_TIMEOUT` seconds
+    (default: one day).
+
+    Matches are symmetric, so both directions share one cache entry.
+    """
+    a, b = sorted((profile.pk, other.pk))
+    keys = [PROFILE_VERSION % a, PROFILE_VERSION % b]
+    versions = get_versions(keys)
+    key = MATCH % (a, versions[keys[0]], b, versions[keys[1]])
+    match = cache.get(key)
+    if match is None:
+        match = profile.match_percent(other)
+        cache.set(key, match, getattr(
+            settings, 'QUESTIONS_MATCH_CACHE_TIMEOUT', 24 * 60 * 60
+        ))
+    return match
+
+# vim: ts=4 et sw=4 sts=4
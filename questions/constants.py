@@ -27,3 +27,21 @@ VALUE_CHOICES = (
     ('3', '0.5',),
     ('4', '1.0',),
 )
+
+IMPORTANCE_MANDATORY = IMPORTANCE_CHOICES[4][0]
+"""Answers with this importance are hard constraints for matching."""
+
+IMPORTANCE_WEIGHTS = (
+    ('0', 1),
+    ('1', 5),
+    ('2', 10),
+    ('3', 50),
+    ('4', 250),
+)
+"""Weight of an answer in the match score, by `IMPORTANCE_CHOICES` key."""
+
+MAX_POSSIBLE_ANSWERS = 32
+"""Possible answers per question that fit into an acceptable-answer mask."""
+
+TOP_MATCHES = 50
+"""Number of best matches to keep for every profile."""
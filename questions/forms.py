@@ -121,6 +121,10 @@ class AnswerQuestionForm(forms.ModelForm):
         except Exception as e:
             raise Exception(e)
 
+        self.fields['user_answer'].queryset = \
+            self.question.possible_answers()
+        self.fields["acceptable_answer"].queryset = \
+            self.question.possible_answers()
         self.fields['user_answer'].choices = possible_answers
         self.fields["acceptable_answer"].choices = possible_answers
         self.helper = FormHelper(self)
@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.indexes` -- in-memory indexes to narrow down candidates.
+
+Indexes are built from an :mod:`question.matching.AnswerMatrix` and are
+meant to run before exact scoring, to drop candidates cheaply.
+"""
+
+import heapq
+import logging
+import time
+from datetime import date
+from dateutil.relativedelta import relativedelta
+
+import numpy as np
+from django.conf import settings
+
+from .constants import LOOKFOR_CHOICES
+from .constants import MAX_POSSIBLE_ANSWERS
+from .constants import VALUE_CHOICES
+from .matching import MANDATORY, UNANSWERED
+from .models import PossibleAnswer, Profile
+from .snapshot import current_snapshot, load_snapshot, snapshot_dir
+
+logger = logging.getLogger(__name__)
+
+LOOKFOR_ANY = ord(LOOKFOR_CHOICES[0][0])
+NO_DOB = 0
+"""Birth date ordinal of profiles without a date of birth."""
+
+
+def _postings(keys, rows):
+    """
+    Group `rows` by `keys` into a compact inverted index.
+
+    :rtype: tuple of the sorted unique keys, the start and end of each key
+            in the postings, and the postings (rows ordered by key).
+    """
+    order = np.argsort(keys, kind='mergesort')
+    keys, rows = keys[order], rows[order]
+    unique, starts = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys)).astype(starts.dtype)
+    return unique, starts, ends, rows.astype(np.int32)
+
+
+def _lookup_postings(index, keys):
+    """
+    :rtype: concatenated postings of all `keys` found in `index`.
+    """
+    unique, starts, ends, rows = index
+    if not len(unique) or not len(keys):
+        return np.zeros(0, dtype=np.int32)
+    position = np.searchsorted(unique, keys)
+    position[position >= len(unique)] = 0
+    position = position[unique[position] == keys]
+    if not len(position):
+        return np.zeros(0, dtype=np.int32)
+    return np.concatenate([
+        rows[start:end]
+        for start, end in zip(starts[position], ends[position])
+    ])
+
+
+class DealbreakerIndex(object):
+    """
+    .. class:: DealbreakerIndex
+
+    Inverted index over "Mandatory" answers.
+
+    For every question and possible answer, the index lists the profiles
+    that marked the question as mandatory and do not accept that possible
+    answer. A second index lists who gave which answer, for the questions
+    that are mandatory to anybody.
+
+    :meth:`excluded` uses both to find every profile that fails a hard
+    constraint with a given profile, in either direction.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        answers = np.asarray(matrix.answers)
+
+        if answers.size:
+            self.limit = answers.max(axis=0).astype(np.int64) + 1
+        else:
+            self.limit = np.zeros(answers.shape[1], dtype=np.int64)
+        """Number of positions that anybody answered, per column."""
+
+        rows, columns = np.nonzero(
+            (np.asarray(matrix.importance) == MANDATORY) &
+            (answers != UNANSWERED)
+        )
+        masks = np.asarray(matrix.acceptable)[rows, columns]
+        keys = []
+        postings = []
+        for position in range(int(self.limit.max(initial=0))):
+            rejected = (
+                (position < self.limit[columns]) &
+                (((masks >> position) & 1) == 0)
+            )
+            keys.append(columns[rejected] * MAX_POSSIBLE_ANSWERS + position)
+            postings.append(rows[rejected])
+        self.rejected = _postings(
+            np.concatenate(keys or [np.zeros(0, np.int64)]).astype(np.int64),
+            np.concatenate(postings or [np.zeros(0, np.int64)])
+        )
+        """(column, position) -> rows that reject it as mandatory."""
+
+        mandatory = np.unique(columns)
+        sub = answers[:, mandatory]
+        rows, index = np.nonzero(sub != UNANSWERED)
+        self.answered = _postings(
+            mandatory[index].astype(np.int64) * MAX_POSSIBLE_ANSWERS +
+            sub[rows, index],
+            rows
+        )
+        """(column, position) -> rows that answered the position."""
+
+    def excluded(self, profile_id):
+        """
+        .. method:: excluded(self, profile_id)
+
+        :rtype: sorted array of profile ids that fail a hard constraint with
+                `profile_id`, in either direction.
+        """
+        matrix = self.matrix
+        try:
+            a = matrix.row(profile_id)
+        except KeyError:
+            return np.zeros(0, dtype=np.int64)
+        answers = np.asarray(matrix.answers[a])
+        columns = np.flatnonzero(answers != UNANSWERED)
+
+        """Profiles to whom our answers are dealbreakers."""
+        rows = [_lookup_postings(
+            self.rejected,
+            columns.astype(np.int64) * MAX_POSSIBLE_ANSWERS + answers[columns]
+        )]
+
+        """Profiles that gave answers we do not accept, but require."""
+        mandatory = columns[
+            np.asarray(matrix.importance[a, columns]) == MANDATORY
+        ]
+        acceptable = np.asarray(matrix.acceptable[a, mandatory])
+        keys = [
+            column * MAX_POSSIBLE_ANSWERS + position
+            for column, mask in zip(mandatory.tolist(), acceptable.tolist())
+            for position in range(int(self.limit[column]))
+            if not (mask >> position) & 1
+        ]
+        rows.append(
+            _lookup_postings(self.answered, np.array(keys, dtype=np.int64))
+        )
+
+        rows = np.unique(np.concatenate(rows))
+        rows = rows[rows != a]
+        return matrix.profile_ids[rows]
+
+    def prune(self, profile_id, candidate_ids):
+        """
+        :rtype: `candidate_ids` without those excluded for `profile_id`.
+        """
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        return candidate_ids[
+            ~np.isin(candidate_ids, self.excluded(profile_id))
+        ]
+
+
+def possible_answer_values(question_ids):
+    """
+    :rtype: array of `PossibleAnswer.value` as float, by column of
+            `question_ids` and position.
+    """
+    columns = dict(
+        (question_id, column)
+        for column, question_id in enumerate(np.asarray(question_ids).tolist())
+    )
+    labels = dict(VALUE_CHOICES)
+    values = np.zeros(
+        (len(columns), MAX_POSSIBLE_ANSWERS), dtype=np.float32
+    )
+    positions = {}
+    for question_id, value in PossibleAnswer.objects.order_by(
+            'question', 'pk').values_list('question_id', 'value').iterator():
+        position = positions.get(question_id, 0)
+        positions[question_id] = position + 1
+        column = columns.get(question_id)
+        if column is not None and position < MAX_POSSIBLE_ANSWERS:
+            values[column, position] = float(labels.get(value, 0.0))
+    return values
+
+
+class ValueLSH(object):
+    """
+    .. class:: ValueLSH
+
+    Approximate nearest neighbours of profiles, by the values of their
+    answers (see `PossibleAnswer.value`).
+
+    Every profile is a vector of the values of its answers, 0 for questions
+    it did not answer. Random hyperplanes hash similar vectors (by cosine)
+    into the same bucket, in each of `tables` independent hash tables of
+    `bits` hyperplanes each. More tables and probes raise recall, more bits
+    make buckets smaller.
+    """
+
+    def __init__(self, matrix, values, tables=8, bits=16, seed=0,
+                 block_size=65536):
+        self.matrix = matrix
+        self.values = values
+        self.bits = bits
+        random = np.random.RandomState(seed)
+        self.planes = random.standard_normal(
+            (tables, len(matrix.question_ids), bits)
+        ).astype(np.float32)
+        """Random hyperplanes, per table."""
+
+        self.weights = (1 << np.arange(bits)).astype(np.int64)
+        keys = np.zeros((tables, len(matrix)), dtype=np.int64)
+        for start in range(0, len(matrix), block_size):
+            stop = min(start + block_size, len(matrix))
+            keys[:, start:stop] = self.signatures(
+                self.vectors(np.arange(start, stop))
+            )
+        rows = np.arange(len(matrix))
+        answered = (np.asarray(matrix.answers) != UNANSWERED).any(axis=1)
+        self.buckets = [
+            _postings(keys[table][answered], rows[answered])
+            for table in range(tables)
+        ]
+        """Rows by hash key, per table."""
+
+    @classmethod
+    def build(cls, matrix, **kwargs):
+        return cls(matrix, possible_answer_values(matrix.question_ids),
+                   **kwargs)
+
+    def vectors(self, rows):
+        """
+        :rtype: value vectors for `rows`.
+        """
+        answers = np.asarray(self.matrix.answers[rows])
+        columns = np.arange(answers.shape[1])[None, :]
+        return np.where(
+            answers != UNANSWERED,
+            self.values[columns, np.maximum(answers, 0)],
+            0.0
+        ).astype(np.float32)
+
+    def signatures(self, vectors):
+        """
+        :rtype: hash keys of `vectors`, per table.
+        """
+        signs = np.einsum('rm,tmb->trb', vectors, self.planes) > 0
+        return signs.astype(np.int64).dot(self.weights)
+
+    def candidates(self, profile_id, limit=2000, probes=0):
+        """
+        .. method:: candidates(self, profile_id, limit=2000, probes=0)
+
+        Profiles likely to be similar to `profile_id`.
+
+        :param limit: maximum number of candidates.
+        :param probes: additionally look into buckets that differ in one of
+                       the first `probes` bits, to raise recall.
+        :rtype: array of up to `limit` profile ids, the ones found in the
+                most tables first.
+        """
+        try:
+            a = self.matrix.row(profile_id)
+        except KeyError:
+            return np.zeros(0, dtype=np.int64)
+        keys = self.signatures(self.vectors(np.array([a])))[:, 0]
+        flips = [0] + [1 << bit for bit in range(min(probes, self.bits))]
+        rows = np.concatenate([
+            _lookup_postings(bucket, np.array([key ^ flip for flip in flips]))
+            for bucket, key in zip(self.buckets, keys.tolist())
+        ])
+        rows, hits = np.unique(rows[rows != a], return_counts=True)
+        order = np.argsort(-hits, kind='mergesort')[:limit]
+        return self.matrix.profile_ids[rows[order]]
+
+
+class ProfileIndex(object):
+    """
+    .. class:: ProfileIndex
+
+    Columnar copy of the attributes profiles are filtered by: gender,
+    lookfor, date of birth (as ordinal) and visibility, as numpy arrays
+    sorted by profile id, to filter the nearest neighbours of
+    :func:`approximate_matches` without a query.
+
+    Kept up to date with :meth:`update` and :meth:`remove` by
+    :mod:`question.signals` in the process it lives in.
+    """
+
+    def __init__(self, ids, gender, lookfor, dob, is_public):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.gender = np.asarray(gender, dtype=np.uint8)
+        self.lookfor = np.asarray(lookfor, dtype=np.uint8)
+        self.dob = np.asarray(dob, dtype=np.int32)
+        self.is_public = np.asarray(is_public, dtype=bool)
+
+    @staticmethod
+    def encode(gender, lookfor, dob, is_public):
+        return (
+            ord(gender),
+            ord(lookfor),
+            dob.toordinal() if dob else NO_DOB,
+            bool(is_public)
+        )
+
+    @classmethod
+    def build(cls):
+        """
+        Load all profiles, in a single query.
+        """
+        values = Profile.objects.order_by('pk').values_list(
+            'pk', 'gender', 'lookfor', 'dob', 'is_public'
+        )
+        rows = [
+            (pk,) + cls.encode(gender, lookfor, dob, is_public)
+            for pk, gender, lookfor, dob, is_public in values.iterator()
+        ]
+        columns = list(zip(*rows)) or [()] * 5
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self, profile):
+        """
+        Add or update `profile`.
+        """
+        values = self.encode(
+            profile.gender, profile.lookfor, profile.dob, profile.is_public
+        )
+        row = np.searchsorted(self.ids, profile.pk)
+        if row == len(self.ids) or self.ids[row] != profile.pk:
+            self.ids = np.insert(self.ids, row, profile.pk)
+            self.gender = np.insert(self.gender, row, values[0])
+            self.lookfor = np.insert(self.lookfor, row, values[1])
+            self.dob = np.insert(self.dob, row, values[2])
+            self.is_public = np.insert(self.is_public, row, values[3])
+        else:
+            self.gender[row] = values[0]
+            self.lookfor[row] = values[1]
+            self.dob[row] = values[2]
+            self.is_public[row] = values[3]
+
+    def remove(self, pk):
+        """
+        Remove the profile `pk`.
+        """
+        row = np.searchsorted(self.ids, pk)
+        if row < len(self.ids) and self.ids[row] == pk:
+            keep = np.arange(len(self.ids)) != row
+            self.ids = self.ids[keep]
+            self.gender = self.gender[keep]
+            self.lookfor = self.lookfor[keep]
+            self.dob = self.dob[keep]
+            self.is_public = self.is_public[keep]
+
+    def compatible(self, profile, min_age=None, max_age=None):
+        """
+        .. method:: compatible(self, profile, min_age=None, max_age=None)
+
+        Vectorized :mod:`question.managers.ProfileManager.compatible` and
+        :mod:`question.managers.ProfileManager.between_ages`.
+
+        :rtype: array of profile ids.
+        """
+        gender, lookfor, dob, is_public = self.encode(
+            profile.gender, profile.lookfor, profile.dob, profile.is_public
+        )
+        selected = self.is_public & (self.ids != profile.pk)
+        if lookfor != LOOKFOR_ANY:
+            selected &= self.gender == lookfor
+        selected &= (self.lookfor == LOOKFOR_ANY) | (self.lookfor == gender)
+        today = date.today()
+        if min_age is not None:
+            selected &= self.dob != NO_DOB
+            selected &= self.dob <= (
+                today - relativedelta(years=min_age)
+            ).toordinal()
+        if max_age is not None:
+            selected &= self.dob != NO_DOB
+            selected &= self.dob > (
+                today - relativedelta(years=max_age + 1)
+            ).toordinal()
+        return self.ids[selected]
+
+
+def approximate_matches(profile, k=10, min_age=None, max_age=None,
+                        limit=2000, probes=2):
+    """
+    .. function:: approximate_matches(profile, k=10, min_age=None,
+                                      max_age=None, limit=2000, probes=2)
+
+    Find the `k` best matches for `profile` among the `limit` nearest
+    neighbours from :class:`ValueLSH`, scored exactly on the snapshot.
+    Trades some recall for not looking at most profiles at all.
+
+    Neighbours are filtered like
+    :mod:`question.matching.match_candidates`, with :class:`ProfileIndex`.
+
+    :rtype: list of `(match, profile id)`, best match first, or None if no
+            index is available or `profile` is not in it yet.
+    """
+    lsh = value_lsh()
+    if lsh is None:
+        return None
+    try:
+        lsh.matrix.row(profile.pk)
+    except KeyError:
+        return None
+    neighbours = lsh.candidates(profile.pk, limit, probes)
+    neighbours = neighbours[np.isin(
+        neighbours, profiles().compatible(profile, min_age, max_age)
+    )]
+    neighbours = dealbreakers().prune(profile.pk, neighbours)
+    ids, scores = lsh.matrix.scores(profile.pk, neighbours)
+    best = heapq.nlargest(
+        k,
+        ((match, pk) for pk, match in zip(ids.tolist(), scores.tolist())
+         if match > 0),
+        key=lambda item: (item[0], -item[1])
+    )
+    return best
+
+
+_indexes = {}
+"""Indexes of this process, with the time they were built."""
+
+
+def _cached(name, build, snapshot=True):
+    """
+    Return the index `name` of this process, built by `build`.
+
+    Indexes built from answers are only available if a snapshot is
+    configured and was written (see :mod:`question.snapshot`), so they can
+    be loaded quickly. Indexes are rebuilt once older than
+    `QUESTIONS_INDEX_MAX_AGE` seconds (default 300).
+    """
+    if snapshot and not snapshot_dir():
+        return None
+    max_age = getattr(settings, 'QUESTIONS_INDEX_MAX_AGE', 300)
+    built, index = _indexes.get(name, (0, None))
+    if index is None or time.time() - built > max_age:
+        if snapshot and current_snapshot(snapshot_dir()) is None:
+            return None
+        started = time.time()
+        index = build()
+        _indexes[name] = (time.time(), index)
+        logger.debug(
+            "Built %s in %.3fs.", name, time.time() - started
+        )
+    return index
+
+
+def snapshot_matrix():
+    """
+    .. function:: snapshot_matrix()
+
+    The answer matrix of this process, loaded from the snapshot, or None.
+    """
+    return _cached('matrix', load_snapshot)
+
+
+def dealbreakers():
+    """
+    .. function:: dealbreakers()
+
+    The :class:`DealbreakerIndex` of this process, or None.
+    """
+    return _cached(
+        'dealbreakers', lambda: DealbreakerIndex(snapshot_matrix())
+    )
+
+
+def value_lsh():
+    """
+    .. function:: value_lsh()
+
+    The :class:`ValueLSH` of this process, or None. Configure it with
+    `QUESTIONS_LSH_TABLES` and `QUESTIONS_LSH_BITS`.
+    """
+    return _cached('value_lsh', lambda: ValueLSH.build(
+        snapshot_matrix(),
+        tables=getattr(settings, 'QUESTIONS_LSH_TABLES', 8),
+        bits=getattr(settings, 'QUESTIONS_LSH_BITS', 16),
+    ))
+
+
+def profiles():
+    """
+    .. function:: profiles()
+
+    The :class:`ProfileIndex` of this process.
+    """
+    return _cached('profiles', ProfileIndex.build, snapshot=False)
+
+
+def profile_changed(profile, deleted=False):
+    """
+    Update the :class:`ProfileIndex` of this process, if it was built.
+    """
+    built, index = _indexes.get('profiles', (0, None))
+    if index is None:
+        return
+    if deleted:
+        index.remove(profile.pk)
+    else:
+        index.update(profile)
+
+# vim: ts=4 et sw=4 sts=4
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.management.commands.export_analytics` -- write an
+anonymized answer dataset.
+
+.. seealso:: :mod:`question.analytics`
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from questions.analytics import write_dataset
+
+
+class Command(BaseCommand):
+    help = 'Write anonymized answers as a compressed numpy .npz file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The .npz file to write.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Answers read from the database at once.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help='Seed of the random order of profiles.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        arrays = write_dataset(
+            options['path'], options['chunk_size'], options['seed']
+        )
+        self.stdout.write(
+            'Wrote %d answers of %d profiles to %d questions to %s '
+            'in %.1fs.' % (
+                len(arrays['answer']), len(arrays['gender']),
+                len(arrays['question_ids']), options['path'],
+                time.time() - started
+            )
+        )
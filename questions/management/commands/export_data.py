@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.management.commands.export_data` -- stream questions or
+answers to a file.
+
+.. seealso:: :mod:`question.streaming`
+"""
+
+import io
+
+from django.core.management.base import BaseCommand
+
+from questions.streaming import ANSWER_FIELDS, QUESTION_FIELDS
+from questions.streaming import CHUNK_SIZE, FORMATS
+from questions.streaming import csv_lines, jsonl_lines
+from questions.streaming import export_answers, export_questions
+
+
+class Command(BaseCommand):
+    help = 'Write all questions or answers as JSON Lines or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=('questions', 'answers'))
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='File to write, standard output by default.'
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS, default=None,
+            help='Defaults to csv for .csv files, jsonl otherwise.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Rows read from the database at once.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'jsonl'
+        )
+        if options['kind'] == 'questions':
+            records = export_questions(options['chunk_size'])
+            fields = QUESTION_FIELDS
+        else:
+            records = export_answers(chunk_size=options['chunk_size'])
+            fields = ANSWER_FIELDS
+        if format == 'csv':
+            lines = csv_lines(records, fields)
+        else:
+            lines = jsonl_lines(records)
+
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with io.open(path, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(lines)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.management.commands.import_data` -- stream questions or
+answers from a file.
+
+Answers are written without signals, so the statistics and matches of the
+imported answers are rebuilt afterwards unless `--no-rebuild` is given.
+
+.. seealso:: :mod:`question.streaming`
+"""
+
+import io
+import sys
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from questions.streaming import CHUNK_SIZE, FORMATS
+from questions.streaming import import_answers, import_questions
+from questions.streaming import read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Add questions or answers from JSON Lines or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=('questions', 'answers'))
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='File to read, standard input by default.'
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS, default=None,
+            help='Defaults to csv for .csv files, jsonl otherwise.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Records written to the database at once.'
+        )
+        parser.add_argument(
+            '--no-rebuild', action='store_false', dest='rebuild',
+            help='Do not rebuild statistics and matches after importing '
+                 'answers.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'jsonl'
+        )
+        read = read_csv if format == 'csv' else read_jsonl
+        started = time.time()
+        if path == '-':
+            self.load(options, read(sys.stdin))
+        else:
+            with io.open(path, encoding='utf-8', newline='') as f:
+                self.load(options, read(f))
+        self.stdout.write('Done in %.1fs.' % (time.time() - started))
+
+    def load(self, options, records):
+        if options['kind'] == 'questions':
+            questions, possible_answers = import_questions(
+                records, options['chunk_size']
+            )
+            self.stdout.write(
+                'Created %d questions and %d possible answers.' % (
+                    questions, possible_answers
+                )
+            )
+            return
+        created, skipped = import_answers(records, options['chunk_size'])
+        self.stdout.write(
+            'Created %d answers, skipped %d.' % (created, skipped)
+        )
+        if created and options['rebuild']:
+            call_command('rebuild_stats', stdout=self.stdout)
+            call_command('rebuild_matches', stdout=self.stdout)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.management.commands.rebuild_matches` -- rebuild all matches.
+
+Loads every answer into one :mod:`question.matching.AnswerMatrix`, places
+it in shared memory and lets a pool of processes score blocks of rows
+against all profiles. Workers attach to the shared memory by name, so the
+matrix is never pickled. The best matches of every profile replace the
+stored :mod:`question.models.MatchList`.
+"""
+
+import json
+import multiprocessing
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from questions.constants import LOOKFOR_CHOICES, TOP_MATCHES
+from questions.matching import AnswerMatrix
+from questions.models import MatchList, Profile
+from questions.snapshot import current_snapshot, load_snapshot
+from questions.snapshot import snapshot_dir
+from questions.stats import chunks
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+LOOKFOR_ANY = ord(LOOKFOR_CHOICES[0][0])
+
+ARRAYS = (
+    'profile_ids', 'answers', 'importance', 'acceptable',
+    'gender', 'lookfor', 'is_public',
+)
+"""Arrays shared with the workers."""
+
+_shared = {}
+"""Arrays and shared memory blocks, attached to by every worker."""
+
+
+def share(arrays):
+    """
+    Copy `arrays` into new shared memory blocks.
+
+    :rtype: tuple of the blocks, and a description for :func:`attach`.
+    """
+    blocks = []
+    spec = {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(
+            create=True, size=max(1, array.nbytes)
+        )
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        view[...] = array
+        blocks.append(block)
+        spec[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, spec
+
+
+def attach(spec):
+    """
+    Pool initializer: map the shared arrays described by `spec`.
+    """
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared[name + '_block'] = block
+        _shared[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _shared['matrix'] = AnswerMatrix(
+        _shared['profile_ids'],
+        np.zeros(_shared['answers'].shape[1], dtype=np.int64),
+        _shared['answers'],
+        _shared['importance'],
+        _shared['acceptable'],
+    )
+
+
+def score_rows(args):
+    """
+    Score the rows `start` to `stop` against all profiles.
+
+    :rtype: list of `(profile id, [[profile id, match], ...])`.
+    """
+    start, stop, k = args
+    matrix = _shared['matrix']
+    gender = _shared['gender']
+    lookfor = _shared['lookfor']
+    public = _shared['is_public']
+    result = []
+    for row in range(start, stop):
+        profile_id = int(matrix.profile_ids[row])
+        ids, scores = matrix.scores(profile_id)
+        compatible = (
+            public &
+            ((lookfor == LOOKFOR_ANY) | (lookfor == gender[row])) &
+            ((lookfor[row] == LOOKFOR_ANY) | (gender == lookfor[row])) &
+            (scores > 0)
+        )
+        compatible[row] = False
+        candidates = np.flatnonzero(compatible)
+        if len(candidates) > k:
+            best = np.argpartition(-scores[candidates], k - 1)[:k]
+            candidates = candidates[best]
+        order = np.lexsort((ids[candidates], -scores[candidates]))
+        candidates = candidates[order]
+        result.append((profile_id, [
+            [int(pk), float(match)]
+            for pk, match in zip(ids[candidates], scores[candidates])
+        ]))
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the best matches of all profiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=multiprocessing.cpu_count(),
+            help='Number of worker processes.'
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=256,
+            help='Number of profiles scored per task.'
+        )
+        parser.add_argument(
+            '--snapshot', nargs='?', const='', default=None,
+            help='Load answers from a snapshot instead of the database, '
+                 'defaults to QUESTIONS_SNAPSHOT_DIR.'
+        )
+        parser.add_argument(
+            '--matches', type=int, default=TOP_MATCHES,
+            help='Number of matches to keep per profile.'
+        )
+
+    def handle(self, *args, **options):
+        if shared_memory is None:
+            raise CommandError('rebuild_matches requires Python 3.8+.')
+
+        started = time.time()
+        if options['snapshot'] is None:
+            matrix = AnswerMatrix.build()
+        else:
+            path = options['snapshot'] or snapshot_dir()
+            if not path or current_snapshot(path) is None:
+                raise CommandError(
+                    'No snapshot found, run snapshot_answers first.'
+                )
+            matrix = load_snapshot(path)
+        profiles = dict(
+            (pk, (gender, lookfor, is_public))
+            for pk, gender, lookfor, is_public in Profile.objects.values_list(
+                'pk', 'gender', 'lookfor', 'is_public'
+            ).iterator()
+        )
+        profile_ids = matrix.profile_ids
+        answers = matrix.answers
+        importance = matrix.importance
+        acceptable = matrix.acceptable
+        keep = np.array(
+            [pk in profiles for pk in profile_ids.tolist()], dtype=bool
+        )
+        if not keep.all():
+            """Profiles deleted since the snapshot was written."""
+            profile_ids = profile_ids[keep]
+            answers = answers[keep]
+            importance = importance[keep]
+            acceptable = acceptable[keep]
+        n = len(profile_ids)
+        attributes = [profiles[pk] for pk in profile_ids.tolist()]
+        arrays = {
+            'profile_ids': profile_ids,
+            'answers': answers,
+            'importance': importance,
+            'acceptable': acceptable,
+            'gender': np.array(
+                [ord(a[0]) for a in attributes], dtype=np.uint8
+            ),
+            'lookfor': np.array(
+                [ord(a[1]) for a in attributes], dtype=np.uint8
+            ),
+            'is_public': np.array([a[2] for a in attributes], dtype=bool),
+        }
+        self.stdout.write(
+            'Loaded %d profiles and %d questions in %.1fs.' % (
+                n, len(matrix.question_ids), time.time() - started
+            )
+        )
+
+        blocks, spec = share(arrays)
+        del matrix, arrays, answers, importance, acceptable
+        started = time.time()
+        tasks = [
+            (start, min(start + options['block_size'], n), options['matches'])
+            for start in range(0, n, options['block_size'])
+        ]
+        try:
+            pool = multiprocessing.Pool(
+                options['processes'], initializer=attach, initargs=(spec,)
+            )
+            try:
+                with transaction.atomic():
+                    MatchList.objects.all().delete()
+                    for result in pool.imap_unordered(score_rows, tasks):
+                        """Skip profiles deleted in the meantime."""
+                        existing = set()
+                        for chunk in chunks(
+                                [pk for pk, matches in result], 500):
+                            existing.update(Profile.objects.filter(
+                                pk__in=chunk
+                            ).values_list('pk', flat=True))
+                        MatchList.objects.bulk_create([
+                            MatchList(
+                                profile_id=pk, matches=json.dumps(matches)
+                            )
+                            for pk, matches in result if pk in existing
+                        ])
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        elapsed = max(time.time() - started, 1e-6)
+        self.stdout.write(
+            'Scored %d pairs in %.1fs (%.0f pairs/s).' % (
+                n * n, elapsed, n * n / elapsed
+            )
+        )
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.management.commands.rebuild_stats` -- count all answers.
+
+.. seealso:: :mod:`question.stats.rebuild`
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from questions.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Count the answers of all questions from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Answers read from the database at once.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.time()
+        questions, answers = rebuild(options['chunk_size'])
+        elapsed = time.time() - started
+        self.stdout.write(
+            'Counted %d answers to %d questions in %.1fs (%d answers/s).' % (
+                answers, questions, elapsed, answers / max(elapsed, 1e-6)
+            )
+        )
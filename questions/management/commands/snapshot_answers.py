@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.management.commands.snapshot_answers` -- write a snapshot.
+
+.. seealso:: :mod:`question.snapshot`
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from questions.snapshot import snapshot_dir, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Write a memory mappable snapshot of all answers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=None,
+            help='Snapshot directory, defaults to QUESTIONS_SNAPSHOT_DIR.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot_dir()
+        if not path:
+            raise CommandError(
+                'No path given and QUESTIONS_SNAPSHOT_DIR is not set.'
+            )
+        started = time.time()
+        matrix = write_snapshot(path)
+        self.stdout.write(
+            'Wrote %d profiles and %d questions to %s in %.1fs.' % (
+                len(matrix), len(matrix.question_ids), path,
+                time.time() - started
+            )
+        )
@@ -6,11 +6,20 @@
 """
 
 import logging
-from django.db import models
+from datetime import date
+from dateutil.relativedelta import relativedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, IntegerField, Sum, When
+
+from .constants import LOOKFOR_CHOICES
+from .constants import MAX_POSSIBLE_ANSWERS
 
 
 logger = logging.getLogger(__name__)
 
+LOOKFOR_ANY = LOOKFOR_CHOICES[0][0]
+
 
 class ProfileManager(models.Manager):
     """
@@ -71,9 +80,9 @@ class ProfileManager(models.Manager):
         """
         return float(self.male().count()) / float(self.count())
 
-    def age_range(start, end):
+    def age_range(self, start, end):
         """
-        return all profiles in a range between `start` and `end`.
+        return all profiles born in a range between `start` and `end`.
         """
         if start > end:
             """
@@ -82,11 +91,45 @@ class ProfileManager(models.Manager):
             tmp = end
             end = start
             start = tmp
-        return self.objects.filter(dob__gt=start).filter(dob_lt=end)
+        return self.filter(dob__gt=start).filter(dob__lt=end)
         """Filter objects greater than `start` and less than `end`."""
 
+    def between_ages(self, min_age=None, max_age=None):
+        """
+        .. method:: between_ages(self, min_age=None, max_age=None)
+
+        :rtype: profiles aged `min_age` to `max_age` years (inclusive).
+        """
+        today = date.today()
+        queryset = self.all()
+        if min_age is not None:
+            queryset = queryset.filter(
+                dob__lte=today - relativedelta(years=min_age)
+            )
+        if max_age is not None:
+            queryset = queryset.filter(
+                dob__gt=today - relativedelta(years=max_age + 1)
+            )
+        return queryset
+
+    def compatible(self, profile):
+        """
+        .. method:: compatible(self, profile)
+
+        :rtype: public profiles `profile` is looking for, and that are
+                looking for somebody like `profile`.
+        """
+        queryset = self.filter(is_public=True).exclude(pk=profile.pk)
+        if profile.lookfor != LOOKFOR_ANY:
+            queryset = queryset.filter(gender=profile.lookfor)
+        return queryset.filter(lookfor__in=(LOOKFOR_ANY, profile.gender))
+
     def get_by_natural_key(self, username):
-        return self.get(username=username)
+        """
+        Get profiles by the username of their user, their natural key.
+        """
+        return self.get(user__username=username)
+
 
 class QuestionManager(models.Manager):
     """
@@ -115,12 +158,78 @@ class QuestionManager(models.Manager):
         """
         return self.exclude(answers__profile=profile)
 
+    def with_stats(self):
+        """
+        .. method:: with_stats(self)
+
+        :rtype: queryset annotated with the answer counts of every question
+                (`answer_total`, `male_answer_total`, `female_answer_total`),
+                with category and possible answers loaded along.
+
+        Lists of questions showing their statistics take a constant number
+        of queries this way, see
+        :mod:`question.models.Question.all_answer_count`.
+        """
+        return self.get_queryset().select_related(
+            'category'
+        ).prefetch_related(
+            'possible_answer'
+        ).annotate(
+            answer_total=Count('answers', distinct=True),
+            male_answer_total=Count(Case(When(
+                answers__profile__gender='M', then='answers__id'
+            )), distinct=True),
+            female_answer_total=Count(Case(When(
+                answers__profile__gender='F', then='answers__id'
+            )), distinct=True),
+        )
+
     def get_by_natural_key(self, slug):
         """
         Get Questions by natural kea to allow serialization
         """
         return self.get(slug=slug)
 
+
+class PossibleAnswerManager(models.Manager):
+    """
+    .. class:: PossibleAnswerManager
+
+    Django Manager class for :mod:`question.models.PossibleAnswer` objects.
+    """
+
+    def positions(self, questions=None):
+        """
+        .. method:: positions(self, questions=None)
+
+        Number the possible answers of each question, in order of their pk.
+        The position is the bit of a possible answer in
+        :mod:`question.models.Answer.acceptable_mask`. Deleting a possible
+        answer renumbers the later ones, see
+        :mod:`question.managers.AnswerManager.update_acceptable_masks`.
+
+        :param questions: queryset or list of question ids to limit to.
+        :rtype: tuple of a dict `possible answer id -> position` and a dict
+                `question id -> number of possible answers`.
+        """
+        queryset = self.order_by('question', 'pk')
+        if questions is not None:
+            queryset = queryset.filter(question__in=questions)
+        positions = {}
+        counts = {}
+        for pk, question_id in queryset.values_list('pk', 'question_id'):
+            position = counts.get(question_id, 0)
+            if position == MAX_POSSIBLE_ANSWERS:
+                logger.warning(
+                    "Question %s has more than %s possible answers.",
+                    question_id,
+                    MAX_POSSIBLE_ANSWERS
+                )
+            positions[pk] = position
+            counts[question_id] = position + 1
+        return positions, counts
+
+
 class AnswerManager(models.Manager):
     def for_profile(self, profile):
         """
@@ -143,3 +252,217 @@ class AnswerManager(models.Manager):
             user_answer=self.instance.user_answer
         )
         return agreeing_answers / total_answers
+
+    def update_acceptable_masks(self, question_id):
+        """
+        .. method:: update_acceptable_masks(self, question_id)
+
+        Recompute `acceptable_mask` of all answers to question
+        `question_id` from their acceptable answers, in a constant number
+        of queries per distinct mask.
+
+        Positions are numbered by primary key, so deleting a possible
+        answer moves every later possible answer down by one.
+
+        :rtype: list of ids of the answers whose mask changed.
+        """
+        from .models import PossibleAnswer
+        positions, counts = PossibleAnswer.objects.positions([question_id])
+        masks = dict(self.filter(question=question_id).values_list(
+            'pk', 'acceptable_mask'
+        ))
+        new = dict((pk, 0) for pk in masks)
+        Through = self.model.acceptable_answer.through
+        for answer_id, pk in Through.objects.filter(
+                answer__question=question_id).values_list(
+                'answer_id', 'possibleanswer_id'):
+            position = positions.get(pk, MAX_POSSIBLE_ANSWERS)
+            if position < MAX_POSSIBLE_ANSWERS:
+                new[answer_id] |= 1 << position
+        changed = {}
+        for pk, mask in new.items():
+            if masks[pk] != mask:
+                changed.setdefault(mask, []).append(pk)
+        for mask, pks in changed.items():
+            for start in range(0, len(pks), 500):
+                self.filter(pk__in=pks[start:start + 500]).update(
+                    acceptable_mask=mask
+                )
+        return [pk for pks in changed.values() for pk in pks]
+
+    def upsert(self, profile, question, user_answer=None,
+               acceptable_answer=(), **fields):
+        """
+        .. method:: upsert(self, profile, question, user_answer=None,
+                           acceptable_answer=(), **fields)
+
+        Create or update the answer of `profile` to `question` in one
+        transaction, with `fields` such as `importance` or `is_public`.
+        `user_answer` and `acceptable_answer` may be given as objects or
+        ids.
+
+        The answer is written with a single `INSERT` or `UPDATE`, and of the
+        acceptable answers only those added or removed are written. If a
+        concurrent request creates the same answer first, that answer is
+        updated instead. Matches are rescored once, after the transaction
+        committed and the row lock was released, see
+        :mod:`question.matching.rescore_later`.
+
+        :rtype: `(answer, created)`
+        """
+        lookup = dict(profile=profile, question=question)
+        with transaction.atomic():
+            answer = self.select_for_update().filter(**lookup).first()
+            created = answer is None
+            if created:
+                answer = self.model(**lookup)
+            answer.user_answer_id = getattr(user_answer, 'pk', user_answer)
+            for name, value in fields.items():
+                setattr(answer, name, value)
+            try:
+                with transaction.atomic():
+                    answer.save(force_insert=created)
+            except IntegrityError:
+                if not created:
+                    raise
+                """Somebody else created the answer in the meantime."""
+                existing = self.select_for_update().get(**lookup)
+                answer.pk = existing.pk
+                answer.acceptable_mask = existing.acceptable_mask
+                answer._loaded_user_answer_id = existing.user_answer_id
+                created = False
+                answer.save(force_update=True)
+            answer.acceptable_answer.set(acceptable_answer)
+        return answer, created
+
+    def answered_by(self, user):
+        """
+        .. method:: answered_by(self, user)
+
+        :rtype: set of ids of the questions answered by the profile of
+                `user`, a :mod:`django.contrib.auth.models.User` or its pk.
+        """
+        return set(self.filter(profile__user=user).values_list(
+            'question_id', flat=True
+        ))
+
+    def acceptance(self, profile, questions=None):
+        """
+        .. method:: acceptance(self, profile, questions=None)
+
+        How many of the male and female users who answered a question would
+        accept the answer of `profile`, for all its answers (or those to
+        `questions`) in one query.
+
+        Answers without acceptable answers accept every answer, like in
+        matching (see :mod:`question.matching.AnswerMatrix`), and are
+        counted by `QuestionStats.male_accept_all_count` and
+        `QuestionStats.female_accept_all_count`.
+
+        :rtype: dict `question id -> (male, female)`, shares between 0 and 1
+                or None if nobody of that gender answered.
+
+        .. seealso:: :mod:`question.models.PossibleAnswerStats`
+        """
+        answers = self.filter(profile=profile, user_answer__isnull=False)
+        if questions is not None:
+            answers = answers.filter(question__in=questions)
+        result = {}
+        for (question_id, male_accepts, female_accepts, males, females,
+             male_accept_all, female_accept_all) in answers.values_list(
+                'question_id',
+                'user_answer__stats__male_acceptable_count',
+                'user_answer__stats__female_acceptable_count',
+                'question__stats__male_answer_count',
+                'question__stats__female_answer_count',
+                'question__stats__male_accept_all_count',
+                'question__stats__female_accept_all_count'):
+            male_accepts = (male_accepts or 0) + (male_accept_all or 0)
+            female_accepts = (female_accepts or 0) + (female_accept_all or 0)
+            result[question_id] = (
+                float(male_accepts) / males if males else None,
+                float(female_accepts) / females if females else None,
+            )
+        return result
+
+
+def _count_if(**lookups):
+    """
+    Conditional aggregate: count the rows matching `lookups`.
+    """
+    return Sum(Case(
+        When(then=1, **lookups), default=0, output_field=IntegerField()
+    ))
+
+
+class QuestionStatsManager(models.Manager):
+    """
+    .. class:: QuestionStatsManager
+
+    Django Manager class for :mod:`question.models.QuestionStats` objects.
+    """
+
+    def refresh(self, question):
+        """
+        .. method:: refresh(self, question)
+
+        Count the answers to `question` (a question or its id) from scratch
+        and store the result for the question and all its possible answers.
+
+        :rtype: the :mod:`question.models.QuestionStats` of `question`.
+        """
+        from .models import Answer, PossibleAnswer, PossibleAnswerStats
+        question = getattr(question, 'pk', question)
+        answers = Answer.objects.filter(question=question)
+        totals = answers.aggregate(
+            answer_count=Count('pk'),
+            male_answer_count=_count_if(profile__gender='M'),
+            female_answer_count=_count_if(profile__gender='F'),
+            male_accept_all_count=_count_if(
+                profile__gender='M', acceptable_mask=0
+            ),
+            female_accept_all_count=_count_if(
+                profile__gender='F', acceptable_mask=0
+            ),
+        )
+        stats, created = self.update_or_create(
+            question_id=question,
+            defaults=dict(
+                (key, value or 0) for key, value in totals.items()
+            )
+        )
+
+        counts = dict(
+            (row['user_answer'], row)
+            for row in answers.values('user_answer').annotate(
+                answer_count=Count('pk'),
+                male_answer_count=_count_if(profile__gender='M'),
+                female_answer_count=_count_if(profile__gender='F'),
+            ).order_by()
+        )
+        acceptable = dict(
+            (row['possibleanswer'], row)
+            for row in Answer.acceptable_answer.through.objects.filter(
+                answer__question=question
+            ).values('possibleanswer').annotate(
+                acceptable_count=Count('pk'),
+                male_acceptable_count=_count_if(answer__profile__gender='M'),
+                female_acceptable_count=_count_if(
+                    answer__profile__gender='F'
+                ),
+            ).order_by()
+        )
+        for pk in PossibleAnswer.objects.filter(
+                question=question).values_list('pk', flat=True):
+            defaults = dict(
+                (key, 0) for key in PossibleAnswerStats.COUNTERS
+            )
+            for row in (counts.get(pk, {}), acceptable.get(pk, {})):
+                for key, value in row.items():
+                    if key in defaults:
+                        defaults[key] = value or 0
+            defaults['question_id'] = question
+            PossibleAnswerStats.objects.update_or_create(
+                possible_answer_id=pk, defaults=defaults
+            )
+        return stats
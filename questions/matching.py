@@ -0,0 +1,732 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.matching` -- compute match percentages between profiles.
+
+Answers are loaded once into a profile × question matrix, which allows to
+score one profile against many others in a single, vectorized pass instead
+of querying the database for every question of every pair.
+
+The score follows the well known approach of weighing how satisfied each
+side is with the answers of the other:
+
+- for every question both profiles answered, a profile is satisfied if the
+  other profile's answer is one of its acceptable answers,
+- satisfaction is weighted with the importance the profile gave the question
+  (see :data:`question.constants.IMPORTANCE_WEIGHTS`),
+- the match is the geometric mean of both satisfactions, minus a margin of
+  error of `1 / n` for `n` questions in common,
+- a "Mandatory" question answered unacceptably by the other profile is a
+  dealbreaker and makes the match 0.
+
+An answer without any acceptable answers accepts every possible answer.
+"""
+
+import heapq
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, IntegerField, Q, When
+
+from .constants import IMPORTANCE_CHOICES
+from .constants import IMPORTANCE_MANDATORY
+from .constants import IMPORTANCE_WEIGHTS
+from .constants import MAX_POSSIBLE_ANSWERS
+from .constants import TOP_MATCHES
+from .models import Answer, MatchList, PossibleAnswer, Profile, Question
+
+logger = logging.getLogger(__name__)
+
+IMPORTANCE_CODES = dict(
+    (key, code) for code, (key, label) in enumerate(IMPORTANCE_CHOICES)
+)
+"""Map `Answer.importance` to the row index in :data:`WEIGHTS`."""
+
+WEIGHTS = np.array(
+    [dict(IMPORTANCE_WEIGHTS)[key] for key, label in IMPORTANCE_CHOICES],
+    dtype=np.float64
+)
+"""Weights, indexed by importance code."""
+
+MANDATORY = IMPORTANCE_CODES[IMPORTANCE_MANDATORY]
+"""Importance code of mandatory answers."""
+
+UNANSWERED = -1
+"""Marks unanswered questions in :attr:`AnswerMatrix.answers`."""
+
+
+def possible_answer_positions(questions=None):
+    """
+    Number the possible answers of each question, in order of their pk.
+
+    .. seealso:: :mod:`question.managers.PossibleAnswerManager.positions`
+    """
+    return PossibleAnswer.objects.positions(questions)
+
+
+def _lookup(keys, values):
+    """
+    Find `values` in the sorted array `keys`.
+
+    :rtype: tuple of indices into `keys`, and a mask which `values` exist.
+    """
+    keys = np.asarray(keys)
+    values = np.asarray(values, dtype=keys.dtype)
+    if not len(keys):
+        return (
+            np.zeros(len(values), dtype=np.intp),
+            np.zeros(len(values), dtype=bool)
+        )
+    index = np.searchsorted(keys, values)
+    index[index >= len(keys)] = 0
+    return index, keys[index] == values
+
+
+class AnswerMatrix(object):
+    """
+    .. class:: AnswerMatrix
+
+    Answers of many profiles to many questions, as dense numpy arrays.
+
+    Rows are profiles (:attr:`profile_ids`), columns are questions
+    (:attr:`question_ids`), both sorted by id, except for rows and columns
+    added after a snapshot was written (see :mod:`question.snapshot`).
+    Possible answers are referred to by their position within the
+    question, see :func:`possible_answer_positions`.
+    """
+
+    def __init__(self, profile_ids, question_ids, answers, importance,
+                 acceptable):
+        self.profile_ids = np.asarray(profile_ids, dtype=np.int64)
+        """Profile id for every row."""
+
+        self.question_ids = np.asarray(question_ids, dtype=np.int64)
+        """Question id for every column."""
+
+        self.answers = answers
+        """Position of the users answer, or `UNANSWERED` (int8)."""
+
+        self.importance = importance
+        """Importance code of the answer, see :data:`IMPORTANCE_CODES`."""
+
+        self.acceptable = acceptable
+        """Bitmask of acceptable positions (uint32)."""
+
+        self._sorted = {}
+        """Ids in sorted order and their order, see :meth:`_find`."""
+
+    @classmethod
+    def empty(cls, profile_ids, question_ids):
+        """
+        Create a matrix where nobody answered anything.
+        """
+        shape = (len(profile_ids), len(question_ids))
+        return cls(
+            profile_ids,
+            question_ids,
+            np.full(shape, UNANSWERED, dtype=np.int8),
+            np.zeros(shape, dtype=np.int8),
+            np.zeros(shape, dtype=np.uint32),
+        )
+
+    @classmethod
+    def build(cls, profiles=None, questions=None):
+        """
+        Load answers from the database.
+
+        :param profiles: queryset or list of profile ids to load, defaults
+                         to every profile that answered anything.
+        :param questions: queryset or list of question ids to load, defaults
+                          to every question that has possible answers.
+
+        Runs two queries, regardless of the number of answers.
+        """
+        positions, counts = possible_answer_positions(questions)
+
+        answers = Answer.objects.all()
+        if profiles is not None:
+            answers = answers.filter(profile__in=profiles)
+        if questions is not None:
+            answers = answers.filter(question__in=questions)
+        rows = list(answers.values_list(
+            'profile_id', 'question_id', 'user_answer_id', 'importance',
+            'acceptable_mask'
+        ))
+
+        if profiles is not None and not hasattr(profiles, 'values_list'):
+            profile_ids = np.unique(np.asarray(list(profiles), np.int64))
+        else:
+            profile_ids = np.unique(
+                np.array([row[0] for row in rows], dtype=np.int64)
+            )
+        question_ids = np.array(sorted(counts), dtype=np.int64)
+        matrix = cls.empty(profile_ids, question_ids)
+        if not rows:
+            return matrix
+
+        r, found_r = _lookup(profile_ids, [row[0] for row in rows])
+        c, found_c = _lookup(question_ids, [row[1] for row in rows])
+        found = found_r & found_c
+        position = np.array(
+            [positions.get(row[2], UNANSWERED) for row in rows],
+            dtype=np.int64
+        )
+        found &= (position != UNANSWERED) & (position < MAX_POSSIBLE_ANSWERS)
+        importance = np.array(
+            [IMPORTANCE_CODES.get(row[3], 0) for row in rows], dtype=np.int8
+        )
+        acceptable = np.array(
+            [row[4] for row in rows], dtype=np.int64
+        ).astype(np.uint32)
+        r, c = r[found], c[found]
+        matrix.answers[r, c] = position[found]
+        matrix.importance[r, c] = importance[found]
+        matrix.acceptable[r, c] = acceptable[found]
+
+        full = np.array(
+            [(1 << min(counts[q], MAX_POSSIBLE_ANSWERS)) - 1
+             for q in question_ids.tolist()],
+            dtype=np.uint32
+        )
+        anything = (matrix.acceptable == 0) & (matrix.answers != UNANSWERED)
+        matrix.acceptable[anything] = np.broadcast_to(
+            full, matrix.acceptable.shape
+        )[anything]
+        return matrix
+
+    def __len__(self):
+        return len(self.profile_ids)
+
+    def _find(self, name, values):
+        """
+        Find `values` among the ids of the attribute `name`, which are only
+        sorted once they were checked to be.
+        """
+        keys = getattr(self, name)
+        cached = self._sorted.get(name)
+        if cached is None or cached[0] is not keys:
+            order = None
+            if len(keys) > 1 and not (keys[1:] > keys[:-1]).all():
+                order = np.argsort(keys, kind='mergesort')
+            cached = self._sorted[name] = (
+                keys, keys if order is None else keys[order], order
+            )
+        keys, sorted_keys, order = cached
+        index, found = _lookup(sorted_keys, values)
+        if order is not None:
+            index = order[index]
+        return index, found
+
+    def rows(self, profile_ids):
+        """
+        :rtype: tuple of row indices for `profile_ids` and a mask which of
+                those have a row in this matrix.
+        """
+        return self._find('profile_ids', profile_ids)
+
+    def columns(self, question_ids):
+        """
+        :rtype: tuple of column indices for `question_ids` and a mask which
+                of those have a column in this matrix.
+        """
+        return self._find('question_ids', question_ids)
+
+    def row(self, profile_id):
+        """
+        :rtype: row index of a single profile.
+        :raises KeyError: if the profile is not in this matrix.
+        """
+        index, found = self.rows([profile_id])
+        if not found[0]:
+            raise KeyError(profile_id)
+        return int(index[0])
+
+    def scores(self, profile_id, candidate_ids=None, block_size=65536):
+        """
+        .. method:: scores(self, profile_id, candidate_ids=None)
+
+        Match percentages of one profile against many.
+
+        :param profile_id: the profile to match.
+        :param candidate_ids: profile ids to compare to, defaults to every
+                              profile in this matrix.
+        :rtype: tuple of candidate ids and their match in percent (0-100).
+                Candidates not in this matrix score 0.
+        """
+        if candidate_ids is None:
+            candidate_ids = self.profile_ids
+            rows = np.arange(len(self.profile_ids))
+            found = np.ones(len(rows), dtype=bool)
+        else:
+            candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+            rows, found = self.rows(candidate_ids)
+        result = np.zeros(len(candidate_ids), dtype=np.float64)
+        try:
+            a = self.row(profile_id)
+        except KeyError:
+            return candidate_ids, result
+
+        columns = np.flatnonzero(self.answers[a] != UNANSWERED)
+        if not len(columns):
+            return candidate_ids, result
+        own_answer = self.answers[a, columns].astype(np.uint32)
+        own_weight = WEIGHTS[self.importance[a, columns]]
+        own_acceptable = self.acceptable[a, columns]
+        own_mandatory = self.importance[a, columns] == MANDATORY
+
+        selected = np.flatnonzero(found)
+        for start in range(0, len(selected), block_size):
+            block = selected[start:start + block_size]
+            result[block] = self._score_block(
+                rows[block][:, None], columns[None, :],
+                own_answer, own_weight, own_acceptable, own_mandatory
+            )
+        return candidate_ids, result
+
+    def _score_block(self, rows, columns, own_answer, own_weight,
+                     own_acceptable, own_mandatory):
+        """
+        Score the rows of a block against one profile's answered columns.
+        """
+        answers = self.answers[rows, columns]
+        common = answers != UNANSWERED
+        position = np.where(common, answers, 0).astype(np.uint32)
+
+        weight = np.where(common, own_weight, 0.0)
+        accepted = (own_acceptable >> position) & 1
+        possible = weight.sum(axis=1)
+        own_satisfied = np.divide(
+            (weight * accepted).sum(axis=1), possible,
+            out=np.zeros(len(possible)), where=possible > 0
+        )
+        dealbreaker = (common & own_mandatory & (accepted == 0)).any(axis=1)
+
+        importance = self.importance[rows, columns]
+        weight = np.where(common, WEIGHTS[importance], 0.0)
+        accepted = (self.acceptable[rows, columns] >> own_answer) & 1
+        possible = weight.sum(axis=1)
+        other_satisfied = np.divide(
+            (weight * accepted).sum(axis=1), possible,
+            out=np.zeros(len(possible)), where=possible > 0
+        )
+        dealbreaker |= (
+            common & (importance == MANDATORY) & (accepted == 0)
+        ).any(axis=1)
+        own_satisfied[dealbreaker] = 0.0
+
+        in_common = common.sum(axis=1)
+        error = np.divide(
+            1.0, in_common,
+            out=np.ones(len(in_common)), where=in_common > 0
+        )
+        match = np.sqrt(own_satisfied * other_satisfied) - error
+        return np.clip(match, 0.0, 1.0) * 100.0
+
+
+def match_percent(profile, other):
+    """
+    Match percentage between two profiles.
+
+    Only loads the questions `profile` answered.
+    """
+    questions = Answer.objects.for_profile(profile).values('question')
+    matrix = AnswerMatrix.build([profile.pk, other.pk], questions)
+    ids, scores = matrix.scores(profile.pk, [other.pk])
+    return float(scores[0])
+
+
+def _accepts(answer, other):
+    """
+    :rtype: True if `answer` accepts the answer `other` gave.
+    """
+    if answer is None or other is None or other.user_answer_id is None:
+        return None
+    accepted = set(a.pk for a in answer.acceptable_answer.all())
+    return not accepted or other.user_answer_id in accepted
+
+
+def compare(profile, other):
+    """
+    .. function:: compare(profile, other)
+
+    The answers of `profile` and `other` side by side, for all questions
+    either of them answered, in two queries. Answers `other` did not make
+    public are left out.
+
+    :rtype: list of dicts with `question`, both answers (`answer`,
+            `other_answer`, None if not answered), whether both gave the
+            same answer (`agree`) and whether each accepts the answer of
+            the other (`accepts`, `other_accepts`, None unless both
+            answered). Questions both answered come first.
+    """
+    answers = {}
+    for answer in Answer.objects.filter(
+            Q(profile=profile.pk) | Q(profile=other.pk, is_public=True)
+    ).select_related(
+        'question', 'user_answer'
+    ).prefetch_related('acceptable_answer'):
+        answers.setdefault(answer.question_id, {})[answer.profile_id] = answer
+    result = []
+    for question_id, both in answers.items():
+        mine = both.get(profile.pk)
+        theirs = both.get(other.pk)
+        result.append({
+            'question': (mine or theirs).question,
+            'answer': mine,
+            'other_answer': theirs,
+            'agree': bool(
+                mine and theirs and mine.user_answer_id is not None and
+                mine.user_answer_id == theirs.user_answer_id
+            ),
+            'accepts': _accepts(mine, theirs),
+            'other_accepts': _accepts(theirs, mine),
+        })
+    result.sort(key=lambda row: (
+        row['answer'] is None or row['other_answer'] is None,
+        row['question'].pk
+    ))
+    return result
+
+
+def top_matches(profile, candidates, k=10, chunk_size=500, exclude=None):
+    """
+    .. function:: top_matches(profile, candidates, k=10, chunk_size=500,
+                              exclude=None)
+
+    Find the `k` best matches for `profile` among `candidates`.
+
+    Candidates are visited in order of how many questions they have in
+    common with `profile`, which bounds their score from above by
+    `100 * (1 - 1 / n)`. Scoring stops as soon as no remaining candidate can
+    beat the `k` best matches found so far.
+
+    :param candidates: queryset of :mod:`question.models.Profile`.
+    :param exclude: sorted array of profile ids to skip, such as
+                    :mod:`question.indexes.DealbreakerIndex.excluded`.
+    :rtype: list of `(match, profile id)`, best match first.
+    """
+    if exclude is None:
+        exclude = np.zeros(0, dtype=np.int64)
+    questions = Answer.objects.for_profile(profile).values('question')
+    in_common = candidates.exclude(pk=profile.pk).annotate(
+        in_common=Count(Case(
+            When(answer__question__in=questions, then=1),
+            output_field=IntegerField()
+        ))
+    ).filter(in_common__gt=0).order_by('-in_common', 'pk')
+
+    heap = []
+    chunk = []
+
+    def score(chunk):
+        chunk = chunk[~np.isin(chunk, exclude)].tolist()
+        if not chunk:
+            return
+        matrix = AnswerMatrix.build([profile.pk] + chunk, questions)
+        ids, scores = matrix.scores(profile.pk, chunk)
+        for pk, match in zip(ids.tolist(), scores.tolist()):
+            if match <= 0:
+                continue
+            if len(heap) < k:
+                heapq.heappush(heap, (match, pk))
+            elif match > heap[0][0]:
+                heapq.heapreplace(heap, (match, pk))
+
+    for pk, n in in_common.values_list('pk', 'in_common').iterator():
+        best_possible = 100.0 * (1 - 1.0 / n)
+        if not chunk and len(heap) >= k and heap[0][0] >= best_possible:
+            break
+        chunk.append(pk)
+        if len(chunk) >= chunk_size:
+            score(np.array(chunk, dtype=np.int64))
+            chunk = []
+    if chunk:
+        score(np.array(chunk, dtype=np.int64))
+    return sorted(heap, key=lambda item: (-item[0], item[1]))
+
+
+def rescore(profile, question, k=TOP_MATCHES):
+    """
+    .. function:: rescore(profile, question, k=TOP_MATCHES)
+
+    Update the stored best matches after `profile` changed its answer to
+    `question`, or to a list of questions.
+
+    Only the pairs of `profile` with the profiles that also answered
+    `question` can have changed, so only those are scored. The new scores
+    are merged into the :mod:`question.models.MatchList` of `profile` and of
+    every other profile involved.
+    """
+    if isinstance(question, Question):
+        question = [question]
+    candidates = Profile.objects.compatible(profile).filter(
+        pk__in=Answer.objects.filter(question__in=question).values('profile')
+    )
+    candidate_ids = list(candidates.values_list('pk', flat=True))
+    scores = {}
+    if candidate_ids:
+        matrix = AnswerMatrix.build(
+            candidates | Profile.objects.filter(pk=profile.pk),
+            Answer.objects.for_profile(profile).values('question')
+        )
+        ids, matches = matrix.scores(profile.pk, candidate_ids)
+        scores = dict(zip(ids.tolist(), matches.tolist()))
+
+    updates = {profile.pk: scores}
+    if profile.is_public:
+        """Only public profiles show up in other profiles matches."""
+        for pk, match in scores.items():
+            updates[pk] = {profile.pk: match}
+    merge_matches(updates, k, create=[profile.pk])
+    return scores
+
+
+def merge_matches(updates, k=TOP_MATCHES, create=()):
+    """
+    .. function:: merge_matches(updates, k=TOP_MATCHES, create=())
+
+    Merge `updates`, a dict `profile id -> {profile id: match}`, into the
+    match lists of those profiles.
+
+    Lists are locked while they are merged, in the order of their profiles,
+    so concurrent rescores of the same profiles neither lose updates nor
+    deadlock. Missing lists are created if they change, or if their profile
+    is in `create`.
+
+    :rtype: number of match lists changed.
+    """
+    ids = sorted(updates)
+    changed = 0
+    with transaction.atomic():
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            lists = dict(
+                (match_list.profile_id, match_list)
+                for match_list in MatchList.objects.select_for_update(
+                ).filter(profile__in=chunk).order_by('profile')
+            )
+            for pk in chunk:
+                match_list = lists.get(pk)
+                if match_list is None:
+                    match_list = MatchList(profile_id=pk)
+                merged = match_list.merge(updates[pk], k)
+                if match_list.pk is not None:
+                    if merged:
+                        match_list.save()
+                elif merged or pk in create:
+                    try:
+                        with transaction.atomic():
+                            match_list.save()
+                    except IntegrityError:
+                        """Created concurrently, merge into that one."""
+                        match_list = MatchList.objects.select_for_update(
+                        ).get(profile=pk)
+                        merged = match_list.merge(updates[pk], k)
+                        if merged:
+                            match_list.save()
+                changed += merged
+    return changed
+
+
+class _Rescore(object):
+    """
+    Callback of `rescore_later`, collecting the questions one profile
+    changed its answers to within one transaction.
+    """
+
+    def __init__(self, profile_id):
+        self.profile_id = profile_id
+        self.question_ids = set()
+
+    def __call__(self):
+        try:
+            profile = Profile.objects.get(pk=self.profile_id)
+        except Profile.DoesNotExist:
+            return
+        questions = list(Question.objects.filter(pk__in=self.question_ids))
+        if questions:
+            rescore(profile, questions)
+
+
+def rescore_later(profile_id, question_ids):
+    """
+    .. function:: rescore_later(profile_id, question_ids)
+
+    Rescore profile `profile_id` for one or a list of `question_ids` once
+    the current transaction commits.
+
+    All questions of a profile changed within a transaction are rescored
+    at once, however often its answers are saved. Callbacks dropped by the
+    rollback of a savepoint take the questions added to them along, as
+    those were added within the same savepoint.
+
+    Answers are also deleted when their profile or question is deleted, in
+    which case there is nothing left to rescore.
+    """
+    if not isinstance(question_ids, (list, set, tuple)):
+        question_ids = [question_ids]
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for sids, callback in connection.run_on_commit:
+            if (isinstance(callback, _Rescore) and
+                    callback.profile_id == profile_id):
+                callback.question_ids.update(question_ids)
+                return
+    callback = _Rescore(profile_id)
+    callback.question_ids.update(question_ids)
+    transaction.on_commit(callback)
+
+
+def purge_matches(profile):
+    """
+    .. function:: purge_matches(profile)
+
+    Remove the matches of `profile` that are no longer compatible, after it
+    changed its gender, what it is looking for or whether it is public.
+    `profile` is removed from the match lists of the other profiles just
+    as well.
+
+    :rtype: number of match lists changed.
+    """
+    updates = {}
+    ids = list(MatchList.objects.filter(
+        matches__contains='[%s, ' % profile.pk
+    ).exclude(profile=profile).values_list('profile_id', flat=True))
+    """Entries are stored as `[profile id, match]`."""
+    compatible = set()
+    if profile.is_public:
+        compatible = set(Profile.objects.compatible(profile).filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+    for pk in ids:
+        if pk not in compatible:
+            updates[pk] = {profile.pk: 0}
+
+    own = MatchList.objects.filter(profile=profile).first()
+    if own is not None:
+        ids = [pk for pk, match in own.entries()]
+        compatible = set(Profile.objects.compatible(profile).filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+        updates[profile.pk] = dict(
+            (pk, 0) for pk in ids if pk not in compatible
+        )
+    return merge_matches(updates)
+
+
+def rematch(profile_id):
+    """
+    .. function:: rematch(profile_id)
+
+    Purge the matches of profile `profile_id` that are no longer
+    compatible, and score it against the profiles that became compatible.
+    """
+    try:
+        profile = Profile.objects.get(pk=profile_id)
+    except Profile.DoesNotExist:
+        return
+    purge_matches(profile)
+    questions = list(Question.objects.answered(profile))
+    if questions:
+        rescore(profile, questions)
+
+
+def match_candidates(profile, min_age=None, max_age=None):
+    """
+    .. function:: match_candidates(profile, min_age=None, max_age=None)
+
+    :rtype: queryset of the public profiles `profile` is looking for, and
+            that are looking for `profile`, optionally aged `min_age` to
+            `max_age`.
+    """
+    candidates = Profile.objects.compatible(profile)
+    if min_age is not None or max_age is not None:
+        candidates &= Profile.objects.between_ages(min_age, max_age)
+    return candidates
+
+
+def load_matches(matches):
+    """
+    Turn `(match, profile id)` pairs into profiles.
+
+    :rtype: list of :mod:`question.models.Profile`, in the order of
+            `matches`, each with the match percentage in `match`.
+    """
+    profiles = Profile.objects.select_related('user').in_bulk(
+        [pk for match, pk in matches]
+    )
+    result = []
+    for match, pk in matches:
+        if pk not in profiles:
+            continue
+        other = profiles[pk]
+        other.match = match
+        result.append(other)
+    return result
+
+
+def stored_matches(profile, k=10):
+    """
+    .. function:: stored_matches(profile, k=10)
+
+    The `k` best matches of `profile` from its
+    :mod:`question.models.MatchList`, without those that are no longer
+    compatible.
+
+    :rtype: list of `(match, profile id)`, best match first, or None if
+            `profile` has no match list yet or `k` exceeds `TOP_MATCHES`.
+    """
+    if k > TOP_MATCHES:
+        return None
+    match_list = MatchList.objects.filter(profile=profile).first()
+    if match_list is None:
+        return None
+    entries = match_list.entries()
+    compatible = set(Profile.objects.compatible(profile).filter(
+        pk__in=[pk for pk, match in entries]
+    ).values_list('pk', flat=True))
+    return [
+        (match, pk) for pk, match in entries if pk in compatible
+    ][:k]
+
+
+def best_matches(profile, k=10, min_age=None, max_age=None):
+    """
+    .. function:: best_matches(profile, k=10, min_age=None, max_age=None)
+
+    The `k` best matches for `profile` among the public profiles it is
+    looking for, and that are looking for it, optionally aged `min_age` to
+    `max_age`.
+
+    Without an age window, the matches stored by :func:`rescore` are
+    served (see :func:`stored_matches`). Otherwise, profiles that fail a
+    dealbreaker with `profile` are pruned beforehand if a
+    :mod:`question.indexes.DealbreakerIndex` is available. With the
+    `QUESTIONS_APPROXIMATE_MATCHES` setting, only the nearest neighbours
+    from :mod:`question.indexes.ValueLSH` are scored.
+
+    :rtype: list of :mod:`question.models.Profile`, best match first, each
+            with the match percentage in `match`.
+    """
+    from .indexes import approximate_matches, dealbreakers
+    candidates = match_candidates(profile, min_age, max_age)
+    matches = None
+    if min_age is None and max_age is None:
+        matches = stored_matches(profile, k)
+    if matches is None and getattr(
+            settings, 'QUESTIONS_APPROXIMATE_MATCHES', False):
+        matches = approximate_matches(profile, k, min_age, max_age)
+    if matches is None:
+        index = dealbreakers()
+        matches = top_matches(
+            profile,
+            candidates,
+            k,
+            exclude=index.excluded(profile.pk) if index is not None else None
+        )
+    return load_matches(matches)
+
+# vim: ts=4 et sw=4 sts=4
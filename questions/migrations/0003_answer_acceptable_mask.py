@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_acceptable_mask(apps, schema_editor):
+    """
+    Compute `acceptable_mask` for existing answers.
+    """
+    PossibleAnswer = apps.get_model('questions', 'PossibleAnswer')
+    Answer = apps.get_model('questions', 'Answer')
+    positions = {}
+    counts = {}
+    for pk, question_id in PossibleAnswer.objects.order_by(
+            'question', 'pk').values_list('pk', 'question_id'):
+        positions[pk] = counts.get(question_id, 0)
+        counts[question_id] = positions[pk] + 1
+    masks = {}
+    for answer_id, possibleanswer_id in Answer.acceptable_answer.through.\
+            objects.values_list('answer_id', 'possibleanswer_id').iterator():
+        if positions.get(possibleanswer_id, 32) < 32:
+            masks[answer_id] = masks.get(answer_id, 0) | \
+                (1 << positions[possibleanswer_id])
+    for answer_id, mask in masks.items():
+        Answer.objects.filter(pk=answer_id).update(acceptable_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0002_matchlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='acceptable_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_acceptable_mask, migrations.RunPython.noop),
+    ]
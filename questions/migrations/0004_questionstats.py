@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0003_answer_acceptable_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PossibleAnswerStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer_count', models.IntegerField(default=0)),
+                ('male_answer_count', models.IntegerField(default=0)),
+                ('female_answer_count', models.IntegerField(default=0)),
+                ('acceptable_count', models.IntegerField(default=0)),
+                ('possible_answer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='questions.PossibleAnswer')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='possible_answer_stats', to='questions.Question')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuestionStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer_count', models.IntegerField(default=0)),
+                ('male_answer_count', models.IntegerField(default=0)),
+                ('female_answer_count', models.IntegerField(default=0)),
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='questions.Question')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0004_questionstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='possibleanswerstats',
+            name='female_acceptable_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='possibleanswerstats',
+            name='male_acceptable_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questions', '0005_possibleanswerstats_gender_acceptable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionstats',
+            name='female_accept_all_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='questionstats',
+            name='male_accept_all_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -6,11 +6,35 @@
 """
 
 from braces.views import LoginRequiredMixin
+from questions.caching import profile_cache
 from questions.models import Profile
 from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse
 
 
+def get_match_profile(request):
+    """
+    Resolve the profile of the logged in user once per request, and attach
+    it as `request.match_profile` (None without one).
+
+    Profiles are kept in :mod:`question.caching.profile_cache` across
+    requests, so most requests do not query for the profile at all.
+    """
+    if not hasattr(request, 'match_profile'):
+        profile = None
+        user = request.user
+        if user.is_authenticated():
+            profile = profile_cache.get(user.pk)
+            if profile is None:
+                profile = Profile.objects.select_related('user').filter(
+                    user=user
+                ).first()
+                if profile is not None:
+                    profile_cache.set(user.pk, profile)
+        request.match_profile = profile
+    return request.match_profile
+
+
 class ProfileRequiredMixin(LoginRequiredMixin):
     """
     Mixin for all pages that require a userprofile.
@@ -18,12 +42,35 @@ class ProfileRequiredMixin(LoginRequiredMixin):
     If user has no profile, redirect to the profile page first.
     """
     def dispatch(self, request, *args, **kwargs):
-        try:
-            profile = Profile.objects.get(user=request.user)
-        except Profile.DoesNotExist:
+        if request.user.is_authenticated() and \
+                get_match_profile(request) is None:
             return HttpResponseRedirect(reverse('question:profile-edit'))
 
         return super(
             ProfileRequiredMixin,
             self
         ).dispatch(request, *args, **kwargs)
+
+
+class MatchQueryMixin(object):
+    """
+    Mixin for views listing best matches.
+
+    Reads the number of matches `k` and an optional age window
+    `min_age`/`max_age` from the query string.
+    """
+    max_matches = 100
+    """Upper limit for `k`."""
+
+    default_matches = 10
+    """Number of matches if `k` is not given."""
+
+    def get_match_kwargs(self):
+        kwargs = {'k': self.default_matches}
+        for name in ('k', 'min_age', 'max_age'):
+            try:
+                kwargs[name] = int(self.request.GET[name])
+            except (KeyError, ValueError):
+                pass
+        kwargs['k'] = max(1, min(kwargs['k'], self.max_matches))
+        return kwargs
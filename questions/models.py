@@ -8,6 +8,7 @@ ORM models to store :mod:`question.models.Profile` persistantly.
 
 """
 
+import json
 import logging
 from datetime import date
 from dateutil.relativedelta import relativedelta
@@ -24,14 +25,21 @@ from category.models import Category
 from .managers import ProfileManager
 from .managers import QuestionManager
 from .managers import AnswerManager
+from .managers import PossibleAnswerManager
+from .managers import QuestionStatsManager
 
 from .constants import GENDER_CHOICES
 from .constants import LOOKFOR_CHOICES
 from .constants import VALUE_CHOICES
 from .constants import IMPORTANCE_CHOICES
+from .constants import MAX_POSSIBLE_ANSWERS
+from .constants import TOP_MATCHES
 
 logger = logging.getLogger(__name__)
 
+MATCHING_FIELDS = ('is_public', 'gender', 'lookfor')
+"""Fields of a profile which decide whom it is matched with."""
+
 
 class Profile(models.Model):
     """
@@ -68,11 +76,37 @@ class Profile(models.Model):
     objects = ProfileManager()
     """Use :mod:`question.models.ProfileManager` for Profile.objects."""
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the gender as loaded, see :mod:`question.stats`, and
+        everything matching depends on, see `matching_changed`.
+        """
+        instance = super(Profile, cls).from_db(db, field_names, values)
+        instance._loaded_gender = instance.__dict__.get('gender')
+        instance._loaded_matching = tuple(
+            instance.__dict__.get(name) for name in MATCHING_FIELDS
+        )
+        return instance
+
+    def matching_changed(self):
+        """
+        Whether any of `MATCHING_FIELDS` changed since the profile was
+        loaded or this method was called last.
+        """
+        loaded = getattr(self, '_loaded_matching', None)
+        self._loaded_matching = tuple(
+            getattr(self, name) for name in MATCHING_FIELDS
+        )
+        return loaded is not None and loaded != self._loaded_matching
+
     @property
     def age(self):
         """
         Calculate a users age in years.
         """
+        if self.dob is None:
+            return None
         return relativedelta(date.today(), self.dob).years
 
     @property
@@ -93,6 +127,30 @@ class Profile(models.Model):
 #            result[str(a.category)] += 1
         return (result,)
 
+    def acceptance(self):
+        """
+        :rtype: dict `question id -> (male, female)`, the share of male and
+                female users who would accept the answers of this profile.
+
+        .. seealso:: :mod:`question.managers.AnswerManager.acceptance`
+        """
+        return Answer.objects.acceptance(self)
+
+    def match_percent(self, other):
+        """
+        How well this profile matches `other`, in percent.
+
+        .. seealso:: :mod:`question.matching`
+        """
+        from .matching import match_percent
+        return match_percent(self, other)
+
+    def natural_key(self):
+        """
+        Profiles are identified by the username of their user.
+        """
+        return (self.user.username,)
+
     def __str__(self):
         """
         Unicode representation of self
@@ -149,14 +207,15 @@ class Question(models.Model):
         """
         :rtype: count of possible answers for this question.
 
+        Prefetched possible answers are counted without a query.
         """
         return self.possible_answer.all().count()
 
     def user_answer(self, user):
         """
-        :rtype: user answer for this question
+        :rtype: answer of the profile `user` for this question, or None.
         """
-        return self.answers.get(user=user)
+        return self.answers.filter(profile=user).first()
 
     def has_answer(self, user):
         """
@@ -165,10 +224,7 @@ class Question(models.Model):
 
         :rtype: True or False, whether the question was answered.
         """
-        if self.answers.filter(profile=user).count():
-            return True
-        else:
-            return False
+        return self.answers.filter(profile=user).exists()
 
     def last_answer(self):
         """
@@ -180,27 +236,60 @@ class Question(models.Model):
         else:
             return answer[0].when
 
+    def statistics(self):
+        """
+        :rtype: :mod:`question.models.QuestionStats` of this question,
+                counted from scratch the first time it is needed.
+        """
+        try:
+            return self.stats
+        except QuestionStats.DoesNotExist:
+            self.stats = QuestionStats.objects.refresh(self)
+            return self.stats
+
+    def answer_stats(self):
+        """
+        :rtype: list of `(possible answer, PossibleAnswerStats or None)`,
+                read once per instance.
+        """
+        if not hasattr(self, '_answer_stats'):
+            self.statistics()
+            self._answer_stats = []
+            for answer in self.possible_answer.select_related(
+                    'stats').order_by('pk'):
+                try:
+                    stats = answer.stats
+                except PossibleAnswerStats.DoesNotExist:
+                    stats = None
+                self._answer_stats.append((answer, stats))
+        return self._answer_stats
+
     def male_answer_count(self):
         """
         :rtype: How often male users answered this question.
         """
-        return self.answers.filter(
-            profile__user__match_profile__gender='M'
-        ).count()
+        if hasattr(self, 'male_answer_total'):
+            return self.male_answer_total
+        return self.statistics().male_answer_count
 
     def female_answer_count(self):
         """
         :rtype: How often female users answered this question.
         """
-        return self.answers.filter(
-            profile__user__match_profile__gender='F'
-        ).count()
+        if hasattr(self, 'female_answer_total'):
+            return self.female_answer_total
+        return self.statistics().female_answer_count
 
     def all_answer_count(self):
         """
         :rtype: How often this question was answered.
+
+        Annotations of :mod:`question.managers.QuestionManager.with_stats`
+        are used if present.
         """
-        return self.answers.all().count()
+        if hasattr(self, 'answer_total'):
+            return self.answer_total
+        return self.statistics().answer_count
 
     def male_quote(self):
         answers = self.all_answer_count()
@@ -218,17 +307,29 @@ class Question(models.Model):
 
     def male_matches(self, user):
         """
-        return quote of answers that would accept the users answer
+        return quote of male answers that would accept the users answer
+
+        :rtype: share between 0 and 1, or None if the question was not
+                answered by `user` or by any man.
+
+        .. seealso:: :mod:`question.managers.AnswerManager.acceptance`
         """
-        answer = self.user_answer(user)
-        raise NotImplemented
+        male, female = Answer.objects.acceptance(user, [self]).get(
+            self.pk, (None, None)
+        )
+        return male
 
     def female_matches(self, user):
         """
-        return quote of answers that would accept the users answer
+        return quote of female answers that would accept the users answer
+
+        :rtype: share between 0 and 1, or None if the question was not
+                answered by `user` or by any woman.
         """
-        answer = self.user_answer(user)
-        raise NotImplemented
+        male, female = Answer.objects.acceptance(user, [self]).get(
+            self.pk, (None, None)
+        )
+        return female
 
     def answer_percent(self):
         """
@@ -237,11 +338,8 @@ class Question(models.Model):
         """
         result = {}
         answer_count = float(self.all_answer_count())
-        for answer in self.possible_answers():
-            user_answer_count = float(Answer.objects.filter(
-                question=self,
-                user_answer=answer
-            ).count())
+        for answer, stats in self.answer_stats():
+            user_answer_count = float(stats.answer_count if stats else 0)
             if user_answer_count > 0:
                 """Only if somebody answered this question before."""
                 result[answer] = int(
@@ -255,15 +353,12 @@ class Question(models.Model):
     def acceptable_percent(self):
         """
         returns an dictionairy where the key is the possible answer and the
-        value is the percent of give answers
+        value is the percent of answers that would accept it.
         """
         answer_count = float(self.all_answer_count())
         result = {}
-        for answer in self.possible_answers():
-            acceptable_answer_count = Answer.objects.filter(
-                question=self,
-                acceptable_answer=answer
-            ).count()
+        for answer, stats in self.answer_stats():
+            acceptable_answer_count = stats.acceptable_count if stats else 0
             if answer_count > 0:
                 result[answer] = int(
                     (acceptable_answer_count / answer_count) * 100.0)
@@ -271,6 +366,18 @@ class Question(models.Model):
                 result[answer] = 0
         return result
 
+    def answer_positions(self):
+        """
+        :rtype: dict `possible answer id -> position` for this question.
+
+        .. seealso:: :mod:`question.managers.PossibleAnswerManager.positions`
+        """
+        positions, counts = PossibleAnswer.objects.positions([self.pk])
+        return positions
+
+    def natural_key(self):
+        return (self.slug,)
+
     def __str__(self):
         return self.question
 
@@ -290,6 +397,8 @@ class PossibleAnswer(models.Model):
 
     value = models.CharField(max_length=1, choices=VALUE_CHOICES, default='2')
 
+    objects = PossibleAnswerManager()
+
     def __str__(self):
         return str(self.answer)
 
@@ -327,6 +436,13 @@ class Answer(models.Model):
     )
     """The answers the user would allow from a potential matching partner."""
 
+    acceptable_mask = models.BigIntegerField(default=0, editable=False)
+    """
+    `acceptable_answer` as a bitmask, with the bit of each possible answer
+    at its position within the question. Kept in sync by
+    :mod:`question.signals`.
+    """
+
     importance = models.CharField(
         max_length=1,
         choices=IMPORTANCE_CHOICES, default='2'
@@ -355,14 +471,172 @@ class Answer(models.Model):
             self.acceptable_answer.all()
         )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the answer as loaded, see :mod:`question.stats`.
+        """
+        instance = super(Answer, cls).from_db(db, field_names, values)
+        instance._loaded_user_answer_id = instance.__dict__.get(
+            'user_answer_id'
+        )
+        return instance
+
     def save(self, *args, **kwargs):
         super(Answer, self).save(*args, **kwargs)
 
+    def accepts(self, position):
+        """
+        :rtype: True if the possible answer at `position` is acceptable.
+        """
+        return bool((self.acceptable_mask >> position) & 1)
+
+    def update_acceptable_mask(self):
+        """
+        Recompute and store `acceptable_mask` from `acceptable_answer`.
+        """
+        positions = self.question.answer_positions()
+        mask = 0
+        for pk in self.acceptable_answer.values_list('pk', flat=True):
+            if positions.get(pk, MAX_POSSIBLE_ANSWERS) < MAX_POSSIBLE_ANSWERS:
+                mask |= 1 << positions[pk]
+        self.acceptable_mask = mask
+        Answer.objects.filter(pk=self.pk).update(acceptable_mask=mask)
+        return mask
+
     @models.permalink
     def get_absolute_url(self):
         return ('question:answer-detail', [str(self.id)])
 
 
+class MatchList(models.Model):
+    """
+    The best matches of a profile, kept up to date as answers change.
+
+    Instead of one row per pair of profiles, every profile stores a bounded
+    list of its `TOP_MATCHES` best matches.
+
+    .. seealso:: :mod:`question.matching.rescore`
+    """
+    profile = models.OneToOneField(Profile, related_name="match_list")
+    """The profile these matches are for."""
+
+    matches = models.TextField(default='[]')
+    """JSON list of `[profile id, match]`, best match first."""
+
+    updated = models.DateTimeField(auto_now=True)
+    """When the list was last changed."""
+
+    def entries(self):
+        """
+        :rtype: list of `(profile id, match)`, best match first.
+        """
+        return [tuple(entry) for entry in json.loads(self.matches)]
+
+    def merge(self, scores, k=TOP_MATCHES):
+        """
+        Update the list with new `scores`, a dict `profile id -> match`.
+
+        Matches of 0 remove a profile from the list.
+
+        :rtype: True if the list changed.
+        """
+        current = dict(self.entries())
+        merged = dict(current)
+        merged.update(scores)
+        best = sorted(
+            ((pk, match) for pk, match in merged.items() if match > 0),
+            key=lambda entry: (-entry[1], entry[0])
+        )[:k]
+        if best == sorted(current.items(), key=lambda e: (-e[1], e[0])):
+            return False
+        self.matches = json.dumps(best)
+        return True
+
+    def __str__(self):
+        return u'%s (%s matches)' % (self.profile_id, len(self.entries()))
+
+
+class QuestionStats(models.Model):
+    """
+    How often a question was answered, kept up to date by
+    :mod:`question.stats` instead of being counted on every request.
+    """
+    question = models.OneToOneField(Question, related_name="stats")
+    """The question these counts are for."""
+
+    answer_count = models.IntegerField(default=0)
+    """How often the question was answered."""
+
+    male_answer_count = models.IntegerField(default=0)
+    """How often male users answered the question."""
+
+    female_answer_count = models.IntegerField(default=0)
+    """How often female users answered the question."""
+
+    male_accept_all_count = models.IntegerField(default=0)
+    """How many answers of male users accept every possible answer."""
+
+    female_accept_all_count = models.IntegerField(default=0)
+    """How many answers of female users accept every possible answer."""
+
+    objects = QuestionStatsManager()
+
+    def __str__(self):
+        return u'%s (%s answers)' % (self.question_id, self.answer_count)
+
+
+class PossibleAnswerStats(models.Model):
+    """
+    How often a possible answer was given and accepted.
+
+    .. seealso:: :mod:`question.models.QuestionStats`
+    """
+    COUNTERS = (
+        'answer_count',
+        'male_answer_count',
+        'female_answer_count',
+        'acceptable_count',
+        'male_acceptable_count',
+        'female_acceptable_count',
+    )
+
+    possible_answer = models.OneToOneField(
+        PossibleAnswer,
+        related_name="stats"
+    )
+    """The possible answer these counts are for."""
+
+    question = models.ForeignKey(
+        Question,
+        related_name="possible_answer_stats"
+    )
+    """The question of `possible_answer`."""
+
+    answer_count = models.IntegerField(default=0)
+    """How often users gave this answer."""
+
+    male_answer_count = models.IntegerField(default=0)
+    """How often male users gave this answer."""
+
+    female_answer_count = models.IntegerField(default=0)
+    """How often female users gave this answer."""
+
+    acceptable_count = models.IntegerField(default=0)
+    """How many users would accept this answer."""
+
+    male_acceptable_count = models.IntegerField(default=0)
+    """How many male users would accept this answer."""
+
+    female_acceptable_count = models.IntegerField(default=0)
+    """How many female users would accept this answer."""
+
+    def __str__(self):
+        return u'%s (%s answers)' % (
+            self.possible_answer_id, self.answer_count
+        )
+
+
 class CatScore(models.Model):
     user = models.ForeignKey(User, unique=True)
     cat = models.ForeignKey(Category, unique=True)
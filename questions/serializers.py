@@ -5,8 +5,10 @@
 :mod:`question.serializers` -- serializers
 """
 
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
-from .models import Question, PossibleAnswer
+from .constants import IMPORTANCE_CHOICES
+from .models import Question, PossibleAnswer, Profile
 from category.models import Category
 
 
@@ -36,6 +38,67 @@ class QuestionSerializer(serializers.ModelSerializer):
         )
 
 
+class MatchSerializer(serializers.ModelSerializer):
+    username = serializers.StringRelatedField(source='user')
+    match = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Profile
+        fields = (
+            'id',
+            'username',
+            'gender',
+            'lookfor',
+            'age',
+            'match',
+        )
+
+
+class AnswerRecordSerializer(serializers.Serializer):
+    """
+    One answer of a batch, see :mod:`question.bulk.bulk_answer`.
+
+    Possible answers are validated against `possible_answers` from the
+    context, as returned by :mod:`question.caching.possible_answer_ids`.
+
+    Fields left out keep their value when an existing answer is updated,
+    new answers get the defaults of :mod:`question.models.Answer`.
+    """
+    question = serializers.IntegerField()
+    user_answer = serializers.IntegerField(allow_null=True, required=False)
+    acceptable_answer = serializers.ListField(
+        child=serializers.IntegerField(), required=False
+    )
+    importance = serializers.ChoiceField(
+        choices=IMPORTANCE_CHOICES, required=False
+    )
+    is_public = serializers.BooleanField(required=False)
+    description = serializers.CharField(
+        required=False, allow_blank=True, allow_null=True
+    )
+
+    def validate(self, data):
+        possible_answers = self.context['possible_answers'].get(
+            data['question']
+        )
+        if not possible_answers:
+            raise serializers.ValidationError(
+                {'question': _('Unknown question.')}
+            )
+        user_answer = data.get('user_answer')
+        if user_answer is not None and user_answer not in possible_answers:
+            raise serializers.ValidationError(
+                {'user_answer': _('Not an answer to this question.')}
+            )
+        acceptable = set(data.get('acceptable_answer', ()))
+        if acceptable - set(possible_answers):
+            raise serializers.ValidationError(
+                {'acceptable_answer': _('Not an answer to this question.')}
+            )
+        data['acceptable_answer'] = sorted(acceptable)
+        return data
+
+
 class CategorySerializer(serializers.ModelSerializer):
     def count(self):
         """
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.signals` -- keep derived data in sync with answers.
+
+Connected by :mod:`question.apps.QuestionsConfig`.
+"""
+
+import logging
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from category.models import Category
+
+from .caching import bump_categories_version
+from .caching import bump_possible_answers_version
+from .caching import bump_profile_version
+from .caching import bump_question_version
+from .caching import profile_cache
+from .indexes import profile_changed
+from .matching import rematch, rescore_later
+from .models import Answer, PossibleAnswer, Profile, Question
+from .snapshot import log_answer, log_deleted_answer, log_question
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, created=False, **kwargs):
+    """
+    Keep the :mod:`question.indexes.ProfileIndex` and the profile cache of
+    this process fresh, and the matches of the profile compatible.
+    """
+    profile_changed(instance)
+    profile_cache.discard(instance.user_id)
+    if instance.matching_changed() and not created:
+        profile_id = instance.pk
+        transaction.on_commit(lambda: rematch(profile_id))
+    if stats.gender_changed(instance):
+        for question_id in Answer.objects.filter(
+                profile=instance).values_list('question_id', flat=True):
+            bump_question_version(question_id)
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    profile_changed(instance, deleted=True)
+    profile_cache.discard(instance.user_id)
+
+
+@receiver(post_save, sender=Answer)
+def answer_saved(sender, instance, created=False, **kwargs):
+    """
+    Rescore the matches of the profile whose answer changed, once the
+    transaction commits, see :mod:`question.matching.rescore_later`.
+    """
+    stats.answer_saved(instance, created)
+    bump_profile_version(instance.profile_id)
+    bump_question_version(instance.question_id)
+    log_answer(instance)
+    rescore_later(instance.profile_id, instance.question_id)
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted(sender, instance, **kwargs):
+    """
+    Rescore the matches of the profile whose answer was deleted.
+    """
+    stats.answer_deleted(instance)
+    bump_profile_version(instance.profile_id)
+    bump_question_version(instance.question_id)
+    log_deleted_answer(instance.profile_id, instance.question_id)
+    rescore_later(instance.profile_id, instance.question_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    bump_question_version(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump_categories_version()
+
+
+@receiver(post_save, sender=PossibleAnswer)
+def possible_answer_changed(sender, instance, **kwargs):
+    """
+    Possible answers are part of the cached statistics of their question.
+    """
+    bump_question_version(instance.question_id)
+    bump_possible_answers_version(instance.question_id)
+
+
+@receiver(post_delete, sender=PossibleAnswer)
+def possible_answer_deleted(sender, instance, **kwargs):
+    """
+    Later possible answers of the question moved down one position, so
+    acceptable answer masks and the snapshot are brought up to date.
+    """
+    bump_question_version(instance.question_id)
+    bump_possible_answers_version(instance.question_id)
+    changed = Answer.objects.update_acceptable_masks(instance.question_id)
+    if changed:
+        stats.masks_changed(instance.question_id)
+    for profile_id in set(Answer.objects.filter(
+            pk__in=changed).values_list('profile_id', flat=True)):
+        bump_profile_version(profile_id)
+    log_question(instance.question_id)
+
+
+@receiver(m2m_changed, sender=Answer.acceptable_answer.through)
+def acceptable_answer_changed(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    """
+    Update `Answer.acceptable_mask` and rescore the matches of the profile
+    whose acceptable answers changed.
+    """
+    if action == 'pre_clear' and reverse:
+        """`pk_set` is not given for `post_clear`."""
+        instance._cleared_answers = list(
+            instance.acceptable_answer.values_list('pk', flat=True)
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        """`instance` is a possible answer, `pk_set` are answers."""
+        if action == 'post_clear':
+            pk_set = instance.__dict__.pop('_cleared_answers', ())
+        for answer in Answer.objects.filter(pk__in=pk_set or ()):
+            acceptable_answer_changed(
+                sender, answer, action, False, None, **kwargs
+            )
+        return
+    old_mask = instance.acceptable_mask
+    stats.acceptable_changed(
+        instance, old_mask, instance.update_acceptable_mask()
+    )
+    bump_profile_version(instance.profile_id)
+    bump_question_version(instance.question_id)
+    log_answer(instance)
+    rescore_later(instance.profile_id, instance.question_id)
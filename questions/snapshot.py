@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.snapshot` -- answer matrix snapshots on disk.
+
+A snapshot holds the arrays of an :mod:`question.matching.AnswerMatrix` as
+`.npy` files, which are opened as :class:`numpy.memmap` instead of being
+read, so opening a snapshot takes milliseconds regardless of its size.
+
+Every snapshot is written to a directory of its own within the snapshot
+directory, and becomes current at once when the `CURRENT` file is
+replaced to name it. Readers never see a snapshot half written, and the
+previous snapshot is kept for readers that are still opening it.
+
+Changes to answers after the snapshot was written are appended to a delta
+log (`deltas.bin`) of fixed size records, and replayed on top of the
+snapshot when it is opened. Records are only appended once the transaction
+that changed the answer committed, and writing a new snapshot drops the
+records it already holds.
+
+Answer arrays are written with spare rows and columns, which take the
+profiles and questions that show up in the log, so replaying the log
+only copies the pages it touches, rather than the whole matrix.
+
+Snapshots are configured with the `QUESTIONS_SNAPSHOT_DIR` setting. As
+possible answers are referred to by position, a new snapshot is required
+after possible answers were deleted.
+"""
+
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .constants import MAX_POSSIBLE_ANSWERS
+from .matching import AnswerMatrix
+from .matching import IMPORTANCE_CODES
+from .matching import UNANSWERED
+from .matching import possible_answer_positions
+from .models import Answer
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+IDS = ('profile_ids', 'question_ids')
+"""Ids of the rows and columns of a snapshot."""
+
+ARRAYS = (
+    ('answers', UNANSWERED),
+    ('importance', 0),
+    ('acceptable', 0),
+)
+"""Answer arrays of a snapshot, with the value of their spare cells."""
+
+DELTA_DTYPE = np.dtype([
+    ('profile', '<i8'),
+    ('question', '<i8'),
+    ('answer', 'i1'),
+    ('importance', 'i1'),
+    ('acceptable', '<u4'),
+])
+"""One record of the delta log: the new state of one answer."""
+
+DELTA_LOG = 'deltas.bin'
+CURRENT = 'CURRENT'
+PREFIX = 'snapshot-'
+
+SPARE_ROWS = 0.1
+"""Spare rows of a snapshot, as a share of its rows."""
+
+MIN_SPARE_ROWS = 1000
+
+SPARE_COLUMNS = 16
+
+
+def snapshot_dir():
+    """
+    :rtype: the configured snapshot directory, or None.
+    """
+    return getattr(settings, 'QUESTIONS_SNAPSHOT_DIR', None)
+
+
+def log_size(path):
+    try:
+        return os.path.getsize(os.path.join(path, DELTA_LOG))
+    except OSError:
+        return 0
+
+
+def current_snapshot(path):
+    """
+    :rtype: the directory of the current snapshot in `path`, or None if
+            none was written yet.
+    """
+    try:
+        with open(os.path.join(path, CURRENT)) as current:
+            return os.path.join(path, current.read().strip())
+    except (IOError, OSError):
+        return None
+
+
+def _lock(log):
+    """
+    Lock the open delta log `log` until it is closed, where supported.
+    """
+    if fcntl is not None:
+        fcntl.flock(log.fileno(), fcntl.LOCK_EX)
+
+
+def _is_current(log, filename):
+    """
+    :rtype: whether the open file `log` still is `filename`, and was not
+            replaced by `_switch` in the meantime.
+    """
+    try:
+        return os.fstat(log.fileno()).st_ino == os.stat(filename).st_ino
+    except OSError:
+        return False
+
+
+def _switch(path, name, offset):
+    """
+    Make the snapshot `name` in `path` current, and drop the records
+    before `offset` from the delta log, as the snapshot holds them.
+
+    The snapshot is switched before the log is replaced, as replaying
+    records the snapshot holds already is harmless, while missing records
+    is not.
+    """
+    filename = os.path.join(path, DELTA_LOG)
+    with open(filename, 'a+b') as log:
+        _lock(log)
+        log.seek(offset)
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as truncated:
+            shutil.copyfileobj(log, truncated)
+        current = os.path.join(path, CURRENT + '.tmp')
+        with open(current, 'w') as f:
+            f.write(name)
+        os.rename(current, os.path.join(path, CURRENT))
+        os.rename(tmp, filename)
+
+
+def _spare(n):
+    return max(MIN_SPARE_ROWS, int(n * SPARE_ROWS))
+
+
+def write_snapshot(path, matrix=None):
+    """
+    .. function:: write_snapshot(path, matrix=None)
+
+    Write a snapshot of all answers (or `matrix`) to the directory `path`,
+    make it current and fold the delta log into it. Snapshots older than
+    the previous one are removed.
+
+    The log offset is taken before the answers are loaded, so changes made
+    while the snapshot is written are kept in the log and replayed again,
+    which is harmless as every record holds the full state of an answer.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    offset = log_size(path)
+    if matrix is None:
+        matrix = AnswerMatrix.build()
+    name = '%s%013d-%d' % (PREFIX, int(time.time() * 1000), os.getpid())
+    directory = os.path.join(path, name)
+    os.mkdir(directory)
+    for ids in IDS:
+        np.save(os.path.join(directory, ids + '.npy'), getattr(matrix, ids))
+    rows, columns = len(matrix.profile_ids), len(matrix.question_ids)
+    shape = (rows + _spare(rows), columns + SPARE_COLUMNS)
+    for array, spare in ARRAYS:
+        source = getattr(matrix, array)
+        target = np.lib.format.open_memmap(
+            os.path.join(directory, array + '.npy'), mode='w+',
+            dtype=source.dtype, shape=shape
+        )
+        target[...] = spare
+        target[:rows, :columns] = source
+        target.flush()
+        del target
+    _switch(path, name, offset)
+
+    for old in sorted(
+            old for old in os.listdir(path) if old.startswith(PREFIX)
+    )[:-2]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return matrix
+
+
+def read_deltas(path, offset=0):
+    """
+    :rtype: array of `DELTA_DTYPE` records from `offset` on.
+    """
+    filename = os.path.join(path, DELTA_LOG)
+    if not os.path.exists(filename):
+        return np.zeros(0, dtype=DELTA_DTYPE)
+    return np.fromfile(filename, dtype=DELTA_DTYPE, offset=offset)
+
+
+def _grow(matrix, profile_ids, question_ids, spare=None):
+    """
+    Add rows for `profile_ids` and columns for `question_ids` to `matrix`.
+
+    :param spare: the answer arrays `matrix` is a part of, as loaded from a
+                  snapshot. Their spare rows and columns are used if they
+                  suffice, otherwise `matrix` is copied.
+    """
+    profile_ids = np.concatenate((matrix.profile_ids, profile_ids))
+    question_ids = np.concatenate((matrix.question_ids, question_ids))
+    shape = (len(profile_ids), len(question_ids))
+    if spare is not None:
+        if (shape[0] <= spare[0].shape[0] and
+                shape[1] <= spare[0].shape[1]):
+            return AnswerMatrix(profile_ids, question_ids, *[
+                array[:shape[0], :shape[1]] for array in spare
+            ])
+        logger.warning(
+            "The snapshot ran out of spare rows or columns and is copied; "
+            "write a new snapshot."
+        )
+    grown = AnswerMatrix.empty(profile_ids, question_ids)
+    rows, columns = matrix.answers.shape
+    grown.answers[:rows, :columns] = matrix.answers
+    grown.importance[:rows, :columns] = matrix.importance
+    grown.acceptable[:rows, :columns] = matrix.acceptable
+    return grown
+
+
+def apply_deltas(matrix, deltas, spare=None):
+    """
+    Replay `deltas` on `matrix`, adding rows and columns as required.
+
+    :param spare: see :func:`_grow`.
+    :rtype: the updated matrix, which shares its arrays with `matrix` or
+            `spare` unless it had to be copied.
+    """
+    if not len(deltas):
+        return matrix
+    rows, found_rows = matrix.rows(deltas['profile'])
+    columns, found_columns = matrix.columns(deltas['question'])
+    if not (found_rows.all() and found_columns.all()):
+        matrix = _grow(
+            matrix,
+            np.unique(deltas['profile'][~found_rows]),
+            np.unique(deltas['question'][~found_columns]),
+            spare
+        )
+        rows, found_rows = matrix.rows(deltas['profile'])
+        columns, found_columns = matrix.columns(deltas['question'])
+    """Only the latest record of every answer counts."""
+    cells = (rows * len(matrix.question_ids) + columns)[::-1]
+    cells, latest = np.unique(cells, return_index=True)
+    deltas = deltas[::-1][latest]
+    rows, columns = rows[::-1][latest], columns[::-1][latest]
+    matrix.answers[rows, columns] = deltas['answer']
+    matrix.importance[rows, columns] = deltas['importance']
+    matrix.acceptable[rows, columns] = deltas['acceptable']
+    return matrix
+
+
+def _load(filename):
+    try:
+        return np.load(filename, mmap_mode='c')
+    except ValueError:
+        """Empty arrays can not be mapped."""
+        return np.load(filename)
+
+
+def load_snapshot(path=None):
+    """
+    .. function:: load_snapshot(path=None)
+
+    Open the current snapshot in `path` (default: `QUESTIONS_SNAPSHOT_DIR`)
+    and replay the delta log on top of it.
+
+    Arrays are mapped copy-on-write, so replaying deltas only copies the
+    pages they touch and never changes the files. If another snapshot
+    became current while the log was read, that one is opened instead.
+
+    :rtype: :mod:`question.matching.AnswerMatrix`
+    :raises IOError: if no snapshot was written to `path` yet.
+    """
+    path = path or snapshot_dir()
+    while True:
+        directory = current_snapshot(path)
+        if directory is None:
+            raise IOError("No snapshot in %s." % path)
+        ids = [
+            _load(os.path.join(directory, name + '.npy')) for name in IDS
+        ]
+        spare = [
+            _load(os.path.join(directory, name + '.npy'))
+            for name, value in ARRAYS
+        ]
+        rows, columns = len(ids[0]), len(ids[1])
+        matrix = AnswerMatrix(ids[0], ids[1], *[
+            array[:rows, :columns] for array in spare
+        ])
+        deltas = read_deltas(path)
+        if current_snapshot(path) == directory:
+            break
+    logger.debug("Replaying %s deltas from %s.", len(deltas), path)
+    return apply_deltas(matrix, deltas, spare)
+
+
+def append_delta(path, profile_id, question_id, answer=UNANSWERED,
+                 importance=0, acceptable=0):
+    """
+    Append one record to the delta log in `path`, which is created if it
+    does not exist yet.
+
+    Records are small enough to be appended atomically, even by several
+    processes at once. The log is locked against `_switch`, and opened
+    again if it was replaced while waiting for the lock.
+    """
+    record = np.zeros(1, dtype=DELTA_DTYPE)
+    record[0] = (profile_id, question_id, answer, importance, acceptable)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            """Created concurrently."""
+            if not os.path.isdir(path):
+                raise
+    filename = os.path.join(path, DELTA_LOG)
+    while True:
+        with open(filename, 'ab') as log:
+            _lock(log)
+            if _is_current(log, filename):
+                log.write(record.tobytes())
+                return
+
+
+def _on_commit(path, append):
+    """
+    Call `append` once the transaction commits. A log that can not be
+    written only costs the snapshot its freshness, so errors are logged
+    instead of failing the request that already committed.
+    """
+    def callback():
+        try:
+            append()
+        except EnvironmentError:
+            logger.warning(
+                "Could not append to the delta log in %s.", path,
+                exc_info=True
+            )
+    transaction.on_commit(callback)
+
+
+def _log(path, positions, counts, profile_id, question_id, user_answer_id,
+         importance, acceptable):
+    position = positions.get(user_answer_id, UNANSWERED)
+    if position >= MAX_POSSIBLE_ANSWERS:
+        position = UNANSWERED
+    if not acceptable and position != UNANSWERED:
+        count = min(counts.get(question_id, 0), MAX_POSSIBLE_ANSWERS)
+        acceptable = (1 << count) - 1
+    append_delta(
+        path,
+        profile_id,
+        question_id,
+        position,
+        IMPORTANCE_CODES.get(importance, 0),
+        acceptable
+    )
+
+
+def log_answer(answer):
+    """
+    Append the current state of `answer` to the configured delta log, once
+    the transaction commits.
+    """
+    path = snapshot_dir()
+    if not path:
+        return
+    values = (
+        answer.profile_id, answer.question_id, answer.user_answer_id,
+        answer.importance, answer.acceptable_mask
+    )
+
+    def append():
+        positions, counts = possible_answer_positions([values[1]])
+        _log(path, positions, counts, *values)
+    _on_commit(path, append)
+
+
+def log_question(question_id):
+    """
+    Append the current state of all answers to question `question_id` to
+    the configured delta log, as the positions of its possible answers
+    changed, once the transaction commits.
+    """
+    path = snapshot_dir()
+    if not path:
+        return
+
+    def append():
+        positions, counts = possible_answer_positions([question_id])
+        for row in Answer.objects.filter(question=question_id).values_list(
+                'profile_id', 'user_answer_id', 'importance',
+                'acceptable_mask'
+        ).iterator():
+            _log(path, positions, counts, row[0], question_id, *row[1:])
+    _on_commit(path, append)
+
+
+def log_deleted_answer(profile_id, question_id):
+    """
+    Append the deletion of an answer to the configured delta log, once the
+    transaction commits.
+    """
+    path = snapshot_dir()
+    if path:
+        _on_commit(path, lambda: append_delta(path, profile_id, question_id))
+
+# vim: ts=4 et sw=4 sts=4
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.stats` -- keep question statistics up to date.
+
+:mod:`question.models.QuestionStats` and
+:mod:`question.models.PossibleAnswerStats` are counted from scratch the
+first time they are needed, and from then on adjusted by the changes of
+every single answer, as reported by :mod:`question.signals`.
+
+Counters are only ever changed with `UPDATE ... SET count = count + 1`, so
+concurrent answers do not lose updates. Whenever a counter that should be
+incremented does not exist yet, the whole question is counted again.
+
+:mod:`question.stats.rebuild` counts all questions at once, to fill the
+counters initially or to correct them.
+"""
+
+import logging
+from itertools import islice
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import Answer
+from .models import PossibleAnswer
+from .models import PossibleAnswerStats
+from .models import Profile
+from .models import Question
+from .models import QuestionStats
+
+logger = logging.getLogger(__name__)
+
+GENDER_COUNTERS = {
+    'M': 'male_answer_count',
+    'F': 'female_answer_count',
+}
+"""Counter of answers by gender."""
+
+GENDER_ACCEPTABLE_COUNTERS = {
+    'M': 'male_acceptable_count',
+    'F': 'female_acceptable_count',
+}
+"""Counter of acceptable answers by gender."""
+
+GENDER_ACCEPT_ALL_COUNTERS = {
+    'M': 'male_accept_all_count',
+    'F': 'female_accept_all_count',
+}
+"""Counter of answers without acceptable answers by gender."""
+
+GENDER_CODES = {'M': 1, 'F': 2}
+"""Column of a gender in the result of `count_by_gender`."""
+
+
+def _increment(model, delta, counters, **lookups):
+    """
+    Add `delta` to `counters` of the `model` rows matching `lookups`.
+
+    :rtype: number of rows updated.
+    """
+    return model.objects.filter(**lookups).update(**dict(
+        (counter, F(counter) + delta) for counter in counters
+    ))
+
+
+def _answer_counters(gender, counters=GENDER_COUNTERS,
+                     counter='answer_count'):
+    return [counter] + ([counters[gender]] if gender in counters else [])
+
+
+def _accept_all_counters(gender):
+    if gender in GENDER_ACCEPT_ALL_COUNTERS:
+        return [GENDER_ACCEPT_ALL_COUNTERS[gender]]
+    return []
+
+
+def _gender(profile_id):
+    return Profile.objects.filter(pk=profile_id).values_list(
+        'gender', flat=True
+    ).first()
+
+
+def answer_saved(answer, created):
+    """
+    Count a new answer, or move it to its new possible answer.
+    """
+    old = None if created else getattr(answer, '_loaded_user_answer_id', None)
+    new = answer.user_answer_id
+    answer._loaded_user_answer_id = new
+    if not created and old == new:
+        return
+    gender = _gender(answer.profile_id)
+    counters = _answer_counters(gender)
+    if created and not _increment(
+            QuestionStats, 1, counters + (
+                [] if answer.acceptable_mask else _accept_all_counters(gender)
+            ), question_id=answer.question_id):
+        QuestionStats.objects.refresh(answer.question_id)
+        return
+    if old is not None:
+        _increment(PossibleAnswerStats, -1, counters, possible_answer_id=old)
+    if new is not None and not _increment(
+            PossibleAnswerStats, 1, counters, possible_answer_id=new):
+        QuestionStats.objects.refresh(answer.question_id)
+
+
+def answers_created(profile, answers, acceptable):
+    """
+    Count new `answers` of `profile` which were created without signals,
+    such as with `bulk_create`. `acceptable` are the ids of the possible
+    answers accepted by them, answers without an `acceptable_mask` accept
+    every answer.
+
+    As a profile answers every question once, each question and possible
+    answer is counted at most once, so one `UPDATE` per counter suffices.
+    """
+    question_ids = [answer.question_id for answer in answers]
+    if not question_ids:
+        return
+    user_answers = [
+        answer.user_answer_id for answer in answers
+        if answer.user_answer_id is not None
+    ]
+    accept_all = [
+        answer.question_id for answer in answers
+        if not answer.acceptable_mask
+    ]
+    for model, counters, field, ids in (
+            (QuestionStats, _answer_counters(profile.gender),
+             'question_id', question_ids),
+            (QuestionStats, _accept_all_counters(profile.gender),
+             'question_id', accept_all),
+            (PossibleAnswerStats, _answer_counters(profile.gender),
+             'possible_answer_id', user_answers),
+            (PossibleAnswerStats, _answer_counters(
+                profile.gender, GENDER_ACCEPTABLE_COUNTERS,
+                'acceptable_count'), 'possible_answer_id', acceptable)):
+        if not counters:
+            continue
+        for chunk in chunks(ids, 500):
+            _increment(model, 1, counters, **{field + '__in': chunk})
+    _refresh_incomplete(question_ids, set(user_answers) | set(acceptable))
+
+
+def answers_updated(profile, user_answers, acceptable,
+                    accept_all=((), ())):
+    """
+    Count changes to answers of `profile` which were made without signals,
+    such as by :mod:`question.bulk.bulk_answer`.
+
+    :param user_answers: pair of lists of possible answer ids, which are no
+                         longer and which are newly given as answers.
+    :param acceptable: pair of lists of possible answer ids, which are no
+                       longer and which are newly accepted.
+    :param accept_all: pair of lists of question ids, whose answers no
+                       longer and which newly accept every answer.
+    """
+    counters = _answer_counters(profile.gender)
+    acceptable_counters = _answer_counters(
+        profile.gender, GENDER_ACCEPTABLE_COUNTERS, 'acceptable_count'
+    )
+    for delta, counters, ids in (
+            (-1, counters, user_answers[0]),
+            (1, counters, user_answers[1]),
+            (-1, acceptable_counters, acceptable[0]),
+            (1, acceptable_counters, acceptable[1])):
+        for chunk in chunks(ids, 500):
+            _increment(
+                PossibleAnswerStats, delta, counters,
+                possible_answer_id__in=chunk
+            )
+    counters = _accept_all_counters(profile.gender)
+    for delta, ids in ((-1, accept_all[0]), (1, accept_all[1])):
+        for chunk in chunks(ids if counters else (), 500):
+            _increment(
+                QuestionStats, delta, counters, question_id__in=chunk
+            )
+    _refresh_incomplete((), set(user_answers[1]) | set(acceptable[1]))
+
+
+def _refresh_incomplete(question_ids, expected):
+    """
+    Count the questions in `question_ids` without counters, and those of
+    the possible answers in `expected` without counters, again.
+    """
+    counted = set()
+    for chunk in chunks(question_ids, 500):
+        counted.update(QuestionStats.objects.filter(
+            question_id__in=chunk
+        ).values_list('question_id', flat=True))
+    complete = set()
+    for chunk in chunks(sorted(expected), 500):
+        complete.update(PossibleAnswerStats.objects.filter(
+            possible_answer_id__in=chunk
+        ).values_list('possible_answer_id', flat=True))
+    incomplete = set()
+    for chunk in chunks(sorted(expected - complete), 500):
+        incomplete.update(PossibleAnswer.objects.filter(
+            pk__in=chunk
+        ).values_list('question_id', flat=True))
+    for question_id in (set(question_ids) - counted) | incomplete:
+        QuestionStats.objects.refresh(question_id)
+
+
+def answer_deleted(answer):
+    """
+    Stop counting a deleted answer.
+
+    Counters which do not exist (anymore) are not counted again, as they
+    were most likely deleted along with the question.
+    """
+    gender = _gender(answer.profile_id)
+    counters = _answer_counters(gender)
+    _increment(QuestionStats, -1, counters + (
+        [] if answer.acceptable_mask else _accept_all_counters(gender)
+    ), question_id=answer.question_id)
+    if answer.user_answer_id is not None:
+        _increment(
+            PossibleAnswerStats, -1, counters,
+            possible_answer_id=answer.user_answer_id
+        )
+    if answer.acceptable_mask:
+        _acceptable_moved(answer, gender, answer.acceptable_mask, 0)
+
+
+def acceptable_changed(answer, old_mask, new_mask):
+    """
+    Count the change of the acceptable answers of `answer` from `old_mask`
+    to `new_mask`.
+
+    .. seealso:: :mod:`question.models.Answer.acceptable_mask`
+    """
+    if old_mask == new_mask:
+        return
+    gender = _gender(answer.profile_id)
+    counters = _accept_all_counters(gender)
+    if counters and bool(old_mask) != bool(new_mask):
+        """Answers without acceptable answers accept every answer."""
+        _increment(
+            QuestionStats, -1 if old_mask == 0 else 1, counters,
+            question_id=answer.question_id
+        )
+    _acceptable_moved(answer, gender, old_mask, new_mask)
+
+
+def _acceptable_moved(answer, gender, old_mask, new_mask):
+    """
+    Move the acceptable answer counters of `answer` from `old_mask` to
+    `new_mask`.
+    """
+    counters = _answer_counters(
+        gender, GENDER_ACCEPTABLE_COUNTERS, 'acceptable_count'
+    )
+    for pk, position in answer.question.answer_positions().items():
+        bit = 1 << position
+        if new_mask & bit and not old_mask & bit:
+            if not _increment(
+                    PossibleAnswerStats, 1, counters,
+                    possible_answer_id=pk):
+                QuestionStats.objects.refresh(answer.question_id)
+                return
+        elif old_mask & bit and not new_mask & bit:
+            _increment(
+                PossibleAnswerStats, -1, counters, possible_answer_id=pk
+            )
+
+
+def masks_changed(question_id):
+    """
+    Count the answers to question `question_id` which accept every answer
+    again, after their acceptable answer masks were recomputed, such as
+    when a possible answer was deleted.
+    """
+    counts = dict(Answer.objects.filter(
+        question_id=question_id, acceptable_mask=0
+    ).order_by().values_list('profile__gender').annotate(count=Count('pk')))
+    QuestionStats.objects.filter(question_id=question_id).update(**dict(
+        (counter, counts.get(gender, 0))
+        for gender, counter in GENDER_ACCEPT_ALL_COUNTERS.items()
+    ))
+
+
+def gender_changed(profile):
+    """
+    Move the answers of `profile` to the counters of its new gender.
+
+    :rtype: True if the gender changed.
+    """
+    old = getattr(profile, '_loaded_gender', None)
+    new = profile.gender
+    profile._loaded_gender = new
+    if old is None or old == new:
+        return False
+    for model, lookups, counters in (
+            (QuestionStats, {'question__answers__profile': profile},
+             GENDER_COUNTERS),
+            (QuestionStats, {'question__answers__profile': profile,
+                             'question__answers__acceptable_mask': 0},
+             GENDER_ACCEPT_ALL_COUNTERS),
+            (PossibleAnswerStats,
+             {'possible_answer__user_answer__profile': profile},
+             GENDER_COUNTERS),
+            (PossibleAnswerStats,
+             {'possible_answer__acceptable_answer__profile': profile},
+             GENDER_ACCEPTABLE_COUNTERS)):
+        updates = {}
+        if old in counters:
+            updates[counters[old]] = F(counters[old]) - 1
+        if new in counters:
+            updates[counters[new]] = F(counters[new]) + 1
+        if updates:
+            model.objects.filter(**lookups).update(**updates)
+    return True
+
+
+def chunks(rows, chunk_size):
+    """
+    Split the iterable `rows` into lists of up to `chunk_size` rows.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def count_by_gender(chunk, ids):
+    """
+    Count the `(id, gender)` rows of `chunk` with `numpy.bincount`, by the
+    index of their id in the sorted array `ids`, so the counts take space
+    for `ids` only, however large the ids are. Rows without an id, or with
+    an id not in `ids`, are skipped.
+
+    :rtype: int array of shape `(len(ids), 3)`: all, male and female rows
+            of every id in `ids`.
+    """
+    values = np.fromiter(
+        (-1 if row[0] is None else row[0] for row in chunk),
+        dtype=np.int64, count=len(chunk)
+    )
+    genders = np.fromiter(
+        (GENDER_CODES.get(row[1], 0) for row in chunk),
+        dtype=np.int64, count=len(chunk)
+    )
+    index = np.searchsorted(ids, values)
+    found = index < len(ids)
+    found[found] = ids[index[found]] == values[found]
+    counts = np.bincount(
+        index[found] * 3 + genders[found], minlength=len(ids) * 3
+    ).reshape(len(ids), 3)
+    counts[:, 0] += counts[:, 1] + counts[:, 2]
+    return counts
+
+
+def rebuild(chunk_size=10000):
+    """
+    .. function:: rebuild(chunk_size=10000)
+
+    Count all answers and acceptable answers from scratch and replace all
+    :mod:`question.models.QuestionStats` and
+    :mod:`question.models.PossibleAnswerStats`.
+
+    Answers are streamed in chunks of `chunk_size` rows and counted with
+    numpy, so memory use only depends on the number of questions and
+    possible answers. Answers changed while the counters are rebuilt may be
+    counted wrong until the next rebuild.
+
+    :rtype: `(questions, answers)`, how many were counted.
+    """
+    question_ids = np.array(sorted(
+        Question.objects.values_list('pk', flat=True)
+    ), dtype=np.int64)
+    possible_answers = sorted(
+        PossibleAnswer.objects.values_list('pk', 'question_id')
+    )
+    answer_ids = np.array(
+        [pk for pk, question_id in possible_answers], dtype=np.int64
+    )
+
+    by_question = np.zeros((len(question_ids), 3), dtype=np.int64)
+    by_answer = np.zeros((len(answer_ids), 3), dtype=np.int64)
+    accept_all = np.zeros((len(question_ids), 3), dtype=np.int64)
+    rows = Answer.objects.values_list(
+        'question_id', 'user_answer_id', 'profile__gender', 'acceptable_mask'
+    ).order_by().iterator()
+    answer_count = 0
+    for chunk in chunks(rows, chunk_size):
+        answer_count += len(chunk)
+        by_question += count_by_gender(
+            [(row[0], row[2]) for row in chunk], question_ids
+        )
+        by_answer += count_by_gender(
+            [(row[1], row[2]) for row in chunk], answer_ids
+        )
+        accept_all += count_by_gender(
+            [(row[0], row[2]) for row in chunk if not row[3]], question_ids
+        )
+
+    acceptable = np.zeros((len(answer_ids), 3), dtype=np.int64)
+    rows = Answer.acceptable_answer.through.objects.values_list(
+        'possibleanswer_id', 'answer__profile__gender'
+    ).order_by().iterator()
+    for chunk in chunks(rows, chunk_size):
+        acceptable += count_by_gender(chunk, answer_ids)
+
+    with transaction.atomic():
+        QuestionStats.objects.all().delete()
+        QuestionStats.objects.bulk_create((
+            QuestionStats(
+                question_id=pk,
+                answer_count=int(by_question[i, 0]),
+                male_answer_count=int(by_question[i, 1]),
+                female_answer_count=int(by_question[i, 2]),
+                male_accept_all_count=int(accept_all[i, 1]),
+                female_accept_all_count=int(accept_all[i, 2]),
+            )
+            for i, pk in enumerate(question_ids.tolist())
+        ), batch_size=chunk_size)
+        PossibleAnswerStats.objects.all().delete()
+        PossibleAnswerStats.objects.bulk_create((
+            PossibleAnswerStats(
+                possible_answer_id=pk,
+                question_id=question_id,
+                answer_count=int(by_answer[i, 0]),
+                male_answer_count=int(by_answer[i, 1]),
+                female_answer_count=int(by_answer[i, 2]),
+                acceptable_count=int(acceptable[i, 0]),
+                male_acceptable_count=int(acceptable[i, 1]),
+                female_acceptable_count=int(acceptable[i, 2]),
+            )
+            for i, (pk, question_id) in enumerate(possible_answers)
+        ), batch_size=chunk_size)
+    return len(question_ids), answer_count
+
+# vim: ts=4 et sw=4 sts=4
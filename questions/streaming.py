@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+"""
+:mod:`question.streaming` -- move questions and answers in and out.
+
+Questions, possible answers and answers are written and read as flat
+records that refer to each other by natural keys: questions by slug,
+possible answers by their question and text, profiles by username.
+Records are serialized as JSON Lines or CSV.
+
+Both directions work on chunks of records, so memory use only depends on
+the chunk size. Exports page through the tables by primary key, imports
+resolve the natural keys of a chunk with one query per model and write it
+with `bulk_create`.
+
+Imports only add what is missing. Rows that exist already are skipped, so
+an interrupted import can simply be run again.
+
+Lines are text on both Python 2 and 3; the Python 2 `csv` module works on
+UTF-8 encoded bytes, which are converted from and to text here.
+"""
+
+import csv
+import json
+import logging
+
+from django.db import transaction
+from django.template.defaultfilters import slugify
+from django.utils import six
+
+from category.models import Category
+
+from .caching import bump_possible_answers_version
+from .caching import bump_profile_version
+from .caching import bump_question_version
+from .constants import MAX_POSSIBLE_ANSWERS
+from .models import Answer
+from .models import PossibleAnswer
+from .models import Profile
+from .models import Question
+from .stats import chunks
+
+logger = logging.getLogger(__name__)
+
+QUESTION_FIELDS = (
+    'slug', 'question', 'category', 'is_active', 'answer', 'value',
+)
+"""Fields of a question record, one record per possible answer."""
+
+ANSWER_FIELDS = (
+    'profile', 'question', 'question_text', 'user_answer',
+    'acceptable_answer', 'importance', 'is_public', 'description',
+)
+"""
+Fields of an answer record. `question_text` is informational and ignored
+on import.
+"""
+
+LIST_FIELDS = ('acceptable_answer',)
+"""Fields holding lists, stored as JSON in CSV files."""
+
+BOOLEAN_FIELDS = ('is_active', 'is_public')
+"""Fields holding booleans, stored as `True` or `False` in CSV files."""
+
+FORMATS = ('jsonl', 'csv')
+
+CHUNK_SIZE = 250
+"""
+Records per chunk. Two chunks of ids stay below the 999 query parameters
+SQLite allows.
+"""
+
+
+def _pages(queryset, fields, chunk_size):
+    """
+    Yield lists of up to `chunk_size` rows of `fields` of `queryset`,
+    ordered by primary key.
+
+    Pages start after the last primary key of the previous page, so no page
+    costs more than the first one. The primary key is the first value of
+    every row.
+    """
+    last = None
+    while True:
+        page = queryset.order_by('pk')
+        if last is not None:
+            page = page.filter(pk__gt=last)
+        rows = list(page.values_list('pk', *fields)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def export_questions(chunk_size=CHUNK_SIZE):
+    """
+    .. function:: export_questions(chunk_size=CHUNK_SIZE)
+
+    :rtype: generator of question records with `QUESTION_FIELDS`, one for
+            every possible answer, in the order of their positions. A
+            question without possible answers has one record without
+            `answer`.
+    """
+    fields = ('slug', 'question', 'category__title', 'is_active')
+    for rows in _pages(Question.objects.all(), fields, chunk_size):
+        possible_answers = {}
+        for question_id, answer, value in PossibleAnswer.objects.filter(
+                question__in=[row[0] for row in rows]).order_by(
+                'pk').values_list('question_id', 'answer', 'value'):
+            possible_answers.setdefault(question_id, []).append(
+                (answer, value)
+            )
+        for pk, slug, question, category, is_active in rows:
+            for answer, value in possible_answers.get(pk, [(None, None)]):
+                yield {
+                    'slug': slug,
+                    'question': question,
+                    'category': category,
+                    'is_active': is_active,
+                    'answer': answer,
+                    'value': value,
+                }
+
+
+def export_answers(answers=None, chunk_size=CHUNK_SIZE):
+    """
+    .. function:: export_answers(answers=None, chunk_size=CHUNK_SIZE)
+
+    :param answers: queryset of the answers to export, all by default.
+
+    :rtype: generator of answer records with `ANSWER_FIELDS`. Answers and
+            acceptable answers are given by their text.
+    """
+    if answers is None:
+        answers = Answer.objects.all()
+    fields = (
+        'profile__user__username', 'question__slug', 'question__question',
+        'user_answer__answer', 'importance', 'is_public', 'description',
+    )
+    Through = Answer.acceptable_answer.through
+    for rows in _pages(answers, fields, chunk_size):
+        acceptable = {}
+        for answer_id, text in Through.objects.filter(
+                answer__in=[row[0] for row in rows]).order_by(
+                'possibleanswer_id').values_list(
+                'answer_id', 'possibleanswer__answer'):
+            acceptable.setdefault(answer_id, []).append(text)
+        for (pk, username, slug, text, user_answer, importance, is_public,
+                description) in rows:
+            yield {
+                'profile': username,
+                'question': slug,
+                'question_text': text,
+                'user_answer': user_answer,
+                'acceptable_answer': acceptable.get(pk, []),
+                'importance': importance,
+                'is_public': is_public,
+                'description': description,
+            }
+
+
+def jsonl_lines(records):
+    """
+    :rtype: generator of `records` as lines of JSON.
+    """
+    for record in records:
+        yield six.text_type(json.dumps(record, sort_keys=True)) + u'\n'
+
+
+class _Line(object):
+    """
+    File-like object that keeps the last line written by `csv.writer`.
+    """
+
+    def write(self, line):
+        self.line = line
+
+
+def _encode(value):
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _decode(value):
+    if six.PY2 and isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def csv_lines(records, fields):
+    """
+    :rtype: generator of `records` as lines of CSV with the columns
+            `fields`, headed by their names.
+    """
+    line = _Line()
+    writer = csv.writer(line)
+    writer.writerow([_encode(field) for field in fields])
+    yield _decode(line.line)
+    for record in records:
+        writer.writerow([
+            json.dumps(record[field]) if field in LIST_FIELDS
+            else '' if record[field] is None
+            else _encode(record[field])
+            for field in fields
+        ])
+        yield _decode(line.line)
+
+
+def read_jsonl(lines):
+    """
+    :rtype: generator of the records of JSON `lines`, skipping blank lines.
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(lines):
+    """
+    :rtype: generator of the records of CSV `lines`, as written by
+            `csv_lines`. Empty values are read as None.
+    """
+    for row in csv.DictReader(_encode(line) for line in lines):
+        record = {}
+        for field, value in row.items():
+            field, value = _decode(field), _decode(value)
+            if field in LIST_FIELDS:
+                value = json.loads(value) if value else []
+            elif field in BOOLEAN_FIELDS:
+                value = value.lower() in ('1', 'true', 'yes')
+            elif value == '':
+                value = None
+            record[field] = value
+        yield record
+
+
+def import_questions(records, chunk_size=CHUNK_SIZE):
+    """
+    .. function:: import_questions(records, chunk_size=CHUNK_SIZE)
+
+    Create the questions and possible answers of question `records` that
+    do not exist yet. Questions are identified by slug, which defaults to
+    the slugified question, possible answers by their question and text.
+    Categories are looked up by title; unknown categories are left empty.
+
+    :rtype: `(questions, possible_answers)`, the number of rows created.
+    """
+    created_questions = created_answers = 0
+    for chunk in chunks(records, chunk_size):
+        for record in chunk:
+            record['slug'] = record.get('slug') or slugify(record['question'])
+        slugs = set(record['slug'] for record in chunk)
+        categories = dict(Category.objects.filter(title__in=set(
+            record.get('category') for record in chunk
+        )).values_list('title', 'pk'))
+
+        with transaction.atomic():
+            questions = dict(Question.objects.filter(
+                slug__in=slugs
+            ).values_list('slug', 'pk'))
+            existing = set(questions.values())
+            new = {}
+            for record in chunk:
+                if record['slug'] not in questions:
+                    new.setdefault(record['slug'], Question(
+                        slug=record['slug'],
+                        question=record['question'],
+                        category_id=categories.get(record.get('category')),
+                        is_active=bool(record.get('is_active')),
+                    ))
+            if new:
+                Question.objects.bulk_create(new.values())
+                """Primary keys are not set by `bulk_create` everywhere."""
+                questions.update(Question.objects.filter(
+                    slug__in=list(new)
+                ).values_list('slug', 'pk'))
+
+            known = set(PossibleAnswer.objects.filter(
+                question__in=existing
+            ).values_list('question_id', 'answer'))
+            possible_answers = []
+            for record in chunk:
+                key = (questions[record['slug']], record.get('answer'))
+                if key[1] is None or key in known:
+                    continue
+                known.add(key)
+                possible_answers.append(PossibleAnswer(
+                    question_id=key[0],
+                    answer=key[1],
+                    value=record.get('value') or '2',
+                ))
+            PossibleAnswer.objects.bulk_create(possible_answers)
+
+        for question_id in set(
+                answer.question_id for answer in possible_answers):
+            if question_id in existing:
+                bump_question_version(question_id)
+                bump_possible_answers_version(question_id)
+        created_questions += len(new)
+        created_answers += len(possible_answers)
+    return created_questions, created_answers
+
+
+def import_answers(records, chunk_size=CHUNK_SIZE):
+    """
+    .. function:: import_answers(records, chunk_size=CHUNK_SIZE)
+
+    Create the answers of answer `records` that do not exist yet. Records
+    of unknown profiles or questions are skipped, unknown possible answers
+    are left out.
+
+    No signals are sent, so neither statistics, matches nor the snapshot
+    log are updated. Run the `rebuild_stats` and `rebuild_matches`
+    commands afterwards.
+
+    :rtype: `(created, skipped)`, the number of records.
+    """
+    created = skipped = 0
+    Through = Answer.acceptable_answer.through
+    for chunk in chunks(records, chunk_size):
+        profiles = dict(Profile.objects.filter(user__username__in=set(
+            record['profile'] for record in chunk
+        )).values_list('user__username', 'pk'))
+        questions = dict(Question.objects.filter(slug__in=set(
+            record['question'] for record in chunk
+        )).values_list('slug', 'pk'))
+        possible_answers = {}
+        positions = {}
+        for pk, question_id, text in PossibleAnswer.objects.filter(
+                question__in=questions.values()).order_by('pk').values_list(
+                'pk', 'question_id', 'answer'):
+            possible_answers.setdefault((question_id, text), pk)
+            positions.setdefault(question_id, []).append(pk)
+
+        with transaction.atomic():
+            existing = set(Answer.objects.filter(
+                profile__in=profiles.values(),
+                question__in=questions.values()
+            ).values_list('profile_id', 'question_id'))
+            answers = []
+            acceptable = {}
+            for record in chunk:
+                key = (
+                    profiles.get(record['profile']),
+                    questions.get(record['question'])
+                )
+                if None in key or key in existing:
+                    skipped += 1
+                    continue
+                existing.add(key)
+                question_id = key[1]
+                ids = [
+                    possible_answers[(question_id, text)]
+                    for text in record.get('acceptable_answer') or ()
+                    if (question_id, text) in possible_answers
+                ]
+                mask = 0
+                for pk in ids:
+                    position = positions[question_id].index(pk)
+                    if position < MAX_POSSIBLE_ANSWERS:
+                        mask |= 1 << position
+                acceptable[key] = ids
+                answers.append(Answer(
+                    profile_id=key[0],
+                    question_id=question_id,
+                    user_answer_id=possible_answers.get(
+                        (question_id, record.get('user_answer'))
+                    ),
+                    acceptable_mask=mask,
+                    importance=record.get('importance') or '2',
+                    is_public=record.get('is_public', True),
+                    description=record.get('description'),
+                ))
+            if not answers:
+                continue
+            Answer.objects.bulk_create(answers)
+            """Primary keys are not set by `bulk_create` everywhere."""
+            pks = dict(
+                ((profile_id, question_id), pk)
+                for pk, profile_id, question_id in Answer.objects.filter(
+                    profile__in=set(key[0] for key in acceptable),
+                    question__in=set(key[1] for key in acceptable)
+                ).values_list('pk', 'profile_id', 'question_id')
+            )
+            Through.objects.bulk_create([
+                Through(answer_id=pks[key], possibleanswer_id=pk)
+                for key, ids in acceptable.items()
+                for pk in ids
+            ])
+
+        for profile_id in set(key[0] for key in acceptable):
+            bump_profile_version(profile_id)
+        for question_id in set(key[1] for key in acceptable):
+            bump_question_version(question_id)
+        created += len(answers)
+    return created, skipped
+
+# vim: ts=4 et sw=4 sts=4
@@ -6,11 +6,77 @@ Tasks to compare user profiles, other related functions.
 """
 from __future__ import absolute_import
 
-from celery import shared_task
+import heapq
+from itertools import chain
+
+from celery import chord, shared_task
+from django.db.models import Max, Min
+
+from .indexes import dealbreakers
+from .matching import match_candidates, top_matches
+from .models import Profile
 
 
 @shared_task
 def debug():
     return 0
 
+
+@shared_task
+def score_shard(profile_id, start, end, k=10, min_age=None, max_age=None):
+    """
+    Score `profile_id` against the candidates with a pk from `start` up to,
+    but not including `end`.
+
+    :rtype: list of `[match, profile id]`, best match first.
+    """
+    profile = Profile.objects.get(pk=profile_id)
+    candidates = match_candidates(profile, min_age, max_age).filter(
+        pk__gte=start, pk__lt=end
+    )
+    index = dealbreakers()
+    exclude = index.excluded(profile_id) if index is not None else None
+    return [
+        list(entry)
+        for entry in top_matches(profile, candidates, k, exclude=exclude)
+    ]
+
+
+@shared_task
+def merge_matches(results, k=10):
+    """
+    Merge the results of :func:`score_shard` into the `k` best matches.
+
+    :rtype: list of `[match, profile id]`, best match first.
+    """
+    best = heapq.nsmallest(
+        k,
+        chain.from_iterable(results),
+        key=lambda entry: (-entry[0], entry[1])
+    )
+    return [list(entry) for entry in best]
+
+
+def scatter_matches(profile_id, k=10, shards=8, min_age=None, max_age=None):
+    """
+    Find the `k` best matches for `profile_id` on all workers.
+
+    Profiles are split into `shards` ranges of primary keys, each scored by
+    :func:`score_shard` on a worker of its own, and then merged by
+    :func:`merge_matches`. Requires a result backend, unless tasks run
+    eagerly (`CELERY_TASK_ALWAYS_EAGER`).
+
+    :rtype: :class:`celery.result.AsyncResult` for the list of
+            `[match, profile id]`, best match first.
+    """
+    bounds = Profile.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    first = bounds['first'] or 0
+    last = (bounds['last'] or 0) + 1
+    size = max(1, -(-(last - first) // shards))
+    header = [
+        score_shard.s(profile_id, start, start + size, k, min_age, max_age)
+        for start in range(first, last, size)
+    ]
+    return chord(header)(merge_matches.s(k))
+
 # vim: ts=4 et sw=4 sts=4
@@ -1,39 +1,44 @@
 from django import template
-from ..models import Question
+from ..models import Answer
 
 register = template.Library()
 
 
-class UserAnswerNode(template.Node):
+def answered_questions(context, user):
     """
-    TemplateTag RenderNode
+    Ids of the questions `user` answered, loaded once per request (or
+    rendering, without a request in the context) and user.
 
-    renders whether user answered a question.pk
+    .. seealso:: :mod:`question.managers.AnswerManager.answered_by`
     """
-    def __init__(self, user, question):
-        self.user = template.Variable(user)
-        self.variable_question = template.Variable(question)
-
-    def render(self, context):
-        real_question = Question.objects.get(
-            pk=self.variable_question.resolve(context)
+    request = context.get('request')
+    if request is not None:
+        if not hasattr(request, '_answered_questions'):
+            request._answered_questions = {}
+        answered = request._answered_questions
+    else:
+        answered = context.render_context.setdefault(
+            'answered_questions', {}
         )
-        return real_question.has_answer(self.user.resolve(context))
+    if user not in answered:
+        answered[user] = Answer.objects.answered_by(user)
+    return answered[user]
 
 
-@register.tag('user_answered')
-def user_answered(parser, token):
+@register.simple_tag(takes_context=True)
+def user_answered(context, user, question):
     """
     user_answered
     =============
 
     Templatetag to render whether a user actually answered a question.
+
+    `user` and `question` may be objects or primary keys. All questions
+    answered by `user` are loaded with the first use of the tag, so a page
+    listing many questions takes one query.
+
+    {% user_answered user question as answered %}
     """
-    try:
-        tag_name, user, question = token.split_contents()
-    except ValueError:
-        raise template.TemplateSyntaxError(
-            "%r tag requires exactly two arguments" %
-            token.contents.split()[0]
-        )
-    return UserAnswerNode(user, question)
+    user = getattr(user, 'pk', user)
+    question = getattr(question, 'pk', question)
+    return question in answered_questions(context, user)
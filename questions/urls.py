@@ -12,12 +12,16 @@ from questions.views import AnswerDetail
 from questions.views import AnswerQuestion
 
 from questions.views import ProfileList, ProfileEditView, ProfileView
+from questions.views import ProfileAnswerExport
 from questions.views import CategoryList, CategoryDetail
 from questions.views import Submit
 from questions.views import Compare
+from questions.views import BestMatches
 
 from questions.apiviews import QuestionViewSet
 from questions.apiviews import CategoryViewSet
+from questions.apiviews import MatchViewSet
+from questions.apiviews import AnswerBatchViewSet
 
 from rest_framework import routers
 
@@ -34,6 +38,11 @@ urlpatterns = [
 urlpatterns += [
     url(r'^p/$', ProfileEditView.as_view(), name='profile-edit'),
     url(r'^p/(?P<pk>\d+)/$', ProfileView.as_view(), name='profile-view'),
+    url(
+        r'^p/(?P<pk>\d+)/export/$',
+        ProfileAnswerExport.as_view(),
+        name='profile-export'
+    ),
     url(r'^u/$', ProfileList.as_view(), name='profile-list'),
 ]
 
@@ -54,12 +63,15 @@ urlpatterns += [
 
 urlpatterns += [
     url(r'^compare/(?P<pk>\d+)/$', Compare.as_view(), name='compare'),
+    url(r'^match/$', BestMatches.as_view(), name='match'),
 ]
 
 # Routers provide an easy way of automatically determining the URL conf.
 router = routers.DefaultRouter(trailing_slash=False)
 router.register(r'question', QuestionViewSet, base_name="api-question")
 router.register(r'category', CategoryViewSet, base_name="api-category")
+router.register(r'match', MatchViewSet, base_name="api-match")
+router.register(r'answers', AnswerBatchViewSet, base_name="api-answers")
 
 urlpatterns += [
     url(r'^api/', include(router.urls)),
@@ -13,12 +13,23 @@
 from django.views.generic.edit import CreateView, UpdateView
 from braces.views import LoginRequiredMixin, GroupRequiredMixin
 from django.views.generic import TemplateView, ListView, DetailView
+from django.views.generic import View
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from category.models import Category
 
 from .models import Question, Answer, Profile
 from .forms import ProfileForm, QuestionForm, AnswerQuestionForm
-from .mixins import ProfileRequiredMixin
+from .caching import fragment_timeout, match_percent, question_version
+from .caching import question_etag
+from .matching import best_matches, compare
+from .mixins import ProfileRequiredMixin, MatchQueryMixin
+from .mixins import get_match_profile
+from .streaming import ANSWER_FIELDS, csv_lines, export_answers, jsonl_lines
 
 
 class Home(TemplateView):
@@ -77,7 +88,7 @@ class ProfileEditView(LoginRequiredMixin, GroupRequiredMixin, UpdateView):
         """
         Get initial values for 'user', to ensure no other user is edited.
         """
-        profile = Profile.objects.get(user=self.request.user.pk)
+        profile = get_match_profile(self.request)
         self.initial.update({'profile': profile})
         return self.initial
 
@@ -100,6 +111,71 @@ class ProfileView(LoginRequiredMixin, GroupRequiredMixin, DetailView):
         """
         return Profile.objects.filter(is_public=True)
 
+    def get_context_data(self, **kwargs):
+        """
+        Add the answers of the profile along with how many men and women
+        would accept each of them, and how well it matches the viewer.
+        """
+        context = super(ProfileView, self).get_context_data(**kwargs)
+        viewer = get_match_profile(self.request)
+        if viewer is not None and viewer != self.object:
+            context['match'] = match_percent(viewer, self.object)
+        acceptance = self.object.acceptance()
+        context['answers'] = [
+            (answer, acceptance.get(answer.question_id, (None, None)))
+            for answer in self.object.answers.select_related('question')
+        ]
+        return context
+
+
+class ProfileAnswerExport(LoginRequiredMixin, GroupRequiredMixin, View):
+    """
+    .. class:: ProfileAnswerExport
+
+    Download all answers of a profile, as CSV or as JSON Lines (NDJSON).
+
+    The response is streamed: answers are read in chunks, with the texts of
+    their question and possible answers fetched once per chunk, see
+    :mod:`question.streaming.export_answers`.
+
+    Only the owner of the profile and staff may export it.
+
+    :param pk: The primary key of the profile to export.
+    :param format: `csv` or `jsonl`, from the query string (default: csv).
+    """
+    group_required = u'question'
+    login_url = "/profile/login/"
+
+    content_types = {
+        'csv': 'text/csv; charset=utf-8',
+        'jsonl': 'application/x-ndjson',
+    }
+    """Content type of every format."""
+
+    def get(self, request, pk):
+        profile = get_object_or_404(
+            Profile.objects.select_related('user'), pk=pk
+        )
+        if profile.user_id != request.user.pk and not request.user.is_staff:
+            raise PermissionDenied
+        format = request.GET.get('format', 'csv')
+        if format not in self.content_types:
+            raise Http404
+        records = export_answers(Answer.objects.filter(profile=profile))
+        if format == 'csv':
+            lines = csv_lines(records, ANSWER_FIELDS)
+        else:
+            lines = jsonl_lines(records)
+        response = StreamingHttpResponse(
+            lines, content_type=self.content_types[format]
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="answers-%s.%s"' % (
+                profile.user.username, format
+            )
+        )
+        return response
+
 
 class QuestionList(LoginRequiredMixin, GroupRequiredMixin, ListView):
     """
@@ -113,10 +189,11 @@ class QuestionList(LoginRequiredMixin, GroupRequiredMixin, ListView):
     template_name = "question/question_list.html"
 
     def get_queryset(self):
-        profile = Profile.objects.get(user=self.request.user.pk)
+        profile = get_match_profile(self.request)
         return Question.objects.unanswered(profile)
 
 
+@method_decorator(condition(etag_func=question_etag), name='dispatch')
 class QuestionDetail(DetailView):
     """
     .. class:: QuestionDetail
@@ -127,12 +204,31 @@ class QuestionDetail(DetailView):
     - the question
     - possible answers
     - stats about already given answers
+
+    Answers conditional requests with 304 until the question changes,
+    see :mod:`question.caching.question_etag`.
     """
     model = Question
     template_name = "question/question_detail.html"
     login_url = "/profile/login/"
     group_required = u'question'
 
+    def get_context_data(self, **kwargs):
+        """
+        Add how many men and women would accept the answer of the current
+        user, if there is one, and the version of the statistics, which
+        are cached until the question is answered again.
+        """
+        context = super(QuestionDetail, self).get_context_data(**kwargs)
+        context['stats_version'] = question_version(self.object.pk)
+        context['stats_timeout'] = fragment_timeout()
+        profile = get_match_profile(self.request)
+        if profile is not None:
+            context['acceptance'] = Answer.objects.acceptance(
+                profile, [self.object]
+            ).get(self.object.pk)
+        return context
+
 
 class AnswerList(GroupRequiredMixin, ProfileRequiredMixin, ListView):
     """
@@ -169,7 +265,7 @@ class AnswerList(GroupRequiredMixin, ProfileRequiredMixin, ListView):
         :rtype: A queryset for :mod:`questions.models.Answer`
 
         """
-        return Profile.objects.get(user=self.request.user).answers
+        return get_match_profile(self.request).answers
         # return Answer.objects.filter(profile__user=self.request.user)
 
 
@@ -189,14 +285,17 @@ class AnswerQuestion(GroupRequiredMixin, ProfileRequiredMixin, UpdateView):
     template_name = "question/answer_question.html"
 
     def get(self, *args, **kwargs):
-        self.question = Question.objects.get(pk=kwargs['pk'])
+        self.question = get_object_or_404(Question, pk=kwargs['pk'])
         return super(AnswerQuestion, self).get(*args, **kwargs)
 
     def post(self, *args, **kwargs):
-        self.question = Question.objects.get(pk=kwargs['pk'])
+        self.question = get_object_or_404(Question, pk=kwargs['pk'])
         return super(AnswerQuestion, self).post(*args, **kwargs)
 
     def get_object(self, queryset=None):
+        if self.request.method == 'POST':
+            """Submitted answers are written by `form_valid`."""
+            return None
         if queryset is None:
             queryset = self.get_queryset()
 
@@ -213,13 +312,31 @@ class AnswerQuestion(GroupRequiredMixin, ProfileRequiredMixin, UpdateView):
 
     def get_initial(self):
         self.initial.update(
-            {'profile': Profile.objects.get(user=self.request.user)}
+            {'profile': get_match_profile(self.request)}
         )
         self.initial.update(
             {'question': self.question}
         )
         return self.initial
 
+    def form_valid(self, form):
+        """
+        Create or update the answer at once.
+
+        .. seealso:: :mod:`question.managers.AnswerManager.upsert`
+        """
+        data = form.cleaned_data
+        self.object, created = Answer.objects.upsert(
+            get_match_profile(self.request),
+            self.question,
+            user_answer=data['user_answer'],
+            acceptable_answer=data['acceptable_answer'],
+            importance=data['importance'],
+            is_public=data['is_public'],
+            description=data['description'],
+        )
+        return HttpResponseRedirect(self.get_success_url())
+
 
 class CategoryList(ListView):
     model = Category
@@ -254,6 +371,31 @@ class ProfileList(LoginRequiredMixin, GroupRequiredMixin, ListView):
     template_name = "question/profile_list.html"
 
 
+class BestMatches(GroupRequiredMixin, ProfileRequiredMixin, MatchQueryMixin,
+                  ListView):
+    """
+    .. class:: BestMatches
+
+    List the best matches for the logged in user.
+
+    Only public profiles are considered, that the user is looking for and
+    that are looking for the user.
+
+    :param k: number of matches to show, from the query string.
+    :param min_age: optional lower age limit, from the query string.
+    :param max_age: optional upper age limit, from the query string.
+
+    .. seealso:: :mod:`questions.matching.best_matches`.
+    """
+    group_required = u'question'
+    template_name = "question/match.html"
+    login_url = "/profile/login/"
+
+    def get_queryset(self):
+        profile = get_match_profile(self.request)
+        return best_matches(profile, **self.get_match_kwargs())
+
+
 class Compare(LoginRequiredMixin, GroupRequiredMixin, ListView):
     """
     .. class:: Compare
@@ -276,28 +418,37 @@ class Compare(LoginRequiredMixin, GroupRequiredMixin, ListView):
         .. classmethod:: get_queryset(self)
 
         All questions that were answered by either the viewing user
-        or the user being looked at.
+        or the user being looked at, with both answers side by side.
+        Only public profiles can be looked at, and only their public
+        answers are shown.
 
         :param pk: Primary Key of the user-profile to compare to.
 
-        :rtype: a list of :mod:`questions.model.Question` the user has
-        :mod:`questions.model.Answer` for.
-
+        :rtype: list of dicts, see :mod:`question.matching.compare`.
         """
-        other = self.kwargs['pk']
-        return Question.objects.answered(other)
+        self.profile = get_match_profile(self.request)
+        if self.profile is None:
+            raise Http404
+        self.other = get_object_or_404(
+            Profile.objects.filter(is_public=True).select_related('user'),
+            pk=self.kwargs['pk']
+        )
+        return compare(self.profile, self.other)
 
     def get_context_data(self, **kwargs):
         """
         .. classmethod:: get_context_data(self, (*args, (**kwargs)))
 
-        :rtype: Profile of the user to compare to.
+        :rtype: both profiles and how well they match.
         """
         context = super(Compare, self).get_context_data(**kwargs)
-        other = self.kwargs['pk']  # Other profile ID!
-        context['profile'] = Profile.objects.get(pk=self.request.user.pk)
-        context['other'] = Profile.objects.get(pk=other)
-        context['others_questions'] = self.get_queryset()
+        context['profile'] = self.profile
+        context['other'] = self.other
+        context['match'] = match_percent(self.profile, self.other)
+        context['shared'] = len([
+            row for row in self.object_list
+            if row['answer'] and row['other_answer']
+        ])
         return context
 
 
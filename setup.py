@@ -34,5 +34,6 @@ setup(
         'django>=1.10.0',
         'category',
         'python-dateutil==2.3',
+        'numpy',
     ],
 )
@@ -5,11 +5,28 @@
 """
 """
 
-from django.test import TestCase, LiveServerTestCase
-from django.contrib.auth.models import User
+from django.test import TestCase, LiveServerTestCase, override_settings
+from django.test import RequestFactory
+from django.template import Context, Template
+from django.contrib.auth.models import Group, User
 from django.core.urlresolvers import reverse
-
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import connection
+from django.db import transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import six
+from django.utils import translation
+
+import json
 import logging
+import os
+import shutil
+import tempfile
+from datetime import date
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +37,25 @@ except:
 
 from random import Random
 
+from category.models import Category
+from questions.forms import AnswerQuestionForm
 from questions.models import Question, Answer, PossibleAnswer, Profile
+from questions.models import MatchList, QuestionStats
+from questions.tasks import scatter_matches
+from questions.snapshot import current_snapshot, load_snapshot, log_size
+from questions.snapshot import write_snapshot
+from questions.indexes import DealbreakerIndex, ValueLSH, ProfileIndex
+from questions.indexes import approximate_matches, dealbreakers
+from questions.indexes import profiles
+from questions import indexes
+from questions import caching
+from questions.mixins import get_match_profile
+from questions.matching import AnswerMatrix, best_matches, compare
+from questions.matching import _Rescore, merge_matches
+from questions.streaming import ANSWER_FIELDS, csv_lines, jsonl_lines
+from questions.streaming import export_answers
+from questions.analytics import AGE_BUCKETS, GENDER_CODES
+from questions.stats import count_by_gender
 from social.facebook import Facebook
 
 fixtures = ['category.yaml', 'initial_data.json', ]
@@ -310,6 +345,15 @@ class UserUrlTest(TestCase):
         response = self.client.get(reverse('question:answer-list'))
         self.assertEqual(response.status_code, 200)
 
+    def test_match(self):
+        """
+        test_match
+        ==========
+        test for :mod:`question.views.BestMatches`
+        """
+        response = self.client.get(reverse('question:match'))
+        self.assertEqual(response.status_code, 200)
+
     def test_compare(self):
         """
         test_question_list
@@ -491,3 +535,1244 @@ class ApiTest(TestCase):
         """
         response = self.client.get(reverse("question:api-question-list"))
         self.assertEqual(response.status_code, 200)
+
+
+def run_on_commit():
+    """
+    Run the `transaction.on_commit` callbacks, which `TestCase` never
+    commits.
+    """
+    callbacks = connection.run_on_commit
+    connection.run_on_commit = []
+    for sids, callback in callbacks:
+        callback()
+
+
+class MatchingTest(TestCase):
+    fixtures = ['category.yaml', 'initial_data.json', ]
+
+    def setUp(self):
+        """
+        Three profiles answering two questions.
+
+        `alice` and `bob` accept each others answers, `carol` answered
+        what `alice` does not accept.
+        """
+        self.profiles = {}
+        for name, gender in (('alice', 'F'), ('bob', 'M'), ('carol', 'F')):
+            u = User.objects.create(username=name)
+            self.profiles[name] = Profile.objects.create(
+                user=u, gender=gender, is_public=True
+            )
+
+        self.questions = []
+        for text in ("Cats?", "Dogs?"):
+            q = Question.objects.create(question=text)
+            yes = PossibleAnswer.objects.create(question=q, answer="Yes")
+            no = PossibleAnswer.objects.create(question=q, answer="No")
+            self.questions.append((q, yes, no))
+
+        for q, yes, no in self.questions:
+            self.answer('alice', q, yes, [yes])
+            self.answer('bob', q, yes, [yes, no])
+        q, yes, no = self.questions[0]
+        self.answer('carol', q, no, [])
+        run_on_commit()
+
+    def answer(self, name, question, user_answer, acceptable):
+        a = Answer.objects.create(
+            profile=self.profiles[name],
+            question=question,
+            user_answer=user_answer,
+            importance='3'
+        )
+        a.acceptable_answer.add(*acceptable)
+        return a
+
+    def test_build(self):
+        matrix = AnswerMatrix.build()
+        self.assertEqual(len(matrix), 3)
+        self.assertEqual(matrix.answers.shape, (3, 2))
+        carol = matrix.row(self.profiles['carol'].pk)
+        self.assertEqual(list(matrix.answers[carol]), [1, -1])
+        """An answer without acceptable answers accepts everything."""
+        self.assertEqual(matrix.acceptable[carol, 0], 3)
+
+    def test_scores(self):
+        matrix = AnswerMatrix.build()
+        alice = self.profiles['alice']
+        ids, scores = matrix.scores(
+            alice.pk,
+            [self.profiles['bob'].pk, self.profiles['carol'].pk]
+        )
+        self.assertAlmostEqual(scores[0], 50.0)
+        self.assertEqual(scores[1], 0.0)
+
+    def test_match_percent(self):
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        self.assertAlmostEqual(alice.match_percent(bob), 50.0)
+        self.assertAlmostEqual(bob.match_percent(alice), 50.0)
+
+
+class BestMatchesTest(MatchingTest):
+
+    def test_best_matches(self):
+        matches = best_matches(self.profiles['alice'])
+        self.assertEqual([p.pk for p in matches], [self.profiles['bob'].pk])
+        self.assertAlmostEqual(matches[0].match, 50.0)
+
+    def test_lookfor(self):
+        bob = self.profiles['bob']
+        bob.lookfor = 'M'
+        bob.save()
+        self.assertEqual(best_matches(self.profiles['alice']), [])
+
+    def test_age_window(self):
+        bob = self.profiles['bob']
+        bob.dob = date(date.today().year - 30, 1, 1)
+        bob.save()
+        alice = self.profiles['alice']
+        self.assertEqual(len(best_matches(alice, min_age=25, max_age=35)), 1)
+        self.assertEqual(len(best_matches(alice, max_age=29)), 0)
+
+    def test_stored(self):
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        match_list = MatchList.objects.get(profile=alice)
+        match_list.merge({bob.pk: 42.0})
+        match_list.save()
+        matches = best_matches(alice)
+        self.assertEqual([p.pk for p in matches], [bob.pk])
+        self.assertEqual(matches[0].match, 42.0)
+
+    def test_merge_matches(self):
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        MatchList.objects.filter(profile=bob).delete()
+        self.assertEqual(merge_matches({bob.pk: {alice.pk: 10.0}}), 1)
+        self.assertEqual(
+            MatchList.objects.get(profile=bob).entries(), [(alice.pk, 10.0)]
+        )
+
+    def test_api(self):
+        self.client.force_login(self.profiles['alice'].user)
+        response = self.client.get(reverse('question:api-match-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['id'], self.profiles['bob'].pk)
+
+
+class RescoreTest(MatchingTest):
+
+    def test_match_list(self):
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        self.assertEqual(alice.match_list.entries()[0][0], bob.pk)
+        self.assertEqual(bob.match_list.entries()[0][0], alice.pk)
+
+    def test_answer_change(self):
+        """
+        `alice` no longer accepts `bob`s answer to the second question.
+        """
+        alice = self.profiles['alice']
+        q, yes, no = self.questions[1]
+        a = Answer.objects.get(profile=alice, question=q)
+        a.acceptable_answer.set([no])
+        run_on_commit()
+        pk, match = MatchList.objects.get(profile=alice).entries()[0]
+        self.assertLess(match, 50.0)
+        bob = self.profiles['bob']
+        pk, other = MatchList.objects.get(profile=bob).entries()[0]
+        self.assertEqual(match, other)
+
+    def test_rescore_once(self):
+        alice = self.profiles['alice']
+        for q, yes, no in self.questions:
+            a = Answer.objects.get(profile=alice, question=q)
+            a.importance = '4'
+            a.save()
+            a.acceptable_answer.set([yes, no])
+        callbacks = [
+            callback for sids, callback in connection.run_on_commit
+            if isinstance(callback, _Rescore)
+        ]
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            callbacks[0].question_ids, set(q.pk for q, y, n in self.questions)
+        )
+
+    def test_private(self):
+        alice = self.profiles['alice']
+        bob = Profile.objects.get(pk=self.profiles['bob'].pk)
+        bob.is_public = False
+        bob.save()
+        run_on_commit()
+        self.assertEqual(MatchList.objects.get(profile=alice).entries(), [])
+        bob.is_public = True
+        bob.save()
+        run_on_commit()
+        self.assertEqual(
+            MatchList.objects.get(profile=alice).entries()[0][0], bob.pk
+        )
+
+    def test_lookfor(self):
+        bob = Profile.objects.get(pk=self.profiles['bob'].pk)
+        bob.lookfor = 'M'
+        bob.save()
+        run_on_commit()
+        self.assertEqual(MatchList.objects.get(profile=bob).entries(), [])
+        self.assertEqual(
+            MatchList.objects.get(profile=self.profiles['alice']).entries(),
+            []
+        )
+
+
+class ScatterMatchesTest(MatchingTest):
+
+    def setUp(self):
+        super(ScatterMatchesTest, self).setUp()
+        from celery import current_app
+        self.eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+
+    def tearDown(self):
+        from celery import current_app
+        current_app.conf.task_always_eager = self.eager
+
+    def test_scatter_matches(self):
+        alice = self.profiles['alice']
+        for shards in (1, 2, 5):
+            result = scatter_matches(alice.pk, k=5, shards=shards).get()
+            self.assertEqual(
+                [pk for match, pk in result],
+                [self.profiles['bob'].pk]
+            )
+
+
+class RebuildMatchesTest(MatchingTest):
+
+    def test_rebuild_matches(self):
+        MatchList.objects.all().delete()
+        call_command('rebuild_matches', processes=1, block_size=2)
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        entries = MatchList.objects.get(profile=alice).entries()
+        self.assertEqual(entries[0][0], bob.pk)
+        self.assertAlmostEqual(entries[0][1], 50.0)
+        self.assertEqual(MatchList.objects.count(), 3)
+
+
+class SnapshotTest(MatchingTest):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.settings = override_settings(QUESTIONS_SNAPSHOT_DIR=self.path)
+        self.settings.enable()
+        super(SnapshotTest, self).setUp()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.path)
+
+    def assertMatrixEqual(self, a, b):
+        """Rows and columns are compared in the order of their ids."""
+        order = [(
+            np.argsort(matrix.profile_ids)[:, None],
+            np.argsort(matrix.question_ids)[None, :]
+        ) for matrix in (a, b)]
+        for name in ('profile_ids', 'question_ids'):
+            self.assertEqual(
+                sorted(getattr(a, name).tolist()),
+                sorted(getattr(b, name).tolist())
+            )
+        for name in ('answers', 'importance', 'acceptable'):
+            self.assertEqual(
+                getattr(a, name)[order[0]].tolist(),
+                getattr(b, name)[order[1]].tolist()
+            )
+
+    def test_snapshot(self):
+        write_snapshot(self.path)
+        self.assertMatrixEqual(load_snapshot(), AnswerMatrix.build())
+
+    def test_deltas(self):
+        write_snapshot(self.path)
+        q, yes, no = self.questions[1]
+        self.answer('carol', q, yes, [no])
+        Answer.objects.filter(
+            profile=self.profiles['bob'], question=q
+        ).delete()
+        run_on_commit()
+        self.assertMatrixEqual(load_snapshot(), AnswerMatrix.build())
+
+    def test_rollback(self):
+        write_snapshot(self.path)
+        q, yes, no = self.questions[1]
+        try:
+            with transaction.atomic():
+                self.answer('carol', q, yes, [no])
+                raise ValueError
+        except ValueError:
+            pass
+        run_on_commit()
+        self.assertEqual(log_size(self.path), 0)
+
+    def test_truncate(self):
+        write_snapshot(self.path)
+        q, yes, no = self.questions[1]
+        self.answer('carol', q, yes, [no])
+        run_on_commit()
+        self.assertTrue(log_size(self.path))
+        call_command('snapshot_answers', self.path, stdout=six.StringIO())
+        self.assertEqual(log_size(self.path), 0)
+        self.assertMatrixEqual(load_snapshot(), AnswerMatrix.build())
+
+    def test_versions(self):
+        """
+        Every snapshot has a directory of its own, the previous one is kept.
+        """
+        for i in range(3):
+            write_snapshot(self.path)
+        versions = sorted(
+            name for name in os.listdir(self.path)
+            if name.startswith('snapshot-')
+        )
+        self.assertEqual(len(versions), 2)
+        self.assertEqual(
+            current_snapshot(self.path), os.path.join(self.path, versions[1])
+        )
+
+    def test_spare(self):
+        """
+        New profiles and questions are added to the spare rows and columns
+        of the mapped snapshot, rather than copying it.
+        """
+        write_snapshot(self.path)
+        dave = Profile.objects.create(
+            user=User.objects.create(username='dave'), gender='M',
+            is_public=True
+        )
+        self.profiles['dave'] = dave
+        q = Question.objects.create(question="Birds?")
+        yes = PossibleAnswer.objects.create(question=q, answer="Yes")
+        PossibleAnswer.objects.create(question=q, answer="No")
+        self.answer('dave', q, yes, [yes])
+        self.answer('dave', self.questions[0][0], self.questions[0][1], [])
+        run_on_commit()
+        matrix = load_snapshot()
+        self.assertIsInstance(matrix.answers, np.memmap)
+        self.assertMatrixEqual(matrix, AnswerMatrix.build())
+
+    def test_missing_directory(self):
+        path = os.path.join(self.path, 'missing')
+        with override_settings(QUESTIONS_SNAPSHOT_DIR=path):
+            q, yes, no = self.questions[1]
+            self.answer('carol', q, yes, [no])
+            run_on_commit()
+        self.assertTrue(log_size(path))
+
+    def test_deleted_profile(self):
+        """
+        Profiles deleted since the snapshot was written are skipped.
+        """
+        write_snapshot(self.path)
+        self.profiles['carol'].delete()
+        call_command(
+            'rebuild_matches', snapshot=self.path, processes=1,
+            stdout=six.StringIO()
+        )
+        self.assertEqual(
+            sorted(MatchList.objects.values_list('profile', flat=True)),
+            sorted([self.profiles['alice'].pk, self.profiles['bob'].pk])
+        )
+
+
+class AcceptableMaskTest(MatchingTest):
+
+    def test_acceptable_mask(self):
+        q, yes, no = self.questions[0]
+        alice = Answer.objects.get(profile=self.profiles['alice'], question=q)
+        bob = Answer.objects.get(profile=self.profiles['bob'], question=q)
+        carol = Answer.objects.get(profile=self.profiles['carol'], question=q)
+        self.assertEqual(alice.acceptable_mask, 1)
+        self.assertEqual(bob.acceptable_mask, 3)
+        self.assertEqual(carol.acceptable_mask, 0)
+        self.assertTrue(alice.accepts(0))
+        self.assertFalse(alice.accepts(1))
+
+    def test_acceptable_mask_changed(self):
+        q, yes, no = self.questions[0]
+        alice = Answer.objects.get(profile=self.profiles['alice'], question=q)
+        alice.acceptable_answer.add(no)
+        self.assertEqual(Answer.objects.get(pk=alice.pk).acceptable_mask, 3)
+        alice.acceptable_answer.remove(yes)
+        self.assertEqual(Answer.objects.get(pk=alice.pk).acceptable_mask, 2)
+        alice.acceptable_answer.clear()
+        self.assertEqual(Answer.objects.get(pk=alice.pk).acceptable_mask, 0)
+
+    def test_acceptable_percent(self):
+        q, yes, no = self.questions[0]
+        self.assertEqual(q.acceptable_percent(), {yes: 66, no: 33})
+
+    def test_possible_answer_deleted(self):
+        q, yes, no = self.questions[0]
+        maybe = PossibleAnswer.objects.create(question=q, answer="Maybe")
+        bob = Answer.objects.get(profile=self.profiles['bob'], question=q)
+        bob.acceptable_answer.add(maybe)
+        self.assertEqual(Answer.objects.get(pk=bob.pk).acceptable_mask, 7)
+        no.delete()
+        """`maybe` moved to position 1."""
+        self.assertEqual(Answer.objects.get(pk=bob.pk).acceptable_mask, 3)
+
+    def test_reverse_clear(self):
+        q, yes, no = self.questions[0]
+        yes.acceptable_answer.clear()
+        bob = Answer.objects.get(profile=self.profiles['bob'], question=q)
+        self.assertEqual(bob.acceptable_mask, 2)
+        alice = Answer.objects.get(profile=self.profiles['alice'], question=q)
+        self.assertEqual(alice.acceptable_mask, 0)
+
+
+class DealbreakerTest(MatchingTest):
+
+    def setUp(self):
+        super(DealbreakerTest, self).setUp()
+        q, yes, no = self.questions[0]
+        Answer.objects.filter(
+            profile=self.profiles['alice'], question=q
+        ).update(importance='4')
+
+    def test_excluded(self):
+        index = DealbreakerIndex(AnswerMatrix.build())
+        alice = self.profiles['alice']
+        carol = self.profiles['carol']
+        self.assertEqual(list(index.excluded(alice.pk)), [carol.pk])
+        self.assertEqual(list(index.excluded(carol.pk)), [alice.pk])
+        self.assertEqual(list(index.excluded(self.profiles['bob'].pk)), [])
+        self.assertEqual(
+            list(index.prune(alice.pk, [self.profiles['bob'].pk, carol.pk])),
+            [self.profiles['bob'].pk]
+        )
+
+    def test_score(self):
+        matrix = AnswerMatrix.build()
+        alice = self.profiles['alice']
+        carol = self.profiles['carol']
+        ids, scores = matrix.scores(carol.pk, [alice.pk])
+        self.assertEqual(scores[0], 0.0)
+
+
+class ValueLSHTest(MatchingTest):
+
+    def setUp(self):
+        super(ValueLSHTest, self).setUp()
+        for q, yes, no in self.questions:
+            PossibleAnswer.objects.filter(pk=yes.pk).update(value='4')
+            PossibleAnswer.objects.filter(pk=no.pk).update(value='0')
+        indexes._indexes.clear()
+
+    def tearDown(self):
+        indexes._indexes.clear()
+
+    def test_candidates(self):
+        """
+        `alice` and `bob` gave the same answers, so they share all buckets.
+        """
+        index = ValueLSH.build(AnswerMatrix.build(), tables=4, bits=4)
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        candidates = list(index.candidates(alice.pk, limit=1))
+        self.assertEqual(candidates, [bob.pk])
+
+    @override_settings(QUESTIONS_APPROXIMATE_MATCHES=True)
+    def test_best_matches(self):
+        """
+        Without a snapshot, exact matching is used.
+        """
+        matches = best_matches(self.profiles['alice'])
+        self.assertEqual([p.pk for p in matches], [self.profiles['bob'].pk])
+
+    def test_snapshot(self):
+        """
+        With a snapshot, neighbours come from the index, except for profiles
+        that are not in the snapshot yet.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        with override_settings(QUESTIONS_SNAPSHOT_DIR=path,
+                               QUESTIONS_LSH_TABLES=4, QUESTIONS_LSH_BITS=4):
+            write_snapshot(path)
+            matches = approximate_matches(self.profiles['alice'])
+            self.assertEqual(
+                [pk for match, pk in matches], [self.profiles['bob'].pk]
+            )
+            dave = Profile.objects.create(
+                user=User.objects.create(username='dave'), gender='M',
+                is_public=True
+            )
+            self.assertIsNone(approximate_matches(dave))
+
+    def test_no_snapshot(self):
+        """
+        Without a written snapshot there are no indexes, and exact matching
+        is used.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        with override_settings(QUESTIONS_SNAPSHOT_DIR=path,
+                               QUESTIONS_APPROXIMATE_MATCHES=True):
+            self.assertIsNone(dealbreakers())
+            self.assertIsNone(approximate_matches(self.profiles['alice']))
+            matches = best_matches(self.profiles['alice'])
+            self.assertEqual(
+                [p.pk for p in matches], [self.profiles['bob'].pk]
+            )
+
+
+class ProfileIndexTest(MatchingTest):
+
+    def tearDown(self):
+        indexes._indexes.clear()
+
+    def test_compatible(self):
+        alice = self.profiles['alice']
+        index = ProfileIndex.build()
+        self.assertEqual(len(index), 3)
+        self.assertEqual(
+            sorted(index.compatible(alice)),
+            sorted([self.profiles['bob'].pk, self.profiles['carol'].pk])
+        )
+        alice.lookfor = 'M'
+        self.assertEqual(
+            list(index.compatible(alice)), [self.profiles['bob'].pk]
+        )
+        self.assertEqual(list(index.compatible(alice, min_age=18)), [])
+
+    def test_fresh(self):
+        """
+        The index of this process follows saved profiles.
+        """
+        indexes._indexes.clear()
+        index = profiles()
+        bob = self.profiles['bob']
+        bob.is_public = False
+        bob.save()
+        alice = self.profiles['alice']
+        self.assertNotIn(bob.pk, index.compatible(alice))
+        bob.delete()
+        self.assertEqual(len(index), 2)
+
+
+class QuestionStatsTest(MatchingTest):
+
+    def test_count_by_gender(self):
+        """
+        Counts are indexed by position, so large ids take no extra space.
+        """
+        ids = np.array([3, 7, 10 ** 12], dtype=np.int64)
+        counts = count_by_gender(
+            [(3, 'M'), (None, 'F'), (10 ** 12, 'F'), (5, 'M'), (7, 'X')], ids
+        )
+        self.assertEqual(counts.tolist(), [[1, 1, 0], [1, 0, 0], [1, 0, 1]])
+
+    def test_counts(self):
+        """
+        Missing counters are counted from scratch.
+        """
+        q, yes, no = self.questions[0]
+        QuestionStats.objects.filter(question=q).delete()
+        q = Question.objects.get(pk=q.pk)
+        self.assertEqual(q.all_answer_count(), 3)
+        self.assertEqual(q.male_answer_count(), 1)
+        self.assertEqual(q.female_answer_count(), 2)
+        self.assertEqual(q.answer_percent(), {yes: 66, no: 33})
+        self.assertEqual(q.acceptable_percent(), {yes: 66, no: 33})
+
+    def test_incremental(self):
+        """
+        Once counted, changed answers only update the counters.
+        """
+        q, yes, no = self.questions[1]
+        q.statistics()
+        a = self.answer('carol', q, no, [yes])
+        q = Question.objects.get(pk=q.pk)
+        self.assertEqual(q.female_answer_count(), 2)
+        self.assertEqual(q.answer_percent(), {yes: 66, no: 33})
+        self.assertEqual(q.acceptable_percent(), {yes: 100, no: 33})
+
+        a = Answer.objects.get(pk=a.pk)
+        a.user_answer = yes
+        a.save()
+        a.acceptable_answer.clear()
+        q = Question.objects.get(pk=q.pk)
+        self.assertEqual(q.answer_percent(), {yes: 100, no: 0.0})
+        self.assertEqual(q.acceptable_percent(), {yes: 66, no: 33})
+
+        Answer.objects.get(pk=a.pk).delete()
+        q = Question.objects.get(pk=q.pk)
+        self.assertEqual(q.all_answer_count(), 2)
+        self.assertEqual(q.female_answer_count(), 1)
+
+    def test_gender(self):
+        q, yes, no = self.questions[0]
+        q.statistics()
+        bob = Profile.objects.get(pk=self.profiles['bob'].pk)
+        bob.gender = 'F'
+        bob.save()
+        q = Question.objects.get(pk=q.pk)
+        self.assertEqual(q.male_answer_count(), 0)
+        self.assertEqual(q.female_answer_count(), 3)
+
+    def test_with_stats(self):
+        pks = [q.pk for q, yes, no in self.questions]
+        with self.assertNumQueries(2):
+            counts = [
+                (
+                    q.all_answer_count(),
+                    q.male_answer_count(),
+                    q.female_answer_count(),
+                    q.possible_answer_count(),
+                )
+                for q in Question.objects.with_stats().filter(
+                    pk__in=pks).order_by('pk')
+            ]
+        self.assertEqual(counts, [(3, 1, 2, 2), (2, 1, 1, 2)])
+
+    def test_rebuild_stats(self):
+        q, yes, no = self.questions[0]
+        QuestionStats.objects.update(answer_count=0, male_answer_count=7)
+        call_command('rebuild_stats', chunk_size=2)
+        q = Question.objects.get(pk=q.pk)
+        self.assertEqual(q.all_answer_count(), 3)
+        self.assertEqual(q.male_answer_count(), 1)
+        self.assertEqual(q.female_answer_count(), 2)
+        self.assertEqual(q.answer_percent(), {yes: 66, no: 33})
+        self.assertEqual(q.acceptable_percent(), {yes: 66, no: 33})
+
+    def test_acceptance(self):
+        (q0, yes, no), (q1, yes1, no1) = self.questions
+        bob = self.profiles['bob']
+        carol = self.profiles['carol']
+        """`carol` chose no acceptable answers, so accepts everything."""
+        self.assertEqual(q0.male_matches(bob), 1.0)
+        self.assertEqual(q0.female_matches(bob), 1.0)
+        self.assertEqual(q0.female_matches(carol), 0.5)
+        self.assertIsNone(q1.male_matches(carol))
+        self.assertEqual(
+            bob.acceptance(), {q0.pk: (1.0, 1.0), q1.pk: (1.0, 1.0)}
+        )
+        call_command('rebuild_stats')
+        self.assertEqual(
+            bob.acceptance(), {q0.pk: (1.0, 1.0), q1.pk: (1.0, 1.0)}
+        )
+        alice = Answer.objects.get(profile=self.profiles['alice'], question=q0)
+        alice.acceptable_answer.clear()
+        self.assertEqual(q0.female_matches(carol), 1.0)
+
+    def test_accept_all(self):
+        q, yes, no = self.questions[0]
+
+        def accept_all():
+            return QuestionStats.objects.filter(question=q).values_list(
+                'male_accept_all_count', 'female_accept_all_count'
+            ).get()
+
+        self.assertEqual(accept_all(), (0, 1))
+        alice = Answer.objects.get(profile=self.profiles['alice'], question=q)
+        alice.acceptable_answer.clear()
+        self.assertEqual(accept_all(), (0, 2))
+        carol = Answer.objects.get(profile=self.profiles['carol'], question=q)
+        carol.acceptable_answer.add(yes)
+        self.assertEqual(accept_all(), (0, 1))
+        alice.delete()
+        self.assertEqual(accept_all(), (0, 0))
+        call_command('rebuild_stats')
+        self.assertEqual(accept_all(), (0, 0))
+        """`carol` accepted only `yes`, `bob` answered it."""
+        yes.delete()
+        self.assertEqual(accept_all(), (0, 1))
+
+
+class UserAnsweredTagTest(MatchingTest):
+
+    def test_user_answered(self):
+        template = Template(
+            '{% load question %}{% for q in questions %}'
+            '{% user_answered user q as answered %}{{ answered|yesno }} '
+            '{% endfor %}'
+        )
+        context = Context({
+            'user': self.profiles['carol'].user,
+            'questions': [q for q, yes, no in self.questions],
+        })
+        with self.assertNumQueries(1):
+            self.assertEqual(template.render(context), 'yes no ')
+
+
+class CompareTest(MatchingTest):
+
+    def test_compare(self):
+        alice = self.profiles['alice']
+        carol = self.profiles['carol']
+        with self.assertNumQueries(2):
+            rows = compare(alice, carol)
+        self.assertEqual(
+            [row['question'] for row in rows],
+            [q for q, yes, no in self.questions]
+        )
+        shared, alone = rows
+        self.assertFalse(shared['agree'])
+        self.assertFalse(shared['accepts'])
+        self.assertTrue(shared['other_accepts'])
+        self.assertIsNone(alone['other_answer'])
+        self.assertIsNone(alone['accepts'])
+
+    def test_private_answer(self):
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        q, yes, no = self.questions[0]
+        Answer.objects.filter(profile=bob, question=q).update(is_public=False)
+        rows = compare(alice, bob)
+        self.assertEqual([row['question'] for row in rows], [
+            self.questions[1][0], q
+        ])
+        self.assertIsNone(rows[1]['other_answer'])
+        self.assertIsNotNone(rows[1]['answer'])
+        """Own private answers are shown."""
+        self.assertEqual(len(compare(bob, alice)), 2)
+
+    def test_private_profile(self):
+        group, created = Group.objects.get_or_create(name='question')
+        alice = self.profiles['alice']
+        alice.user.groups.add(group)
+        self.client.force_login(alice.user)
+        bob = self.profiles['bob']
+        url = reverse('question:compare', args=[bob.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        bob.is_public = False
+        bob.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class MatchCacheTest(MatchingTest):
+
+    def setUp(self):
+        cache.clear()
+        super(MatchCacheTest, self).setUp()
+
+    def test_match_percent(self):
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        self.assertAlmostEqual(caching.match_percent(alice, bob), 50.0)
+        with self.assertNumQueries(0):
+            self.assertAlmostEqual(caching.match_percent(bob, alice), 50.0)
+
+    def test_answer_changed(self):
+        """
+        Changed answers make cached matches of the profile stale.
+        """
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        caching.match_percent(alice, bob)
+        q, yes, no = self.questions[0]
+        answer = Answer.objects.get(profile=bob, question=q)
+        answer.user_answer = no
+        answer.save()
+        """Stale until the transaction commits."""
+        self.assertAlmostEqual(caching.match_percent(alice, bob), 50.0)
+        run_on_commit()
+        self.assertEqual(
+            caching.match_percent(alice, bob), alice.match_percent(bob)
+        )
+        self.assertNotAlmostEqual(caching.match_percent(alice, bob), 50.0)
+
+    def test_acceptable_changed(self):
+        alice = self.profiles['alice']
+        bob = self.profiles['bob']
+        before = caching.match_percent(alice, bob)
+        q, yes, no = self.questions[0]
+        Answer.objects.get(profile=alice, question=q).acceptable_answer.set(
+            [no]
+        )
+        run_on_commit()
+        after = caching.match_percent(alice, bob)
+        self.assertEqual(after, alice.match_percent(bob))
+        self.assertNotEqual(after, before)
+
+    def test_question_detail(self):
+        """
+        Statistics are cached until the question is answered again.
+        """
+        q, yes, no = self.questions[0]
+        url = reverse('question:question-detail', args=(q.pk,))
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+        self.assertLess(len(second), len(first))
+        self.assertContains(response, '2 Female answers')
+        version = caching.question_version(q.pk)
+        Answer.objects.get(profile=self.profiles['carol'], question=q).delete()
+        """Not bumped before the transaction commits."""
+        self.assertEqual(caching.question_version(q.pk), version)
+        run_on_commit()
+        self.assertNotEqual(caching.question_version(q.pk), version)
+        self.assertContains(self.client.get(url), '1 Female answers')
+
+    def test_question_detail_language(self):
+        """
+        Cached statistics hold translated text, so they are cached per
+        language.
+        """
+        q, yes, no = self.questions[0]
+        url = reverse('question:question-detail', args=(q.pk,))
+        version = caching.question_version(q.pk)
+        with translation.override('de'):
+            self.client.get(url)
+        german, french = [
+            make_template_fragment_key(
+                'question-counts', [q.pk, version, language]
+            ) for language in ('de', 'fr')
+        ]
+        self.assertIsNotNone(cache.get(german))
+        self.assertIsNone(cache.get(french))
+
+    def test_etag(self):
+        q, yes, no = self.questions[0]
+        for url in (
+                reverse('question:question-detail', args=(q.pk,)),
+                reverse('question:api-question-list'),
+                reverse('question:api-question-detail', args=(q.pk,))):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            Answer.objects.get(
+                profile=self.profiles['bob'], question=q
+            ).save()
+            run_on_commit()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        """
+        Question pages are validated by ETag only, as editing the question
+        or its possible answers changes the page without a new answer.
+        """
+        q, yes, no = self.questions[0]
+        url = reverse('question:question-detail', args=(q.pk,))
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        PossibleAnswer.objects.create(question=q, answer="Maybe")
+        run_on_commit()
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_category_etag(self):
+        """Questions show the title of their category."""
+        q, yes, no = self.questions[0]
+        for url in (
+                reverse('question:api-question-list'),
+                reverse('question:api-question-detail', args=(q.pk,))):
+            etag = self.client.get(url)['ETag']
+            category = Category.objects.first()
+            category.title = 'Renamed'
+            category.save()
+            run_on_commit()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+
+class MatchProfileTest(MatchingTest):
+
+    def setUp(self):
+        caching.profile_cache.clear()
+        super(MatchProfileTest, self).setUp()
+
+    def request(self, name):
+        request = RequestFactory().get('/')
+        request.user = self.profiles[name].user
+        return request
+
+    def test_cached(self):
+        alice = self.profiles['alice']
+        request = self.request('alice')
+        self.assertEqual(get_match_profile(request), alice)
+        self.assertEqual(request.match_profile, alice)
+        with self.assertNumQueries(0):
+            profile = get_match_profile(self.request('alice'))
+            self.assertEqual(profile.user.username, 'alice')
+        """Changing the copy does not change the cached profile."""
+        profile.gender = 'M'
+        self.assertEqual(get_match_profile(self.request('alice')).gender, 'F')
+
+    def test_invalidated(self):
+        get_match_profile(self.request('bob'))
+        bob = Profile.objects.get(pk=self.profiles['bob'].pk)
+        bob.gender = 'F'
+        bob.save()
+        self.assertEqual(get_match_profile(self.request('bob')).gender, 'F')
+
+
+class AnswerUpsertTest(MatchingTest):
+
+    def test_upsert(self):
+        carol = self.profiles['carol']
+        q, yes, no = self.questions[1]
+        answer, created = Answer.objects.upsert(
+            carol, q, user_answer=yes, acceptable_answer=[yes],
+            importance='3'
+        )
+        self.assertTrue(created)
+        self.assertEqual(answer.acceptable_mask, 1)
+        again, created = Answer.objects.upsert(
+            carol, q, user_answer=no, acceptable_answer=[yes, no],
+            importance='4'
+        )
+        self.assertFalse(created)
+        self.assertEqual(again.pk, answer.pk)
+        answer = Answer.objects.get(pk=answer.pk)
+        self.assertEqual(answer.user_answer, no)
+        self.assertEqual(answer.importance, '4')
+        self.assertEqual(answer.acceptable_mask, 3)
+        self.assertEqual(
+            sorted(answer.acceptable_answer.values_list('pk', flat=True)),
+            [yes.pk, no.pk]
+        )
+        q = Question.objects.get(pk=q.pk)
+        self.assertEqual(q.answer_percent(), {yes: 66, no: 33})
+        self.assertEqual(q.acceptable_percent(), {yes: 100, no: 66})
+
+    def test_rescore_after_commit(self):
+        carol = self.profiles['carol']
+        q, yes, no = self.questions[1]
+        Answer.objects.upsert(
+            carol, q, user_answer=yes, acceptable_answer=[yes]
+        )
+        self.assertNotIn(
+            carol.pk,
+            dict(MatchList.objects.get(profile=self.profiles['bob']).entries())
+        )
+        run_on_commit()
+        self.assertIn(
+            carol.pk,
+            dict(MatchList.objects.get(profile=self.profiles['bob']).entries())
+        )
+
+
+class AnswerBatchTest(MatchingTest):
+
+    def setUp(self):
+        cache.clear()
+        super(AnswerBatchTest, self).setUp()
+        self.client.force_login(self.profiles['carol'].user)
+        self.url = reverse('question:api-answers-list')
+
+    def post(self, records):
+        return self.client.post(
+            self.url, json.dumps(records), content_type='application/json'
+        )
+
+    def test_batch(self):
+        (q0, yes0, no0), (q1, yes1, no1) = self.questions
+        response = self.post([
+            {'question': q0.pk, 'user_answer': yes0.pk,
+             'acceptable_answer': [yes0.pk]},
+            {'question': q1.pk, 'user_answer': no1.pk,
+             'acceptable_answer': [yes1.pk, no1.pk], 'importance': '4'},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 1, 'updated': 1})
+        carol = self.profiles['carol']
+        answer = Answer.objects.get(profile=carol, question=q1)
+        self.assertEqual(answer.user_answer, no1)
+        self.assertEqual(answer.importance, '4')
+        self.assertEqual(answer.acceptable_mask, 3)
+        self.assertEqual(answer.acceptable_answer.count(), 2)
+        self.assertEqual(
+            Answer.objects.get(profile=carol, question=q0).user_answer, yes0
+        )
+        q1 = Question.objects.get(pk=q1.pk)
+        self.assertEqual(q1.female_answer_count(), 2)
+        self.assertEqual(q1.answer_percent(), {yes1: 66, no1: 33})
+        self.assertEqual(q1.acceptable_percent(), {yes1: 100, no1: 66})
+        run_on_commit()
+        self.assertIn(
+            carol.pk,
+            dict(MatchList.objects.get(profile=self.profiles['bob']).entries())
+        )
+
+    def test_update(self):
+        (q0, yes0, no0), (q1, yes1, no1) = self.questions
+        self.client.force_login(self.profiles['bob'].user)
+        Answer.objects.filter(
+            profile=self.profiles['bob'], question=q0
+        ).update(is_public=False)
+        response = self.post([
+            {'question': q0.pk, 'user_answer': no0.pk,
+             'acceptable_answer': [no0.pk], 'description': 'Changed.'},
+            {'question': q1.pk, 'user_answer': yes1.pk,
+             'acceptable_answer': [yes1.pk, no1.pk], 'importance': '1'},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 0, 'updated': 2})
+        bob = self.profiles['bob']
+        answer = Answer.objects.get(profile=bob, question=q0)
+        self.assertEqual(answer.user_answer, no0)
+        self.assertEqual(answer.description, 'Changed.')
+        """Left out, so unchanged."""
+        self.assertEqual(answer.importance, '3')
+        self.assertFalse(answer.is_public)
+        self.assertEqual(answer.acceptable_mask, 2)
+        self.assertEqual(list(answer.acceptable_answer.all()), [no0])
+        answer = Answer.objects.get(profile=bob, question=q1)
+        self.assertEqual(answer.importance, '1')
+        self.assertEqual(answer.acceptable_mask, 3)
+        q0 = Question.objects.get(pk=q0.pk)
+        self.assertEqual(q0.male_answer_count(), 1)
+        self.assertEqual(q0.answer_percent(), {yes0: 33, no0: 66})
+        self.assertEqual(q0.acceptable_percent(), {yes0: 33, no0: 33})
+        """One rescore, after the transaction."""
+        callbacks = [
+            callback for sids, callback in connection.run_on_commit
+            if isinstance(callback, _Rescore)
+        ]
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(callbacks[0].question_ids, set([q0.pk, q1.pk]))
+
+    def test_possible_answers_cached(self):
+        (q0, yes0, no0), (q1, yes1, no1) = self.questions
+        caching.possible_answer_ids([q0.pk])
+        self.post([{'question': q0.pk, 'user_answer': yes0.pk}])
+        with self.assertNumQueries(0):
+            possible_answers = caching.possible_answer_ids([q0.pk])
+        self.assertEqual(possible_answers, {q0.pk: [yes0.pk, no0.pk]})
+        PossibleAnswer.objects.create(question=q0, answer="Maybe")
+        run_on_commit()
+        self.assertEqual(len(caching.possible_answer_ids([q0.pk])[q0.pk]), 3)
+
+    def test_invalid(self):
+        (q0, yes0, no0), (q1, yes1, no1) = self.questions
+        response = self.post([
+            {'question': q1.pk, 'user_answer': yes0.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        response = self.post([
+            {'question': q1.pk, 'user_answer': yes1.pk},
+            {'question': q1.pk, 'user_answer': no1.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Answer.objects.filter(
+            profile=self.profiles['carol'], question=q1
+        ).exists())
+
+
+class StreamingTest(MatchingTest):
+
+    def setUp(self):
+        super(StreamingTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def roundtrip(self, kind, name, model):
+        path = os.path.join(self.directory, name)
+        call_command('export_data', kind, path, chunk_size=1)
+        model.objects.all().delete()
+        call_command(
+            'import_data', kind, path, chunk_size=1, rebuild=False,
+            stdout=six.StringIO()
+        )
+        return path
+
+    def test_answers(self):
+        for fmt in ('answers.jsonl', 'answers.csv'):
+            self.roundtrip('answers', fmt, Answer)
+            self.assertEqual(Answer.objects.count(), 5)
+            (q0, yes0, no0), (q1, yes1, no1) = self.questions
+            bob = Answer.objects.get(profile=self.profiles['bob'], question=q1)
+            self.assertEqual(bob.user_answer, yes1)
+            self.assertEqual(bob.importance, '3')
+            self.assertEqual(bob.acceptable_mask, 3)
+            self.assertEqual(
+                set(bob.acceptable_answer.all()), set([yes1, no1])
+            )
+
+    def test_import_twice(self):
+        path = os.path.join(self.directory, 'answers.jsonl')
+        call_command('export_data', 'answers', path)
+        out = six.StringIO()
+        call_command('import_data', 'answers', path, stdout=out)
+        self.assertIn('Created 0 answers, skipped 5.', out.getvalue())
+
+    def test_questions(self):
+        for fmt in ('questions.jsonl', 'questions.csv'):
+            self.roundtrip('questions', fmt, Question)
+            self.assertEqual(Question.objects.count(), 2)
+            question = Question.objects.get(question="Cats?")
+            self.assertEqual(
+                [a.answer for a in question.possible_answer.order_by('pk')],
+                ["Yes", "No"]
+            )
+
+    def test_unicode(self):
+        """
+        Lines are text, and non-ASCII text survives both formats.
+        """
+        q, yes, no = self.questions[0]
+        Question.objects.filter(pk=q.pk).update(question=u"Katzen mögen?")
+        PossibleAnswer.objects.filter(pk=yes.pk).update(answer=u"Jä")
+        records = list(export_answers())
+        lines = list(jsonl_lines(records))
+        lines.extend(csv_lines(records, ANSWER_FIELDS))
+        for line in lines:
+            self.assertIsInstance(line, six.text_type)
+        for fmt in ('questions.jsonl', 'questions.csv'):
+            self.roundtrip('questions', fmt, Question)
+            question = Question.objects.get(question=u"Katzen mögen?")
+            self.assertEqual(
+                [a.answer for a in question.possible_answer.order_by('pk')],
+                [u"Jä", "No"]
+            )
+
+    def test_natural_key(self):
+        alice = self.profiles['alice']
+        self.assertEqual(
+            Profile.objects.get_by_natural_key(*alice.natural_key()), alice
+        )
+
+
+class AnswerQuestionTest(MatchingTest):
+
+    def setUp(self):
+        super(AnswerQuestionTest, self).setUp()
+        group, created = Group.objects.get_or_create(name='question')
+        self.profiles['carol'].user.groups.add(group)
+        self.client.force_login(self.profiles['carol'].user)
+
+    def test_form(self):
+        """The mask is derived from the acceptable answers."""
+        self.assertNotIn('acceptable_mask', AnswerQuestionForm.base_fields)
+
+    def test_post(self):
+        q, yes, no = self.questions[1]
+        url = reverse('question:answer-question', args=(q.pk,))
+        data = {
+            'user_answer': yes.pk,
+            'acceptable_answer': [yes.pk, no.pk],
+            'importance': '3',
+            'is_public': 'on',
+            'description': '',
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        answer = Answer.objects.get(profile=self.profiles['carol'], question=q)
+        self.assertEqual(answer.user_answer, yes)
+        self.assertEqual(answer.acceptable_mask, 3)
+        data['acceptable_answer'] = [no.pk]
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        answer = Answer.objects.get(profile=self.profiles['carol'], question=q)
+        self.assertEqual(answer.acceptable_mask, 2)
+
+
+class ProfileAnswerExportTest(MatchingTest):
+
+    def setUp(self):
+        super(ProfileAnswerExportTest, self).setUp()
+        group, created = Group.objects.get_or_create(name='question')
+        for profile in self.profiles.values():
+            profile.user.groups.add(group)
+        self.client.force_login(self.profiles['bob'].user)
+        self.url = reverse(
+            'question:profile-export', args=[self.profiles['bob'].pk]
+        )
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0].split(','), list(ANSWER_FIELDS))
+        self.assertEqual(len(lines), 3)
+        self.assertIn('Cats?', lines[1])
+
+    def test_jsonl(self):
+        (q0, yes0, no0), (q1, yes1, no1) = self.questions
+        response = self.client.get(self.url, {'format': 'jsonl'})
+        """One query for the answers and one for acceptable answers."""
+        with self.assertNumQueries(2):
+            records = [
+                json.loads(line)
+                for line in self.content(response).splitlines()
+            ]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1]['question_text'], 'Dogs?')
+        self.assertEqual(records[1]['user_answer'], 'Yes')
+        self.assertEqual(records[1]['acceptable_answer'], ['Yes', 'No'])
+        self.assertEqual(records[1]['importance'], '3')
+
+    def test_other_profile(self):
+        url = reverse(
+            'question:profile-export', args=[self.profiles['alice'].pk]
+        )
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class AnalyticsExportTest(MatchingTest):
+
+    def setUp(self):
+        super(AnalyticsExportTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'answers.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        bob = self.profiles['bob']
+        bob.dob = date(date.today().year - 30, 1, 1)
+        bob.save()
+        call_command(
+            'export_analytics', self.path, chunk_size=2, seed=1,
+            stdout=six.StringIO()
+        )
+        data = np.load(self.path)
+        self.assertEqual(len(data['gender']), 3)
+        self.assertEqual(len(data['answer']), 5)
+        self.assertEqual(list(data['question_text']), ['Cats?', 'Dogs?'])
+        self.assertEqual(list(data['possible_answer_text']), ['Yes', 'No'] * 2)
+
+        """Find bob as the only male profile."""
+        row = list(data['gender']).index(GENDER_CODES['M'])
+        self.assertEqual(
+            data['age_bucket'][row],
+            np.searchsorted(AGE_BUCKETS, 30, side='right')
+        )
+        mine = data['answer_row'] == row
+        self.assertEqual(list(data['answer_column'][mine]), [0, 1])
+        self.assertEqual(list(data['answer'][mine]), [0, 0])
+        self.assertEqual(list(data['acceptable'][mine]), [3, 3])
+        self.assertNotIn('profile_ids', data.files)
+
+    def test_private(self):
+        """Private answers are not exported."""
+        q, yes, no = self.questions[0]
+        Answer.objects.filter(
+            profile=self.profiles['carol'], question=q
+        ).update(is_public=False)
+        call_command('export_analytics', self.path, stdout=six.StringIO())
+        data = np.load(self.path)
+        self.assertEqual(len(data['gender']), 3)
+        self.assertEqual(len(data['answer']), 4)